@@ -0,0 +1,22 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client-side benchmarks. Run each from the repository root, for example:
+
+    python -m bench.codec_bench
+    python -m bench.sql_bench --rows 10000,1000000
+
+`payloads` generates the canned payloads the benchmarks share.
+"""
@@ -0,0 +1,74 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the JSON codecs on representative response payloads.
+
+    python -m bench.codec_bench [--rows N] [--repeat N]
+
+Reports, for each payload shape and each installed codec, the best time
+to decode the payload, the decode throughput, and the speedup over the
+stdlib codec.
+"""
+
+import argparse
+import json
+import time
+from druid_client.client.codec import codecs
+from . import payloads
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def installed_codecs():
+    found = []
+    for name, cls in codecs.items():
+        try:
+            found.append(cls())
+        except ImportError:
+            pass
+    return found
+
+def run(rows, repeat):
+    shapes = [
+        ('sql object', payloads.object_payload(rows)),
+        ('sql array', payloads.array_payload(rows)),
+        ('sys.segments', payloads.segments_payload(rows)),
+        ]
+    print('{:<14} {:<8} {:>10} {:>10} {:>10} {:>8}'.format('payload', 'codec', 'size (KB)', 'decode ms', 'MB/s', 'speedup'))
+    for label, payload in shapes:
+        data = json.dumps(payload).encode('utf-8')
+        baseline = None
+        for codec in installed_codecs():
+            secs = best_time(lambda: codec.loads(data), repeat)
+            if baseline is None:
+                baseline = secs
+            print('{:<14} {:<8} {:>10.0f} {:>10.2f} {:>10.1f} {:>7.1f}x'.format(
+                label, codec.name, len(data) / 1024, secs * 1000, len(data) / secs / 1e6, baseline / secs))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JSON codecs.')
+    parser.add_argument('--rows', type=int, default=100000, help='rows per payload')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per codec')
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generators of representative Druid response payloads.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+CHANNELS = ['#en.wikipedia', '#de.wikipedia', '#fr.wikipedia', '#ja.wikipedia', '#ru.wikipedia']
+COLUMNS = ['__time', 'channel', 'page', 'user', 'added', 'deleted', 'delta', 'isRobot', 'comment']
+
+def sql_rows(count, seed=42):
+    """
+    Returns `count` rows, as dictionaries, shaped like a SQL query on the
+    Druid tutorial `wikipedia` table: a timestamp, strings of several
+    cardinalities, longs, a double and some nulls.
+    """
+    rnd = random.Random(seed)
+    start = datetime(2016, 6, 27)
+    rows = []
+    for i in range(count):
+        ts = start + timedelta(milliseconds=i * 997)
+        rows.append({
+            '__time': ts.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(ts.microsecond // 1000),
+            'channel': rnd.choice(CHANNELS),
+            'page': 'Page {}'.format(rnd.randrange(count // 4 + 1)),
+            'user': 'user{}'.format(rnd.randrange(1000)),
+            'added': rnd.randrange(5000),
+            'deleted': rnd.randrange(500),
+            'delta': rnd.uniform(-1000, 1000),
+            'isRobot': rnd.random() < 0.2,
+            'comment': None if rnd.random() < 0.3 else 'edit comment {}'.format(i),
+            })
+    return rows
+
+def object_payload(count, seed=42):
+    """
+    Returns a SQL `object` format payload: a list of dictionaries.
+    """
+    return sql_rows(count, seed)
+
+def array_payload(count, seed=42, header=True):
+    """
+    Returns a SQL `array` format payload, with a header row of column names
+    if `header` is set.
+    """
+    rows = [[row[c] for c in COLUMNS] for row in sql_rows(count, seed)]
+    return ([COLUMNS] if header else []) + rows
+
+def segments_payload(count, seed=42):
+    """
+    Returns rows shaped like `SELECT * FROM sys.segments`: long strings,
+    nested JSON text and many columns.
+    """
+    rnd = random.Random(seed)
+    start = datetime(2022, 1, 1)
+    rows = []
+    for i in range(count):
+        day = start + timedelta(days=i // 8)
+        interval_start = day.strftime('%Y-%m-%dT00:00:00.000Z')
+        interval_end = (day + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00.000Z')
+        version = '2022-06-01T12:{:02d}:00.000Z'.format(rnd.randrange(60))
+        rows.append({
+            'segment_id': 'wikipedia_{}_{}_{}_{}'.format(interval_start, interval_end, version, i % 8),
+            'datasource': 'wikipedia',
+            'start': interval_start,
+            'end': interval_end,
+            'size': rnd.randrange(1000000, 500000000),
+            'version': version,
+            'partition_num': i % 8,
+            'num_replicas': 2,
+            'num_rows': rnd.randrange(100000, 5000000),
+            'is_published': 1,
+            'is_available': 1,
+            'is_realtime': 0,
+            'is_overshadowed': 0,
+            'shard_spec': '{"type":"numbered","partitionNum":%d,"partitions":8}' % (i % 8),
+            'dimensions': '["channel","page","user","comment","isRobot"]',
+            'metrics': '["added","deleted","delta"]',
+            'last_compaction_state': None,
+            })
+    return rows
+
+#-------- SQL result payloads --------
+
+SQL_TYPES = {
+    '__time': ('LONG', 'TIMESTAMP'),
+    'channel': ('STRING', 'VARCHAR'),
+    'page': ('STRING', 'VARCHAR'),
+    'user': ('STRING', 'VARCHAR'),
+    'added': ('LONG', 'BIGINT'),
+    'deleted': ('LONG', 'BIGINT'),
+    'delta': ('DOUBLE', 'DOUBLE'),
+    'isRobot': ('STRING', 'VARCHAR'),
+    'comment': ('STRING', 'VARCHAR'),
+    }
+
+NARROW_COLUMNS = ['__time', 'channel', 'added']
+
+# Extra columns of the wide shape: sparse dimensions (mostly null, some
+# entirely so) and dense metrics, as in a table with a flattened schema.
+WIDE_DIMS = 25
+WIDE_METRICS = 26
+
+def wide_columns():
+    return (COLUMNS
+        + ['dim_{}'.format(i) for i in range(WIDE_DIMS)]
+        + ['metric_{}'.format(i) for i in range(WIDE_METRICS)])
+
+def column_types(name):
+    if name.startswith('dim_'):
+        return ('STRING', 'VARCHAR')
+    if name.startswith('metric_'):
+        return ('DOUBLE', 'DOUBLE') if int(name[7:]) % 2 else ('LONG', 'BIGINT')
+    return SQL_TYPES[name]
+
+def shape_columns(shape):
+    if shape == 'narrow':
+        return NARROW_COLUMNS
+    if shape == 'wide':
+        return wide_columns()
+    raise ValueError("Unknown shape: " + shape)
+
+def shape_rows(shape, count, seed=42):
+    """
+    Returns `count` rows, as lists of values, for the `narrow` (3 column)
+    or `wide` (60 column) shape.
+    """
+    columns = shape_columns(shape)
+    base = sql_rows(count, seed)
+    if shape == 'narrow':
+        return [[row[c] for c in columns] for row in base]
+    rnd = random.Random(seed + 1)
+    rows = []
+    for row in base:
+        values = [row[c] for c in COLUMNS]
+        for i in range(WIDE_DIMS):
+            # Odd dimensions are always null.
+            values.append('value {}'.format(rnd.randrange(100)) if i % 2 == 0 and rnd.random() < 0.3 else None)
+        for i in range(WIDE_METRICS):
+            values.append(rnd.uniform(0, 1000) if i % 2 else rnd.randrange(100000))
+        rows.append(values)
+    return rows
+
+def sql_payload(shape, fmt, count, seed=42):
+    """
+    Returns a SQL result payload, as Druid would return it for the given
+    result format ('object', 'array' or 'arrayWithTrailer'). The array
+    formats have the three header rows: names, Druid types and SQL types.
+    """
+    columns = shape_columns(shape)
+    rows = shape_rows(shape, count, seed)
+    if fmt == 'object':
+        return [dict(zip(columns, row)) for row in rows]
+    headers = [
+        columns,
+        [column_types(c)[0] for c in columns],
+        [column_types(c)[1] for c in columns],
+        ]
+    if fmt == 'array':
+        return headers + rows
+    if fmt == 'arrayWithTrailer':
+        return {'results': headers + rows, 'context': {'rowCount': count}}
+    raise ValueError("Unknown format: " + fmt)
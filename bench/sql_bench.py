@@ -0,0 +1,304 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmarks for SQL result parsing and rendering.
+
+    python -m bench.sql_bench [--rows 10000,100000] [--shapes narrow,wide]
+        [--formats object,array,arrayWithTrailer] [--cases parse_rows,...]
+        [--repeat 3] [--table-rows 10000] [--save results.json]
+        [--compare baseline.json] [--tolerance 0.2] [--codec orjson]
+
+Runs each case over canned payloads (see `payloads.sql_payload()`) of each
+size, shape (narrow: 3 columns; wide: 60 columns) and result format, and
+reports the best time of `--repeat` runs, the throughput in rows per
+second and the peak memory allocated by the case, as measured by
+`tracemalloc` in a separate, untimed run.
+
+The cases are:
+
+* `decode`: decoding the response payload (`SqlQueryResult.json()`).
+* `parse_rows`, `parse_schema`: on the decoded payload.
+* `as_array`: rows as lists, from a result whose rows are parsed.
+* `filter_null_cols`: on object rows (`object` format only).
+* `df`: `SqlQueryResult.df()` from the raw response. Requires Pandas.
+* `text_table`, `html_table`: formatting at most `--table-rows` rows.
+
+Payloads are decoded with the codec a client would use (the fastest
+installed) unless `--codec` names one.
+
+Use `--save` to record a baseline, and `--compare` to check a later run
+against it: cases slower than the baseline by more than the tolerance,
+and by more than `--min-ms`, are flagged, and the exit status is 1.
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from druid_client.client import consts
+from druid_client.client.codec import resolve_codec
+from druid_client.client.sql import SqlRequest, SqlQueryResult, parse_rows, parse_schema
+from druid_client.client.text_table import TextTable
+from druid_client.client.html_table import HtmlTable
+from druid_client.client.util import filter_null_cols
+from . import payloads
+
+FORMATS = [consts.SQL_OBJECT, consts.SQL_ARRAY, consts.SQL_ARRAY_WITH_TRAILER]
+SHAPES = ['narrow', 'wide']
+CASES = ['decode', 'parse_rows', 'parse_schema', 'as_array', 'filter_null_cols', 'df', 'text_table', 'html_table']
+
+class CannedResponse:
+    """
+    A successful HTTP response with a fixed payload, standing in for
+    the `requests` response.
+    """
+
+    def __init__(self, content):
+        self.status_code = 200
+        self.headers = {consts.SQL_QUERY_ID_HEADER: 'bench'}
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+class BenchClient:
+    """
+    Stands in for the client of a request: provides the JSON codec.
+    """
+
+    def __init__(self, codec):
+        self.cluster_config = self
+        self.codec = codec
+
+class Payload:
+    """
+    A canned payload for one shape, format and row count.
+    """
+
+    def __init__(self, shape, fmt, rows, client):
+        self.shape = shape
+        self.fmt = fmt
+        self.rows = rows
+        self.client = client
+        self.columns = payloads.shape_columns(shape)
+        self.content = json.dumps(payloads.sql_payload(shape, fmt, rows)).encode('utf-8')
+        self.decoded = client.codec.loads(self.content)
+
+    def request(self):
+        request = SqlRequest(self.client, 'SELECT * FROM wikipedia').with_format(self.fmt)
+        if self.fmt != consts.SQL_OBJECT:
+            request.with_headers(sqlTypes=True, druidTypes=True)
+        return request
+
+    def result(self, parsed=False):
+        result = SqlQueryResult(self.request(), CannedResponse(self.content))
+        if parsed:
+            result.rows()
+        return result
+
+    def context(self):
+        return self.request().header_context()
+
+#-------- Cases --------
+
+# Each case function, given a payload, returns (setup, run): `setup()`
+# builds the input, untimed; `run(input)` is the timed work. A case
+# returns `None` if it does not apply to the payload.
+
+def case_decode(p):
+    return lambda: p.result(), lambda result: result.json()
+
+def case_parse_rows(p):
+    ctx = p.context()
+    return lambda: p.decoded, lambda decoded: parse_rows(p.fmt, ctx, decoded)
+
+def case_parse_schema(p):
+    ctx = p.context()
+    return lambda: p.decoded, lambda decoded: parse_schema(p.fmt, ctx, decoded)
+
+def case_as_array(p):
+    return lambda: p.result(parsed=True), lambda result: result.as_array()
+
+def case_filter_null_cols(p):
+    if p.fmt != consts.SQL_OBJECT:
+        return None
+    return lambda: p.result(parsed=True).rows(), filter_null_cols
+
+def case_df(p):
+    try:
+        import pandas
+    except ImportError:
+        return None
+    return lambda: p.result(), lambda result: result.df()
+
+def table_case(p, table_rows, cls):
+    def setup():
+        rows = p.result(parsed=True).as_array()[:table_rows]
+        table = cls()
+        table.headers(p.columns)
+        return table, rows
+    return setup, lambda args: args[0].format(args[1])
+
+CASE_FNS = {
+    'decode': case_decode,
+    'parse_rows': case_parse_rows,
+    'parse_schema': case_parse_schema,
+    'as_array': case_as_array,
+    'filter_null_cols': case_filter_null_cols,
+    'df': case_df,
+    }
+
+def make_case(name, payload, table_rows):
+    if name == 'text_table':
+        return table_case(payload, table_rows, TextTable)
+    if name == 'html_table':
+        return table_case(payload, table_rows, HtmlTable)
+    return CASE_FNS[name](payload)
+
+#-------- Measurement --------
+
+def best_time(setup, run, repeat):
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def peak_memory(setup, run):
+    """
+    Returns the peak bytes allocated while running the case once, above
+    the memory in use at its start.
+    """
+    arg = setup()
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = run(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak - base
+
+def run_case(name, payload, repeat, table_rows):
+    case = make_case(name, payload, table_rows)
+    if case is None:
+        return None
+    setup, run = case
+    secs = best_time(setup, run, repeat)
+    rows = min(payload.rows, table_rows) if name.endswith('_table') else payload.rows
+    return {
+        'case': name,
+        'shape': payload.shape,
+        'format': payload.fmt,
+        'rows': rows,
+        'payload_bytes': len(payload.content),
+        'secs': secs,
+        'rows_per_sec': rows / secs if secs > 0 else None,
+        'peak_bytes': peak_memory(setup, run),
+        }
+
+def key(result):
+    return "{case}/{shape}/{format}/{rows}".format(**result)
+
+def print_result(result, baseline=None):
+    line = '{:<17} {:<7} {:<17} {:>9} {:>10.2f} {:>12.0f} {:>10.1f}'.format(
+        result['case'], result['shape'], result['format'], result['rows'],
+        result['secs'] * 1000, result['rows_per_sec'] or 0, result['peak_bytes'] / 2**20)
+    if baseline is not None:
+        line += ' {:>+8.0%}'.format(result['secs'] / baseline['secs'] - 1)
+    print(line)
+
+def regressions(results, baseline, tolerance, min_secs):
+    """
+    Returns the results slower than their baseline by more than the
+    relative `tolerance` and by more than `min_secs`, which keeps timer
+    noise on sub-millisecond cases from being reported.
+    """
+    slower = []
+    for result in results:
+        base = baseline.get(key(result))
+        if base is None:
+            continue
+        if result['secs'] > base['secs'] * (1 + tolerance) and result['secs'] - base['secs'] > min_secs:
+            slower.append(result)
+    return slower
+
+def split(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SQL result parsing and rendering.')
+    parser.add_argument('--rows', default='10000,100000', help='comma-separated row counts, up to millions')
+    parser.add_argument('--shapes', default=','.join(SHAPES), help='narrow, wide')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='object, array, arrayWithTrailer')
+    parser.add_argument('--cases', default=','.join(CASES), help='cases to run')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--table-rows', type=int, default=10000, help='rows formatted by the table cases')
+    parser.add_argument('--save', help='write the results, as JSON, to this file')
+    parser.add_argument('--compare', help='baseline results file from --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='ignore slowdowns smaller than this')
+    parser.add_argument('--codec', help='JSON codec: json, orjson or ujson')
+    args = parser.parse_args()
+
+    client = BenchClient(resolve_codec(args.codec))
+    cases = split(args.cases)
+    for name in cases:
+        if name not in CASES:
+            parser.error("Unknown case: " + name)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = {key(r): r for r in json.load(f)}
+
+    print('{:<17} {:<7} {:<17} {:>9} {:>10} {:>12} {:>10}{}'.format(
+        'case', 'shape', 'format', 'rows', 'ms', 'rows/s', 'peak MB',
+        '' if baseline is None else '   change'))
+    results = []
+    for rows in [int(r) for r in split(args.rows)]:
+        for shape in split(args.shapes):
+            for fmt in split(args.formats):
+                payload = Payload(shape, fmt, rows, client)
+                for name in cases:
+                    result = run_case(name, payload, args.repeat, args.table_rows)
+                    if result is None:
+                        continue
+                    results.append(result)
+                    print_result(result, None if baseline is None else baseline.get(key(result)))
+                del payload
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline is not None:
+        slower = regressions(results, baseline, args.tolerance, args.min_ms / 1000)
+        for result in slower:
+            print('REGRESSION: {} is {:.0%} slower than the baseline'.format(
+                key(result), result['secs'] / baseline[key(result)]['secs'] - 1))
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,7 @@ for details of the API. The API detail docstrings are courtesy of this page.
 
 from .client.config import ClusterConfig
 from .client.client import Client
+from .client.async_client import AsyncClient
 
 def connect(url, **kwargs):
     """
@@ -67,5 +68,72 @@ def connect(url, **kwargs):
     tls_cert : string, default = None
         Path to a certificate for a private TLS key used for private
         connections within your own cluser or data center.
+
+    result_cache : ResultCache, default = None
+        Optional cache for SQL query results. See
+        `druid_client.client.cache.ResultCache`.
+
+    topology_ttl : float, default = 30
+        Seconds for which the list of cluster services is cached before
+        it is refreshed in the background.
+
+    pool_size : int, default = 10
+        Number of HTTP connections kept open to each Druid node. All the
+        clients for a node share one connection pool.
+
+    pool_block : bool, default = False
+        If `True`, `pool_size` is also the maximum number of concurrent
+        connections to each node.
+
+    keep_alive : bool, default = True
+        If `False`, connections are closed after each request.
+
+    retry : RetryPolicy, default = RetryPolicy()
+        Policy for retrying idempotent requests after transient failures,
+        or `None` to disable retries. See `druid_client.client.retry`.
+
+    query_retry : QueryRetryPolicy, default = QueryRetryPolicy()
+        Policy for retrying queries which Druid rejects for transient
+        reasons, such as "Query capacity exceeded", or `None` to disable.
+
+    circuit_breaker : bool, default = True
+        If `True`, requests to a node fail fast after repeated failures.
+
+    codec : str, default = None
+        JSON library used to encode requests and decode responses:
+        'orjson', 'ujson' or 'json'. By default, the fastest installed.
+
+    compression : bool, default = True
+        If `True`, asks Druid to gzip or deflate responses.
+
+    compress_min_size : int, default = None
+        Request bodies of at least this many bytes are sent gzipped.
+        `None` sends all request bodies uncompressed.
+
+    metrics : bool, default = True
+        If `True`, keeps per-endpoint request metrics, available from
+        `client.metrics()`.
+
+    hooks : list, default = []
+        Request hooks called for each HTTP request. See
+        `druid_client.client.metrics.RequestHook`.
+
+    tracing : exporter or list, default = None
+        Span exporters, such as `InMemoryExporter()` or
+        `JsonLinesExporter(path)`. Tracing is off if not set. See
+        `druid_client.client.tracing`.
     """
     return Client(ClusterConfig(kwargs), url)
+
+def connect_async(url, **kwargs):
+    """
+    Connect to a Druid server using an asynchronous (`asyncio`) client.
+
+    Takes the same arguments as `connect()`, plus:
+
+    async_limit : int, default = 100
+        Maximum number of concurrent connections for each service client.
+
+    Requires that `aiohttp` be installed.
+    """
+    return AsyncClient(ClusterConfig(kwargs), url)
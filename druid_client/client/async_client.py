@@ -0,0 +1,205 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import requests
+from .async_service import AsyncService, check_async_error
+from . import consts
+from .client import (
+    Client, DEFAULT_MAX_CONCURRENCY, DEFAULT_PAGE_SIZE,
+    REQ_ROUTER_SQL, REQ_ROUTER_SQL_CANCEL, REQ_ROUTER_QUERY, REQ_ROUTER_QUERY_CANCEL)
+from .error import ClientError, QueryTimeoutError
+from .sql import SqlQueryResult, FailedQueryResult, QueryPlan
+from .native import NativeQueryResult, native_query_for
+from .util import is_blank
+from .display import Display
+
+class AsyncClient(AsyncService, Client):
+    """
+    Coroutine-based version of the Druid query client.
+
+    The query methods (`sql_query()`, `sql()`, `explain_sql()`,
+    `sql_many()`, `sql_sliced()`, `native_query()`) are coroutines, and
+    `sql_as_completed()` is an async generator. Use `sql_many()`,
+    `asyncio.gather()` or similar to keep many queries in flight on one
+    event loop:
+
+        client = dcl.connect_async("http://localhost:8888")
+        results = await client.sql_many(queries)
+
+    Streamed results (`sql_stream()`, `native_stream()` and so scan
+    queries' `run()`), `sql_pages()` and `show()` are not supported: run a
+    scan query with `await client.native_query(query)`.
+
+    Cluster discovery (`cluster()`, `metadata()`, `table()`) remains
+    synchronous: use `cluster().async_coordinator()` and similar to
+    obtain asynchronous clients for the other roles.
+    """
+
+    def __init__(self, cluster_config, endpoint):
+        AsyncService.__init__(self, cluster_config, endpoint)
+        self._query_client = None
+        self._extn_cache = {}
+        if getattr(self.cluster_config, 'display', None) is None:
+            self.cluster_config.display = Display()
+        self._reports = None
+
+    #-------- Query --------
+
+    async def sql_query(self, request) -> SqlQueryResult:
+        '''
+        Coroutine version of `Client.sql_query()`.
+        '''
+        request, query_obj = self._prepare_query(request)
+        cache = self.cluster_config.result_cache if request.use_cache else None
+        if cache is not None:
+            result = cache.get(request)
+            if result is not None:
+                return result
+        post = self.post_only_json(REQ_ROUTER_SQL, query_obj, headers=request.headers)
+        try:
+            r = await asyncio.wait_for(post, request.timeout)
+        except asyncio.TimeoutError:
+            try:
+                await self.cancel_sql(request.query_id)
+            except Exception:
+                pass
+            raise QueryTimeoutError("Query did not complete within {} seconds".format(request.timeout), request.query_id)
+        result = SqlQueryResult(request, r)
+        if cache is not None:
+            cache.put(request, result)
+        return result
+
+    async def _safe_sql_query(self, request, semaphore) -> SqlQueryResult:
+        async with semaphore:
+            try:
+                return await self.sql_query(request)
+            except Exception as e:
+                if type(request) == str:
+                    request = self.sql_request(request)
+                return FailedQueryResult(request, e)
+
+    async def sql_many(self, requests, max_concurrency=DEFAULT_MAX_CONCURRENCY) -> list:
+        '''
+        Coroutine version of `Client.sql_many()`: runs the queries with at
+        most `max_concurrency` in flight, and returns the results in the
+        same order as the requests.
+        '''
+        semaphore = asyncio.Semaphore(max_concurrency)
+        return await asyncio.gather(*[self._safe_sql_query(r, semaphore) for r in requests])
+
+    async def sql_as_completed(self, requests, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        '''
+        Async generator version of `Client.sql_as_completed()`: yields
+        `(index, result)` pairs as each query completes.
+        '''
+        semaphore = asyncio.Semaphore(max_concurrency)
+        async def indexed(i, request):
+            return i, await self._safe_sql_query(request, semaphore)
+        tasks = [asyncio.ensure_future(indexed(i, r)) for i, r in enumerate(requests)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def sql_sliced(self, request, start, end, grain=consts.DAY_GRAIN, merge=None,
+            max_slices=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, time_col=consts.TIME_COL):
+        '''
+        Coroutine version of `Client.sql_sliced()`.
+        '''
+        from .slicing import SlicedQueryResult, slice_requests
+        slices, requests = slice_requests(self, request, start, end, grain, merge, max_slices, time_col)
+        results = await self.sql_many(requests, max_concurrency=max_concurrency)
+        return SlicedQueryResult(slices, results, merge)
+
+    def sql_pages(self, request, page_size=DEFAULT_PAGE_SIZE, order_key=consts.TIME_COL, prefetch=True):
+        raise ClientError("Paged results are not supported by the async client.")
+
+    async def cancel_sql(self, query_id) -> bool:
+        '''
+        Coroutine version of `Client.cancel_sql()`.
+        '''
+        r = await self.delete(REQ_ROUTER_SQL_CANCEL, args=[query_id])
+        if r.status_code == requests.codes.not_found:
+            return False
+        check_async_error(r)
+        return True
+
+    def sql_stream(self, request, chunk_size=None):
+        raise ClientError("Streaming results are not supported by the async client.")
+
+    async def native_query(self, query) -> NativeQueryResult:
+        '''
+        Coroutine version of `Client.native_query()`.
+        '''
+        query = native_query_for(self, query)
+        post = self.post_only_json(REQ_ROUTER_QUERY, query.to_request())
+        try:
+            r = await asyncio.wait_for(post, query.timeout)
+        except asyncio.TimeoutError:
+            try:
+                await self.cancel_native(query.query_id)
+            except Exception:
+                pass
+            raise QueryTimeoutError("Query did not complete within {} seconds".format(query.timeout), query.query_id)
+        return NativeQueryResult(query, r)
+
+    async def cancel_native(self, query_id) -> bool:
+        '''
+        Coroutine version of `Client.cancel_native()`.
+        '''
+        r = await self.delete(REQ_ROUTER_QUERY_CANCEL, args=[query_id])
+        if r.status_code == requests.codes.not_found:
+            return False
+        check_async_error(r)
+        return True
+
+    def native_stream(self, query, chunk_size=None):
+        raise ClientError("Streaming results are not supported by the async client.")
+
+    async def sql(self, sql, *args):
+        if len(args) > 0:
+            sql = sql.format(*args)
+        resp = await self.sql_query(sql)
+        resp.raise_for_error()
+        return resp.rows()
+
+    async def explain_sql(self, query) -> QueryPlan:
+        if is_blank(query):
+            raise ClientError("No query provided.")
+        results = await self.sql('EXPLAIN PLAN FOR ' + query)
+        return QueryPlan(results[0])
+
+    #-------- Cluster Services --------
+
+    def cluster(self):
+        """
+        Returns the (synchronous) cluster, bootstrapped from a synchronous
+        client for this endpoint.
+        """
+        if self.cluster_config.cluster is None:
+            from ..cluster.cluster import Cluster
+            Cluster(Client(self.cluster_config, self.endpoint))
+        return self.cluster_config.cluster
+
+    def show(self):
+        raise ClientError("Reports are not supported by the async client: use the synchronous client.")
+
+    #-------- Misc. --------
+
+    async def version(self):
+        status = await self.status()
+        return status.get('version')
@@ -0,0 +1,237 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from .metrics import RequestEvent, body_size, fire_before, fire_after
+from .retry import TRANSIENT_STATUS_CODES
+from .service import (
+    Service, is_ok_status, error_reason,
+    REQ_STATUS, REQ_HEALTH, REQ_PROPERTIES, REQ_IN_CLUSTER)
+from .util import dict_get
+
+class AsyncResponse:
+    """
+    A fully-read response from an asynchronous request.
+
+    Provides the subset of the `requests` `Response` protocol used
+    by the rest of the library (`status_code`, `headers`, `text`,
+    `json()`) so that result classes such as `SqlQueryResult` work
+    with either kind of response.
+    """
+
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.content.decode('utf-8', errors='replace')
+        return self._text
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncRestError(Exception):
+    """
+    Raised when an asynchronous REST call returns an error status.
+
+    The `json` field holds the JSON error payload, if any.
+    """
+
+    def __init__(self, response, msg, json=None):
+        self.response = response
+        self.status_code = response.status_code
+        self.message = msg
+        self.json = json
+
+    def __str__(self):
+        return "{} Error: {} for url: {}".format(self.status_code, self.message, self.response.url)
+
+def check_async_error(response):
+    """
+    Asynchronous analog of `check_error()`: raises an `AsyncRestError`
+    if the response code is not OK or Accepted.
+    """
+    code = response.status_code
+    if is_ok_status(code):
+        return
+    json = None
+    try:
+        json = response.json()
+    except Exception:
+        pass
+    error = error_reason(code, json)
+    if error is None:
+        error = response.reason
+    raise AsyncRestError(response, error, json)
+
+class AsyncService(Service):
+    """
+    Coroutine-based version of `Service` built on `aiohttp`.
+
+    Each REST method is a coroutine which returns the same value as the
+    synchronous version. The role clients (`AsyncCoordinator`, `AsyncOverlord`,
+    etc.) combine this class with the synchronous role class so that role
+    methods which simply return `self.get_json(...)` or `self.post_json(...)`
+    return awaitables. Role methods which do more with the response are
+    overridden as coroutines.
+
+    Requests report to the request hooks and metrics, and honor the
+    endpoint's circuit breaker, as for `Service`. Failed requests are not
+    retried, though: neither the `retry` policy nor the `query_retry`
+    policy applies to asynchronous requests.
+
+    A single `aiohttp` session, with a connection pool bounded by the
+    `async_limit` cluster option, is created on first use and so must
+    be used from the event loop on which it was created. Call `close()`
+    (a coroutine) when done.
+    """
+
+    def __init__(self, cluster_config, endpoint):
+        self.cluster_config = cluster_config
+        self.endpoint = endpoint
+        self._session = None
+
+    def _http(self):
+        if self._session is None:
+            import aiohttp
+            ssl = None
+            if self.cluster_config.tls_cert is not None:
+                import ssl as ssl_lib
+                ssl = ssl_lib.create_default_context(cafile=self.cluster_config.tls_cert)
+            connector = aiohttp.TCPConnector(
+                limit=self.cluster_config.async_limit,
+                ssl=ssl)
+            headers = {'Accept-Encoding': self.cluster_config.sessions.accept_encoding}
+            self._session = aiohttp.ClientSession(connector=connector, headers=headers)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    #-------- REST --------
+
+    async def _send(self, method, url, template=None, body=None, **kwargs) -> AsyncResponse:
+        import aiohttp
+        kwargs['headers'] = self._trace_headers(kwargs.get('headers'))
+        event = RequestEvent(method, self.endpoint, template, url, body)
+        event.bytes_sent = body_size(kwargs.get('data'))
+        breakers = self.cluster_config.breakers
+        breaker = None if breakers is None else breakers.breaker(self.endpoint)
+        if breaker is not None:
+            breaker.before_request()
+        fire_before(self.cluster_config.hooks, event)
+        event.started = time.perf_counter()
+        try:
+            async with self._http().request(method, url, **kwargs) as r:
+                event.status = r.status
+                event.ttfb = time.perf_counter() - event.started
+                content = await r.read()
+                response = AsyncResponse(str(r.url), r.status, r.reason, r.headers, content)
+        except BaseException as e:
+            # As for `requests`, a read timeout is not a connection failure.
+            failed = isinstance(e, aiohttp.ClientConnectionError) and not isinstance(e, aiohttp.SocketTimeoutError)
+            if breaker is not None:
+                if failed:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+            if failed:
+                self.cluster_config.node_failed(self.endpoint)
+            event.error = e
+            event.latency = time.perf_counter() - event.started
+            fire_after(self.cluster_config.hooks, event)
+            raise
+        if breaker is not None:
+            policy = self.cluster_config.retry_policy
+            codes = TRANSIENT_STATUS_CODES if policy is None else policy.status_codes
+            if response.status_code in codes:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        # aiohttp decompresses as it reads: the wire size is the Content-Length.
+        self._complete(response, event, len(content))
+        return response
+
+    async def get(self, req, args=None, params=None, require_ok=True) -> AsyncResponse:
+        """
+        Generic GET request to this service. See `Service.get()`.
+        """
+        url = self.build_url(req, args)
+        r = await self._send('GET', url, template=req, params=params)
+        if require_ok:
+            check_async_error(r)
+        return r
+
+    async def get_json(self, url_tail, args=None, params=None):
+        r = await self.get(url_tail, args, params)
+        return self._decode(r)
+
+    async def post(self, req, body, args=None, headers=None, require_ok=True) -> AsyncResponse:
+        url = self.build_url(req, args)
+        r = await self._send('POST', url, template=req, body=body, data=body, headers=headers)
+        if require_ok:
+            check_async_error(r)
+        return r
+
+    async def post_json(self, req, body, args=None, headers=None, params=None):
+        r = await self.post_only_json(req, body, args, headers, params)
+        check_async_error(r)
+        return self._decode(r)
+
+    async def post_only_json(self, req, body, args=None, headers=None, params=None) -> AsyncResponse:
+        url = self.build_url(req, args)
+        data, headers = self._encode(body, headers)
+        return await self._send('POST', url, template=req, body=body, data=data, headers=headers, params=params)
+
+    async def delete(self, req, args=None, params=None, headers=None) -> AsyncResponse:
+        url = self.build_url(req, args)
+        return await self._send('DELETE', url, template=req, params=params, headers=headers)
+
+    async def delete_json(self, req, args=None, params=None, headers=None):
+        r = await self.delete(req, args=args, params=params, headers=headers)
+        return self._decode(r)
+
+    #-------- Common --------
+
+    async def status(self):
+        return await self.get_json(REQ_STATUS)
+
+    async def is_healthy(self) -> bool:
+        try:
+            return await self.get_json(REQ_HEALTH)
+        except Exception:
+            return False
+
+    async def properties(self) -> map:
+        return await self.get_json(REQ_PROPERTIES)
+
+    async def in_cluster(self):
+        try:
+            result = await self.get_json(REQ_IN_CLUSTER)
+            return dict_get(result, 'selfDiscovered', False)
+        except Exception:
+            return False
@@ -0,0 +1,278 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from . import consts
+from .util import normalize_sql, is_read_only_sql
+
+# Context keys which identify a particular run of a query, and so
+# are not part of the cache key.
+VOLATILE_CONTEXT_KEYS = [consts.SQL_QUERY_ID_KEY, consts.QUERY_ID_KEY]
+
+# System tables describe the live cluster: their results must not be
+# served from the cache.
+SYSTEM_TABLE_PATTERN = re.compile(r'\b(sys|information_schema)\b"?\s*\.', re.IGNORECASE)
+
+def is_system_query(sql) -> bool:
+    """
+    Returns `True` if the SQL reads a `sys` or `INFORMATION_SCHEMA` table.
+    """
+    return SYSTEM_TABLE_PATTERN.search(sql) is not None
+
+def is_cacheable(sql) -> bool:
+    """
+    Returns `True` if the result of the SQL may be cached: a read-only
+    query which does not read the system tables. Statements such as
+    INSERT or REPLACE must run each time, never be replayed from the cache.
+    """
+    return is_read_only_sql(sql) and not is_system_query(sql)
+
+def cache_key(request) -> str:
+    """
+    Returns the cache key for a SQL request: the normalized SQL along with
+    the context, parameters, result format and header options.
+    """
+    context = request.context
+    if context is not None:
+        context = {k: v for k, v in context.items() if k not in VOLATILE_CONTEXT_KEYS}
+    key = {
+        'sql': normalize_sql(request.sql),
+        'context': context if context else None,
+        'params': request.params if request.params else None,
+        'format': request.format(),
+        'headers': request.header_context(),
+        }
+    return json.dumps(key, sort_keys=True, default=str)
+
+def result_size(result) -> int:
+    """
+    Estimates the memory used by a query result as the size of the
+    response payload.
+    """
+    response = result.http_response
+    if response is None:
+        frame = result.columnar()
+        return 0 if frame is None else frame.nbytes()
+    content = getattr(response, 'content', None)
+    return 0 if content is None else len(content)
+
+class CacheStats:
+    """
+    Counters which describe the effectiveness of a cache.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def hit_rate(self):
+        total = self.hits + self.disk_hits + self.misses
+        return 0.0 if total == 0 else (self.hits + self.disk_hits) / total
+
+    def to_dict(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+            'puts': self.puts,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            }
+
+    def __str__(self):
+        return str(self.to_dict())
+
+class CacheEntry:
+
+    def __init__(self, key, result, size, expires):
+        self.key = key
+        self.result = result
+        self.size = size
+        self.expires = expires
+
+class ResultCache:
+    """
+    In-memory cache of SQL query results.
+
+    Results are keyed on the normalized SQL text, context, parameters and
+    result format, so that the same query issued twice shares one
+    `SqlQueryResult` object. Each entry expires after a time-to-live, and
+    the least-recently-used entries are evicted when the total size of the
+    cached response payloads exceeds the byte budget. Only successful
+    results of read-only queries are cached, and queries of the system
+    tables are never cached.
+
+    Enable the cache when connecting:
+
+        client = dcl.connect(url, result_cache=ResultCache(max_bytes=consts.ONE_GB))
+
+    or later via `client.enable_cache()`. The cache is thread-safe.
+
+    An optional `DiskResultStore` provides a second, persistent tier:
+    results missing from memory are looked up in the store, and new
+    results are also written to the store.
+    """
+
+    def __init__(self, max_bytes=64 * consts.ONE_MB, ttl=300, clock=time.monotonic, store=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        max_bytes : int, default = 64 MB
+            Byte budget for the cached response payloads.
+
+        ttl : float, default = 300
+            Default time-to-live, in seconds, of each entry.
+
+        clock : function, default = time.monotonic
+            Time source, in seconds.
+
+        store : DiskResultStore, default = None
+            Optional persistent second tier.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.store = store
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bytes(self):
+        """
+        Returns the total size of the cached payloads.
+        """
+        return self._bytes
+
+    def get(self, request):
+        """
+        Returns the cached result for the request, or `None` if the request
+        is not cached or the entry has expired.
+        """
+        if not is_cacheable(request.sql):
+            return None
+        key = cache_key(request)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= self.clock():
+                self._remove(entry)
+                self.stats.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry.result
+        result = None if self.store is None else self.store.get(request)
+        with self._lock:
+            if result is None:
+                self.stats.misses += 1
+                return None
+            self.stats.disk_hits += 1
+            self._insert(key, result, self.ttl)
+        return result
+
+    def put(self, request, result, ttl=None):
+        """
+        Adds a result to the cache with the given time-to-live, in seconds,
+        or the default TTL. Results larger than the byte budget, and failed
+        results, are not cached.
+        """
+        if not result.ok() or not is_cacheable(request.sql):
+            return
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        key = cache_key(request)
+        with self._lock:
+            self._insert(key, result, self.ttl if ttl is None else ttl, size)
+            self.stats.puts += 1
+        if self.store is not None:
+            self.store.put(request, result)
+
+    def _insert(self, key, result, ttl, size=None):
+        if size is None:
+            size = result_size(result)
+        old = self._entries.get(key)
+        if old is not None:
+            self._remove(old)
+        self._entries[key] = CacheEntry(key, result, size, self.clock() + ttl)
+        self._bytes += size
+        self._evict()
+
+    def _remove(self, entry):
+        del self._entries[entry.key]
+        self._bytes -= entry.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 0:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.stats.evictions += 1
+
+    def invalidate(self, request):
+        """
+        Removes the entry, if any, for the given request.
+        """
+        key = cache_key(request)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._remove(entry)
+                self.stats.invalidations += 1
+        if self.store is not None:
+            self.store.invalidate(request)
+
+    def invalidate_matching(self, predicate):
+        """
+        Removes all entries for which `predicate(sql)` returns `True`, where
+        `sql` is the normalized SQL text, including those in the persistent
+        store, if any. For example, to invalidate all queries against a
+        table after ingesting into it:
+
+            cache.invalidate_matching(lambda sql: 'wikipedia' in sql)
+        """
+        with self._lock:
+            for entry in list(self._entries.values()):
+                if predicate(normalize_sql(entry.result.request.sql)):
+                    self._remove(entry)
+                    self.stats.invalidations += 1
+        if self.store is not None:
+            self.store.invalidate_matching(predicate)
+
+    def clear(self):
+        """
+        Removes all entries, including those in the persistent store, if any.
+        """
+        with self._lock:
+            self.stats.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        if self.store is not None:
+            self.store.clear()
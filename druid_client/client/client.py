@@ -12,15 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .service import Service
-from .error import ClientError
-from .sql import SqlRequest, SqlQueryResult, QueryPlan
-from .util import is_blank
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from .service import Service, check_error
+from .error import ClientError, QueryTimeoutError
+from .sql import SqlRequest, SqlQueryResult, SqlStreamResult, FailedQueryResult, QueryPlan
+from .native import (
+    NativeQuery, ScanQuery, TimeseriesQuery, TopNQuery, GroupByQuery, SegmentMetadataQuery,
+    NativeQueryResult, ScanStreamResult, native_query_for)
+from .util import is_blank, is_read_only_sql
+from .retry import run_query_with_retry
 from .display import Display
+from . import consts
+from .cache import ResultCache
+from .tracing import in_current_context
+
+# Default number of concurrent queries for sql_many()
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Default rows per page for sql_pages()
+DEFAULT_PAGE_SIZE = 10000
 
 ROUTER_BASE = '/druid/v2'
 REQ_ROUTER_QUERY = ROUTER_BASE
 REQ_ROUTER_SQL = ROUTER_BASE + '/sql'
+REQ_ROUTER_SQL_CANCEL = REQ_ROUTER_SQL + '/{}'
+REQ_ROUTER_QUERY_CANCEL = REQ_ROUTER_QUERY + '/{}'
 
 class Client(Service):
     """
@@ -50,28 +68,223 @@ class Client(Service):
             request = self.sql_request(request)
         if is_blank(request.sql):
             raise ClientError("No query provided.")
-        if self.cluster_config.trace:
-            print(request.sql)
         query_obj = request.to_request()
         return (request, query_obj)
 
-    def sql_query(self, request) -> SqlQueryResult:
+    def sql_query(self, request, retry=True) -> SqlQueryResult:
         '''
         Submit a SQL query with control over the context, parameters and other
         options. Returns a response with either a detailed error message, or
         the rows and query ID.
+
+        If Druid rejects the query for a transient reason, such as the Broker
+        being at capacity, and `retry` is `True`, the query is retried per the
+        `query_retry` policy of the cluster configuration. Use
+        `druid_error()` on the result to obtain a typed error.
+
+        If the request has a timeout (`SqlRequest.with_timeout()`), and Druid
+        does not respond in time, cancels the query and raises a
+        `QueryTimeoutError`.
         '''
-        request, query_obj = self._prepare_query(request)
-        r = self.post_only_json(REQ_ROUTER_SQL, query_obj, headers=request.headers)
+        request, _ = self._prepare_query(request)
+        with self.cluster_config.tracer.span('sql.query', sql=request.sql) as span:
+            cache = self.cluster_config.result_cache if request.use_cache else None
+            if cache is not None:
+                result = cache.get(request)
+                if result is not None:
+                    span.update({'query_id': result.id(), 'cached': True})
+                    return result
+            policy = self.cluster_config.query_retry if retry else None
+            result = run_query_with_retry(policy, self.cluster_config.retry_metrics, request,
+                lambda req, attempt: self._run_sql(req))
+            span.update({'query_id': result.id(), 'ok': result.ok()})
+            if cache is not None:
+                cache.put(request, result)
+            return result
+
+    def _run_sql(self, request) -> SqlQueryResult:
+        '''
+        Runs one attempt of a SQL query, with a new query ID.
+        '''
+        query_obj = request.to_request()
+        try:
+            r = self.post_only_json(REQ_ROUTER_SQL, query_obj, headers=request.headers,
+                timeout=request.timeout, idempotent=is_read_only_sql(request.sql))
+        except requests.exceptions.Timeout:
+            self._cancel_quietly(request.query_id)
+            raise QueryTimeoutError("Query did not complete within {} seconds".format(request.timeout), request.query_id)
         return SqlQueryResult(request, r)
 
+    def _safe_sql_query(self, request) -> SqlQueryResult:
+        try:
+            return self.sql_query(request)
+        except Exception as e:
+            if type(request) == str:
+                request = self.sql_request(request)
+            return FailedQueryResult(request, e)
+
+    def _submit_all(self, executor, requests):
+        return [executor.submit(in_current_context(self._safe_sql_query), request) for request in requests]
+
+    def sql_many(self, requests, max_concurrency=DEFAULT_MAX_CONCURRENCY) -> list:
+        '''
+        Runs a set of independent SQL queries concurrently, with at most
+        `max_concurrency` in flight at once, and returns the results in the
+        same order as the requests.
+
+        Parameters
+        ----------
+        requests : list
+            SQL strings or `SqlRequest` objects.
+
+        max_concurrency : int, default = 8
+            Maximum number of concurrent queries, and the size of the
+            connection pool.
+
+        Returns
+        -------
+        A list of `SqlQueryResult` objects. A query which fails does not
+        abort the others: its result reports the error, including errors
+        raised in the client such as connection failures.
+        '''
+        requests = list(requests)
+        self.ensure_pool_size(max_concurrency)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return [f.result() for f in self._submit_all(executor, requests)]
+
+    def sql_as_completed(self, requests, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        '''
+        As `sql_many()`, but yields `(index, result)` pairs as each query
+        completes, where `index` is the position of the request in `requests`.
+        '''
+        requests = list(requests)
+        self.ensure_pool_size(max_concurrency)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = self._submit_all(executor, requests)
+            index = {f: i for i, f in enumerate(futures)}
+            for f in as_completed(futures):
+                yield (index[f], f.result())
+
+    def sql_sliced(self, request, start, end, grain=consts.DAY_GRAIN, merge=None,
+            max_slices=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, time_col=consts.TIME_COL):
+        '''
+        Runs a query over a large time range as a set of concurrent queries,
+        one per time slice, and stitches the results back together in time
+        order.
+
+        Parameters
+        ----------
+        request : str or SqlRequest
+            The query, which must contain a `{time_range}` placeholder where
+            the predicate on the time column belongs.
+
+        start, end : datetime or str
+            The time range [start, end), as UTC datetimes or Druid ISO timestamps.
+
+        grain : str, default = consts.DAY_GRAIN
+            Granularity (a key of `consts.druid_grains`) on which slices are aligned.
+
+        merge : dict, default = None
+            For queries which aggregate across time, maps each aggregate column
+            to its merge function: 'sum', 'count', 'min' or 'max'. Rows with
+            equal values for the other columns are combined.
+
+        max_slices : int, default = None
+            Maximum number of slices: each slice spans several granularity
+            periods if needed.
+
+        max_concurrency : int, default = 8
+            Maximum number of slices to run at once.
+
+        Returns
+        -------
+        A `SlicedQueryResult`.
+        '''
+        from .slicing import run_sliced
+        return run_sliced(self, request, start, end, grain, merge, max_slices, max_concurrency, time_col)
+
+    def sql_pages(self, request, page_size=DEFAULT_PAGE_SIZE, order_key=consts.TIME_COL, prefetch=True):
+        '''
+        Runs a query with a large result as a series of queries, one per page,
+        using keyset pagination rather than OFFSET, and yields each page as a
+        `SqlQueryResult`. While the caller processes a page, the next one is
+        fetched in the background.
+
+        Parameters
+        ----------
+        request : str or SqlRequest
+            The query, which must contain a `{keyset}` placeholder where the
+            predicate on the key belongs, and must not have ORDER BY or LIMIT
+            clauses.
+
+        page_size : int, default = 10000
+            Maximum rows per page: the LIMIT of each page query. Must exceed
+            the number of rows which share any one key value.
+
+        order_key : str or list, default = '__time'
+            Column, or columns, on which to order and page.
+
+        prefetch : bool, default = True
+            If `True`, fetch the next page while the caller processes the
+            current one.
+
+        Raises a `QueryError` if a page query fails. Abandoning the iteration
+        cancels the prefetched query. See `druid_client.client.paging`.
+        '''
+        from .paging import run_pages
+        return run_pages(self, request, page_size, order_key, prefetch)
+
+    def sql_stream(self, request, chunk_size=None) -> SqlStreamResult:
+        '''
+        Submit a SQL query and return a result which parses rows incrementally
+        as they arrive, in constant memory. Iterate over the result to obtain
+        the rows. Supports the `object`, `array` and `arrayWithTrailer` formats.
+
+        Closing the result, or abandoning the iteration, before all rows are
+        read cancels the query. If the request has a timeout, the deadline
+        applies to reading the entire result.
+        '''
+        request, query_obj = self._prepare_query(request)
+        deadline = None if request.timeout is None else time.monotonic() + request.timeout
+        try:
+            r = self.post_only_json(REQ_ROUTER_SQL, query_obj, headers=request.headers, stream=True,
+                timeout=request.timeout, idempotent=is_read_only_sql(request.sql))
+        except requests.exceptions.Timeout:
+            self._cancel_quietly(request.query_id)
+            raise QueryTimeoutError("Query did not start within {} seconds".format(request.timeout), request.query_id)
+        return SqlStreamResult(request, r, chunk_size=chunk_size, deadline=deadline,
+            on_complete=self._stream_complete)
+
+    def cancel_sql(self, query_id) -> bool:
+        '''
+        Cancels a running SQL query given its SQL query ID, as returned by
+        `SqlQueryResult.id()` or assigned in `SqlRequest.query_id`.
+
+        Returns
+        -------
+        `True` if Druid accepted the cancellation, `False` if no such query
+        is running, as when the query has already completed.
+        '''
+        r = self.delete(REQ_ROUTER_SQL_CANCEL, args=[query_id])
+        if r.status_code == requests.codes.not_found:
+            return False
+        check_error(r)
+        return True
+
+    def _cancel_quietly(self, query_id):
+        if query_id is None:
+            return
+        try:
+            self.cancel_sql(query_id)
+        except Exception:
+            pass
+
     def sql(self, sql, *args):
         if len(args) > 0:
             sql = sql.format(*args)
         resp = self.sql_query(sql)
-        if resp.ok():
-            return resp.rows()
-        raise ClientError(resp.error_msg())
+        resp.raise_for_error()
+        return resp.rows()
 
     def explain_sql(self, query) -> QueryPlan:
         """
@@ -91,6 +304,116 @@ class Client(Service):
     
     def sql_request(self, sql):
         return SqlRequest(self, sql)
+
+    #-------- Native Queries --------
+
+    def native_query(self, query, retry=True) -> NativeQueryResult:
+        '''
+        Runs a native query, given as a query object, such as from
+        `timeseries()`, or as a JSON query dictionary, and reads the entire
+        result. Retries and timeouts work as for `sql_query()`.
+
+        Prefer `native_stream()` for scan queries with large results.
+        '''
+        query = native_query_for(self, query)
+        with self.cluster_config.tracer.span('native.query', query_type=query.query_type_name()) as span:
+            policy = self.cluster_config.query_retry if retry else None
+            result = run_query_with_retry(policy, self.cluster_config.retry_metrics, query,
+                lambda q, attempt: self._run_native(q))
+            span.update({'query_id': result.id(), 'ok': result.ok()})
+            return result
+
+    def _run_native(self, query) -> NativeQueryResult:
+        query_obj = query.to_request()
+        try:
+            r = self.post_only_json(REQ_ROUTER_QUERY, query_obj, timeout=query.timeout, idempotent=True)
+        except requests.exceptions.Timeout:
+            self._cancel_native_quietly(query.query_id)
+            raise QueryTimeoutError("Query did not complete within {} seconds".format(query.timeout), query.query_id)
+        return NativeQueryResult(query, r)
+
+    def native_stream(self, query, chunk_size=None) -> ScanStreamResult:
+        '''
+        Runs a scan query and returns a result which parses the rows batch
+        by batch as they arrive, as `sql_stream()` does. Closing the result
+        before all rows are read cancels the query.
+        '''
+        query = native_query_for(self, query)
+        if not isinstance(query, ScanQuery):
+            raise ClientError("Only scan queries can be streamed.")
+        query_obj = query.to_request()
+        deadline = None if query.timeout is None else time.monotonic() + query.timeout
+        try:
+            r = self.post_only_json(REQ_ROUTER_QUERY, query_obj, stream=True, timeout=query.timeout, idempotent=True)
+        except requests.exceptions.Timeout:
+            self._cancel_native_quietly(query.query_id)
+            raise QueryTimeoutError("Query did not start within {} seconds".format(query.timeout), query.query_id)
+        return ScanStreamResult(query, r, chunk_size=chunk_size, deadline=deadline,
+            on_complete=self._stream_complete)
+
+    def cancel_native(self, query_id) -> bool:
+        '''
+        Cancels a running native query given its query ID. Returns `False`
+        if no such query is running.
+        '''
+        r = self.delete(REQ_ROUTER_QUERY_CANCEL, args=[query_id])
+        if r.status_code == requests.codes.not_found:
+            return False
+        check_error(r)
+        return True
+
+    def _cancel_native_quietly(self, query_id):
+        try:
+            self.cancel_native(query_id)
+        except Exception:
+            pass
+
+    def native_request(self, query) -> NativeQuery:
+        '''
+        Returns a query object for a JSON native query dictionary.
+        '''
+        return native_query_for(self, query)
+
+    def scan(self, table) -> ScanQuery:
+        return ScanQuery(self, table)
+
+    def timeseries(self, table) -> TimeseriesQuery:
+        return TimeseriesQuery(self, table)
+
+    def top_n(self, table) -> TopNQuery:
+        return TopNQuery(self, table)
+
+    def group_by(self, table) -> GroupByQuery:
+        return GroupByQuery(self, table)
+
+    def segment_metadata(self, table) -> SegmentMetadataQuery:
+        return SegmentMetadataQuery(self, table)
+
+    #-------- Result Cache --------
+
+    def enable_cache(self, max_bytes=None, ttl=None) -> ResultCache:
+        """
+        Enables the SQL result cache for this client (and others which share
+        its configuration), or returns the existing cache. See `ResultCache`.
+        """
+        cache = self.cluster_config.result_cache
+        if cache is None:
+            cache = ResultCache()
+            self.cluster_config.result_cache = cache
+        if max_bytes is not None:
+            cache.max_bytes = max_bytes
+        if ttl is not None:
+            cache.ttl = ttl
+        return cache
+
+    def disable_cache(self):
+        self.cluster_config.result_cache = None
+
+    def cache(self) -> ResultCache:
+        """
+        Returns the result cache, or `None` if caching is not enabled.
+        """
+        return self.cluster_config.result_cache
    
     #-------- Cluster Services --------
 
@@ -134,6 +457,7 @@ class Client(Service):
     def query_client(self):
         """
         Returns a client for `pydruid` configured as for this client.
+        Native queries are also available directly: see `native_query()`.
         """
         if self._query_client is None:
             import pydruid.client as pydruid_client
@@ -0,0 +1,137 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+JSON codecs for REST payloads.
+
+Decoding large responses, such as SQL results or `sys.segments`, is the
+main client-side CPU cost. A codec encodes request bodies and decodes
+response payloads using the fastest JSON library installed: `orjson`,
+then `ujson`, falling back to the standard library `json` module.
+Choose a codec explicitly with the `codec` option of `connect()`.
+"""
+
+import json
+from .error import ConfigError
+
+STDLIB_CODEC = 'json'
+ORJSON_CODEC = 'orjson'
+UJSON_CODEC = 'ujson'
+
+class JsonCodec:
+    """
+    JSON codec based on the standard library `json` module.
+    """
+
+    name = STDLIB_CODEC
+
+    def loads(self, data):
+        """
+        Decodes a JSON payload given as `bytes` (UTF-8) or `str`.
+        """
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        """
+        Encodes an object as UTF-8 JSON bytes.
+        """
+        return json.dumps(obj).encode('utf-8')
+
+class OrjsonCodec(JsonCodec):
+    """
+    JSON codec based on `orjson`.
+    """
+
+    name = ORJSON_CODEC
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        # Non-string keys, as allowed by the stdlib encoder.
+        return self._orjson.dumps(obj, option=self._orjson.OPT_NON_STR_KEYS)
+
+class UjsonCodec(JsonCodec):
+    """
+    JSON codec based on `ujson`.
+    """
+
+    name = UJSON_CODEC
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return self._ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+codecs = {
+    STDLIB_CODEC: JsonCodec,
+    ORJSON_CODEC: OrjsonCodec,
+    UJSON_CODEC: UjsonCodec,
+}
+
+# Codecs tried, in order, to find the default.
+preferred_codecs = [ORJSON_CODEC, UJSON_CODEC]
+
+STDLIB = JsonCodec()
+
+def codec_for(name) -> JsonCodec:
+    """
+    Returns the codec with the given name. Raises a `ConfigError` if the
+    name is unknown or the library is not installed.
+    """
+    cls = codecs.get(name)
+    if cls is None:
+        raise ConfigError("Unknown JSON codec: " + str(name))
+    try:
+        return cls()
+    except ImportError:
+        raise ConfigError("JSON codec {} is not installed".format(name))
+
+def default_codec() -> JsonCodec:
+    """
+    Returns the fastest installed codec.
+    """
+    for name in preferred_codecs:
+        try:
+            return codecs[name]()
+        except ImportError:
+            pass
+    return STDLIB
+
+def resolve_codec(codec) -> JsonCodec:
+    """
+    Returns the codec for the `codec` configuration option: `None` for the
+    default, a codec name, or a codec object.
+    """
+    if codec is None:
+        return default_codec()
+    if type(codec) is str:
+        return codec_for(codec)
+    return codec
+
+def decode_response(response, codec=None):
+    """
+    Decodes the JSON payload of an HTTP response with the given codec,
+    or the default codec.
+    """
+    return (STDLIB if codec is None else codec).loads(response.content)
@@ -0,0 +1,559 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Columnar representation of query results.
+
+Rather than a list of rows of boxed Python values, a `ColumnarFrame` holds
+one typed buffer per column: 64-bit integers, doubles, timestamps (as
+milliseconds since the epoch) or dictionary-encoded strings. The frame is
+built row-by-row as the response is decoded, so the rows themselves are
+never materialized. Buffers are stdlib `array` objects which NumPy, Pandas
+and Arrow wrap without copying.
+
+NumPy is required only to convert the buffers (`to_numpy()` and friends),
+Pandas only for `to_pandas()` and `pyarrow` only for `to_arrow()`.
+"""
+
+from array import array
+from datetime import datetime, timedelta, timezone
+from . import consts
+
+LONG_KIND = 'long'
+DOUBLE_KIND = 'double'
+TIMESTAMP_KIND = 'timestamp'
+STRING_KIND = 'string'
+OBJECT_KIND = 'object'
+
+# Maps SQL and Druid type names (upper case) to column kinds.
+type_kinds = {
+    'BIGINT': LONG_KIND,
+    'INTEGER': LONG_KIND,
+    'SMALLINT': LONG_KIND,
+    'TINYINT': LONG_KIND,
+    'BOOLEAN': LONG_KIND,
+    'LONG': LONG_KIND,
+    'DOUBLE': DOUBLE_KIND,
+    'FLOAT': DOUBLE_KIND,
+    'REAL': DOUBLE_KIND,
+    'DECIMAL': DOUBLE_KIND,
+    'TIMESTAMP': TIMESTAMP_KIND,
+    'DATE': TIMESTAMP_KIND,
+    'VARCHAR': STRING_KIND,
+    'CHAR': STRING_KIND,
+    'STRING': STRING_KIND,
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def kind_for_type(sql_type, druid_type=None):
+    """
+    Returns the column kind for a SQL or Druid type name, trying each in
+    turn; `OBJECT_KIND` if neither is known; or `None` if no type is given,
+    so that the kind must be inferred from the data.
+    """
+    types = [t for t in [sql_type, druid_type] if t is not None]
+    for t in types:
+        kind = type_kinds.get(t.upper())
+        if kind is not None:
+            return kind
+    return OBJECT_KIND if types else None
+
+def kind_for_value(value):
+    if type(value) is bool or type(value) is int:
+        return LONG_KIND
+    if type(value) is float:
+        return DOUBLE_KIND
+    if type(value) is str:
+        return STRING_KIND
+    return OBJECT_KIND
+
+def parse_timestamp(value) -> int:
+    """
+    Converts a Druid timestamp (an ISO string or milliseconds since the
+    epoch) to milliseconds since the epoch.
+    """
+    if type(value) is int:
+        return value
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    dt = datetime.fromisoformat(value.replace(' ', 'T'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+def format_timestamp(millis) -> str:
+    """
+    Converts milliseconds since the epoch to a Druid ISO timestamp string
+    of the form `2022-01-01T00:00:00.000Z`.
+    """
+    dt = EPOCH + timedelta(milliseconds=millis)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(dt.microsecond // 1000)
+
+class ColumnBuilder:
+    """
+    Accumulates the values of one column. `append()` returns `False` if the
+    value does not fit the column kind, in which case the caller promotes
+    the builder via `promote()`.
+    """
+
+    kind = None
+
+    def __init__(self, name):
+        self.name = name
+        self.nulls = None
+        self.count = 0
+
+    def _null(self):
+        if self.nulls is None:
+            self.nulls = bytearray(self.count)
+        self.nulls.append(1)
+
+    def _not_null(self):
+        if self.nulls is not None:
+            self.nulls.append(0)
+
+    def values(self) -> list:
+        """
+        Returns the values as Python objects, used when promoting.
+        """
+        raise NotImplementedError
+
+    def build(self):
+        raise NotImplementedError
+
+class LongBuilder(ColumnBuilder):
+
+    kind = LONG_KIND
+
+    def __init__(self, name):
+        ColumnBuilder.__init__(self, name)
+        self.data = array('q')
+
+    def append(self, value):
+        if value is None:
+            self.data.append(0)
+            self._null()
+        elif type(value) is int or type(value) is bool:
+            self.data.append(value)
+            self._not_null()
+        else:
+            return False
+        self.count += 1
+        return True
+
+    def values(self):
+        return [None if self.nulls is not None and self.nulls[i] else v for i, v in enumerate(self.data)]
+
+    def build(self):
+        return Column(self.name, self.kind, self.data, self.nulls)
+
+class DoubleBuilder(ColumnBuilder):
+
+    kind = DOUBLE_KIND
+
+    def __init__(self, name):
+        ColumnBuilder.__init__(self, name)
+        self.data = array('d')
+
+    def append(self, value):
+        if value is None:
+            self.data.append(float('nan'))
+            self._null()
+        elif type(value) is float or type(value) is int:
+            self.data.append(value)
+            self._not_null()
+        else:
+            return False
+        self.count += 1
+        return True
+
+    def values(self):
+        return [None if self.nulls is not None and self.nulls[i] else v for i, v in enumerate(self.data)]
+
+    def build(self):
+        return Column(self.name, self.kind, self.data, self.nulls)
+
+class TimestampBuilder(ColumnBuilder):
+
+    kind = TIMESTAMP_KIND
+
+    def __init__(self, name):
+        ColumnBuilder.__init__(self, name)
+        self.data = array('q')
+
+    def append(self, value):
+        if value is None:
+            self.data.append(0)
+            self._null()
+        else:
+            try:
+                self.data.append(parse_timestamp(value))
+            except (ValueError, TypeError, AttributeError):
+                return False
+            self._not_null()
+        self.count += 1
+        return True
+
+    def values(self):
+        return [None if self.nulls is not None and self.nulls[i] else v for i, v in enumerate(self.data)]
+
+    def build(self):
+        return Column(self.name, self.kind, self.data, self.nulls)
+
+class StringBuilder(ColumnBuilder):
+    """
+    Dictionary-encodes strings: each value is stored as an index into
+    the list of distinct values. Nulls have the code -1.
+    """
+
+    kind = STRING_KIND
+
+    def __init__(self, name):
+        ColumnBuilder.__init__(self, name)
+        self.data = array('i')
+        self.codes = {}
+        self.dictionary = []
+
+    def append(self, value):
+        if value is None:
+            self.data.append(-1)
+        elif type(value) is str:
+            code = self.codes.get(value)
+            if code is None:
+                code = len(self.dictionary)
+                self.codes[value] = code
+                self.dictionary.append(value)
+            self.data.append(code)
+        else:
+            return False
+        self.count += 1
+        return True
+
+    def values(self):
+        return [None if code == -1 else self.dictionary[code] for code in self.data]
+
+    def build(self):
+        return Column(self.name, self.kind, self.data, None, self.dictionary)
+
+class ObjectBuilder(ColumnBuilder):
+
+    kind = OBJECT_KIND
+
+    def __init__(self, name, values=None):
+        ColumnBuilder.__init__(self, name)
+        self.data = [] if values is None else values
+        self.count = len(self.data)
+
+    def append(self, value):
+        self.data.append(value)
+        self.count += 1
+        return True
+
+    def values(self):
+        return self.data
+
+    def build(self):
+        return Column(self.name, self.kind, self.data, None)
+
+class InferredBuilder(ColumnBuilder):
+    """
+    Placeholder for a column of unknown type: counts leading nulls until
+    the first non-null value determines the kind.
+    """
+
+    def append(self, value):
+        if value is not None:
+            return False
+        self.count += 1
+        return True
+
+    def values(self):
+        return [None] * self.count
+
+    def build(self):
+        return Column(self.name, OBJECT_KIND, self.values(), None)
+
+builders = {
+    LONG_KIND: LongBuilder,
+    DOUBLE_KIND: DoubleBuilder,
+    TIMESTAMP_KIND: TimestampBuilder,
+    STRING_KIND: StringBuilder,
+    OBJECT_KIND: ObjectBuilder,
+}
+
+def promote(builder, value):
+    """
+    Returns a new builder able to hold both the existing values and
+    the given value.
+    """
+    if type(builder) is InferredBuilder:
+        kind = kind_for_value(value)
+    elif builder.kind == LONG_KIND and type(value) is float:
+        kind = DOUBLE_KIND
+    else:
+        kind = OBJECT_KIND
+    new_builder = builders[kind](builder.name)
+    for v in builder.values():
+        if not new_builder.append(v):
+            return ObjectBuilder(builder.name, builder.values())
+    return new_builder
+
+class Column:
+    """
+    One column of a `ColumnarFrame`.
+
+    Attributes
+    ----------
+    name : str
+        The column name.
+
+    kind : str
+        One of `long`, `double`, `timestamp` (milliseconds since the epoch),
+        `string` (dictionary-encoded) or `object` (a list of Python values.)
+
+    data : array or list
+        The values, or for strings, the dictionary codes (-1 for null).
+
+    nulls : bytearray
+        For numeric and timestamp columns, a byte per row which is 1 if the
+        value is null, or `None` if the column has no nulls.
+
+    dictionary : list
+        For string columns, the distinct values.
+    """
+
+    def __init__(self, name, kind, data, nulls, dictionary=None):
+        self.name = name
+        self.kind = kind
+        self.data = data
+        self.nulls = nulls
+        self.dictionary = dictionary
+
+    def __len__(self):
+        return len(self.data)
+
+    def nbytes(self):
+        """
+        Approximate memory used by the column buffers.
+        """
+        if self.kind == OBJECT_KIND:
+            return 8 * len(self.data)
+        size = self.data.itemsize * len(self.data)
+        if self.nulls is not None:
+            size += len(self.nulls)
+        if self.dictionary is not None:
+            size += sum(len(s) for s in self.dictionary)
+        return size
+
+    def values(self) -> list:
+        """
+        Returns the column as a list of Python values. Timestamps are
+        returned as milliseconds since the epoch.
+        """
+        if self.kind == STRING_KIND:
+            d = self.dictionary
+            return [None if code == -1 else d[code] for code in self.data]
+        if self.kind == OBJECT_KIND:
+            return self.data
+        if self.nulls is None:
+            return self.data.tolist()
+        return [None if n else v for v, n in zip(self.data, self.nulls)]
+
+    def null_mask(self):
+        """
+        Returns a NumPy boolean array which is `True` for null values, or `None`
+        if the column has no nulls.
+        """
+        import numpy as np
+        if self.kind == STRING_KIND:
+            mask = self.to_numpy() == -1
+            return mask if mask.any() else None
+        if self.nulls is None:
+            return None
+        return np.frombuffer(self.nulls, dtype=np.bool_)
+
+    def to_numpy(self):
+        """
+        Returns the column buffer as a NumPy array without copying: `int64`
+        for longs, `float64` for doubles, `datetime64[ms]` for timestamps, and
+        the `int32` dictionary codes for strings. Object columns are copied
+        into an `object` array.
+        """
+        import numpy as np
+        if self.kind == LONG_KIND:
+            return np.frombuffer(self.data, dtype=np.int64)
+        if self.kind == DOUBLE_KIND:
+            return np.frombuffer(self.data, dtype=np.float64)
+        if self.kind == TIMESTAMP_KIND:
+            return np.frombuffer(self.data, dtype='datetime64[ms]')
+        if self.kind == STRING_KIND:
+            return np.frombuffer(self.data, dtype=np.int32)
+        values = np.empty(len(self.data), dtype=object)
+        values[:] = self.data
+        return values
+
+    def to_pandas(self):
+        import pandas as pd
+        values = self.to_numpy()
+        mask = self.null_mask()
+        if self.kind == STRING_KIND:
+            return pd.Categorical.from_codes(values, categories=pd.Index(self.dictionary, dtype=object))
+        if self.kind == LONG_KIND and mask is not None:
+            return pd.arrays.IntegerArray(values, mask)
+        if self.kind == TIMESTAMP_KIND and mask is not None:
+            import numpy as np
+            values = values.copy()
+            values[mask] = np.datetime64('NaT')
+        return values
+
+    def to_arrow(self):
+        import pyarrow as pa
+        mask = self.null_mask()
+        if self.kind == STRING_KIND:
+            indices = pa.array(self.to_numpy(), mask=mask)
+            return pa.DictionaryArray.from_arrays(indices, pa.array(self.dictionary, type=pa.string()))
+        if self.kind == OBJECT_KIND:
+            return pa.array(self.data)
+        return pa.array(self.to_numpy(), mask=mask)
+
+class ColumnarFrame:
+    """
+    A query result held as one typed column per result column.
+    """
+
+    def __init__(self, columns, schema=None):
+        self.columns = columns
+        self.schema = schema
+        self._index = {c.name: c for c in columns}
+
+    def names(self):
+        return [c.name for c in self.columns]
+
+    def column(self, name) -> Column:
+        return self._index[name]
+
+    def __getitem__(self, name):
+        return self._index[name]
+
+    def __len__(self):
+        return 0 if len(self.columns) == 0 else len(self.columns[0])
+
+    def row_count(self):
+        return len(self)
+
+    def nbytes(self):
+        return sum(c.nbytes() for c in self.columns)
+
+    def rows(self) -> list:
+        """
+        Converts the frame back to rows (lists of Python values.)
+        """
+        return [list(row) for row in zip(*[c.values() for c in self.columns])]
+
+    def to_numpy(self) -> dict:
+        """
+        Returns a dictionary of column name to NumPy array. See `Column.to_numpy()`.
+        """
+        return {c.name: c.to_numpy() for c in self.columns}
+
+    def to_pandas(self):
+        """
+        Returns a Pandas `DataFrame`. String columns become categoricals over
+        the dictionary codes, and numeric columns wrap the column buffers.
+        """
+        import pandas as pd
+        return pd.DataFrame({c.name: c.to_pandas() for c in self.columns}, copy=False)
+
+    def to_arrow(self):
+        """
+        Returns a `pyarrow` `Table`, with strings as dictionary arrays.
+        """
+        import pyarrow as pa
+        return pa.table({c.name: c.to_arrow() for c in self.columns})
+
+class FrameBuilder:
+    """
+    Builds a `ColumnarFrame` one row at a time.
+
+    If a schema (list of `ColumnSchema`) with types is provided, it determines
+    the column kinds, else kinds are inferred from the first non-null value
+    of each column, promoting long to double, or to object, as needed.
+    """
+
+    def __init__(self, schema=None):
+        self.schema = schema
+        self._builders = None
+        self._names = None
+        if schema is not None and len(schema) > 0:
+            self._create([c.name for c in schema],
+                [kind_for_type(c.sql_type, c.druid_type) for c in schema])
+
+    def _create(self, names, kinds):
+        self._names = names
+        self._builders = []
+        for name, kind in zip(names, kinds):
+            if kind is None and name == consts.TIME_COL:
+                kind = TIMESTAMP_KIND
+            if kind is None:
+                self._builders.append(InferredBuilder(name))
+            else:
+                self._builders.append(builders[kind](name))
+
+    def _append(self, i, value):
+        builder = self._builders[i]
+        if not builder.append(value):
+            builder = promote(builder, value)
+            builder.append(value)
+            self._builders[i] = builder
+
+    def add_object(self, row):
+        """
+        Adds a row in `object` format: a dictionary of column name to value.
+        """
+        if self._builders is None:
+            names = list(row.keys())
+            self._create(names, [None] * len(names))
+        for i, name in enumerate(self._names):
+            self._append(i, row.get(name))
+
+    def add_array(self, row):
+        """
+        Adds a row in `array` format: a list of values in column order.
+        """
+        if self._builders is None:
+            self._create(['EXPR$' + str(i) for i in range(len(row))], [None] * len(row))
+        for i, value in enumerate(row):
+            self._append(i, value)
+
+    def add(self, row):
+        if type(row) is dict:
+            self.add_object(row)
+        else:
+            self.add_array(row)
+
+    def build(self) -> ColumnarFrame:
+        if self._builders is None:
+            return ColumnarFrame([], self.schema)
+        return ColumnarFrame([b.build() for b in self._builders], self.schema)
+
+def frame_from_stream(schema, rows) -> ColumnarFrame:
+    """
+    Builds a frame from an iterable of rows, such as a `SqlStreamResult`.
+    """
+    builder = FrameBuilder(schema)
+    for row in rows:
+        builder.add(row)
+    return builder.build()
@@ -0,0 +1,139 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compressed transport.
+
+Druid's HTTP server (Jetty's `GzipHandler`) compresses responses with
+gzip or deflate when the client asks for it, and inflates gzip request
+bodies. Responses are decompressed incrementally as they are read, so
+compression composes with streamed SQL results.
+
+`TransferStats` counts the bytes on the wire against the bytes before
+compression, in each direction, to show what compression saves.
+"""
+
+import gzip
+import threading
+
+GZIP_ENCODING = 'gzip'
+IDENTITY_ENCODING = 'identity'
+
+# Response encodings which Druid supports.
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Speed matters more than ratio for request bodies.
+GZIP_LEVEL = 5
+
+def accept_encoding(compression) -> str:
+    """
+    Returns the `Accept-Encoding` header for the `compression` option.
+    """
+    return ACCEPT_ENCODING if compression else IDENTITY_ENCODING
+
+def compress_body(data, headers, min_size):
+    """
+    Compresses a request body with gzip if it is at least `min_size` bytes.
+    Returns the body and the headers, with `Content-Encoding` added if the
+    body was compressed. A `min_size` of `None` disables compression.
+    """
+    if min_size is None or data is None or len(data) < min_size:
+        return data, headers
+    if headers is not None and 'Content-Encoding' in headers:
+        return data, headers
+    headers = {} if headers is None else dict(headers)
+    headers['Content-Encoding'] = GZIP_ENCODING
+    return gzip.compress(data, compresslevel=GZIP_LEVEL), headers
+
+def wire_bytes(response):
+    """
+    Returns the number of body bytes received on the wire for a response,
+    before decompression, or `None` if not known.
+
+    For `requests`, this is the count of bytes read from the socket, and so
+    is complete only once the body has been read. Otherwise, falls back to
+    the `Content-Length` header.
+    """
+    raw = getattr(response, 'raw', None)
+    if raw is not None:
+        try:
+            return int(raw.tell())
+        except Exception:
+            pass
+    length = response.headers.get('Content-Length') if response.headers is not None else None
+    try:
+        return None if length is None else int(length)
+    except ValueError:
+        return None
+
+class TransferStats:
+    """
+    Byte counters for requests and responses, shared by all the clients
+    of a cluster.
+
+    "Wire" bytes are those sent or received, compressed or not; "body"
+    bytes are the uncompressed payload. The ratio of the two shows the
+    saving from compression.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.compressed_requests = 0
+        self.request_body_bytes = 0
+        self.request_wire_bytes = 0
+        self.responses = 0
+        self.compressed_responses = 0
+        self.response_body_bytes = 0
+        self.response_wire_bytes = 0
+        self._lock = threading.Lock()
+
+    def note_request(self, body_bytes, wire_bytes):
+        with self._lock:
+            self.requests += 1
+            self.request_body_bytes += body_bytes
+            self.request_wire_bytes += wire_bytes
+            if wire_bytes != body_bytes:
+                self.compressed_requests += 1
+
+    def note_response(self, response, body_bytes):
+        """
+        Records a response once its body, of `body_bytes` decoded bytes,
+        has been read.
+        """
+        wire = wire_bytes(response)
+        if wire is None:
+            wire = body_bytes
+        encoding = response.headers.get('Content-Encoding') if response.headers is not None else None
+        with self._lock:
+            self.responses += 1
+            self.response_body_bytes += body_bytes
+            self.response_wire_bytes += wire
+            if encoding is not None and encoding != IDENTITY_ENCODING:
+                self.compressed_responses += 1
+
+    def to_dict(self):
+        def ratio(wire, body):
+            return None if body == 0 else wire / body
+        return {
+            'requests': self.requests,
+            'compressed_requests': self.compressed_requests,
+            'request_body_bytes': self.request_body_bytes,
+            'request_wire_bytes': self.request_wire_bytes,
+            'request_ratio': ratio(self.request_wire_bytes, self.request_body_bytes),
+            'responses': self.responses,
+            'compressed_responses': self.compressed_responses,
+            'response_body_bytes': self.response_body_bytes,
+            'response_wire_bytes': self.response_wire_bytes,
+            'response_ratio': ratio(self.response_wire_bytes, self.response_body_bytes),
+            }
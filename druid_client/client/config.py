@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from aiohttp import ClientError
 from .util import dict_get, split_host_url, service_url
 from . import consts
 from .extensions import load_extensions
+from .sessions import SessionRegistry, DEFAULT_POOL_SIZE
+from .codec import resolve_codec
+from .compression import TransferStats, accept_encoding
+from .metrics import MetricsRegistry, PrintHook
+from .tracing import resolve_tracer
+from .retry import RetryPolicy, RetryMetrics, CircuitBreakers, QueryRetryPolicy
 
 class ServiceMapper:
     """
@@ -132,11 +137,76 @@ class ClusterConfig:
         self.service_mapper = config.get('mapper', ServiceMapper())
         self.tls_cert = config.get('tls_cert')
         self.prefer_tls = config.get('prefer_tls', False)
+        # Maximum number of concurrent connections for each asynchronous
+        # service client.
+        self.async_limit = config.get('async_limit', 100)
+        # Optional ResultCache for SQL queries.
+        self.result_cache = config.get('result_cache')
+        # Seconds for which the cluster topology (sys.servers) is cached.
+        # Zero refreshes the topology on every role lookup.
+        self.topology_ttl = config.get('topology_ttl', 30)
+        # JSON codec for request and response payloads: the fastest
+        # installed, unless given by name or as a codec object.
+        self.codec = resolve_codec(config.get('codec'))
+        # HTTP sessions, one per service endpoint.
+        self.sessions = SessionRegistry(
+            tls_cert=self.tls_cert,
+            pool_size=config.get('pool_size', DEFAULT_POOL_SIZE),
+            pool_block=config.get('pool_block', False),
+            keep_alive=config.get('keep_alive', True),
+            accept_encoding=accept_encoding(config.get('compression', True)))
+        # Request bodies of at least this many bytes are sent gzipped:
+        # None sends all bodies uncompressed.
+        self.compress_min_size = config.get('compress_min_size')
+        self.transfer_stats = TransferStats()
+        # Retries of transient failures: None disables retries.
+        self.retry_policy = config.get('retry', RetryPolicy())
+        self.retry_metrics = RetryMetrics()
+        # Retries of queries which Druid rejects for transient reasons,
+        # such as load shedding: None disables these retries.
+        self.query_retry = config.get('query_retry', QueryRetryPolicy())
+        # Per-endpoint circuit breakers, unless disabled.
+        self.breakers = None
+        if config.get('circuit_breaker', True):
+            self.breakers = CircuitBreakers(metrics=self.retry_metrics)
         self.extensions = load_extensions()
+        # Request hooks, called for each HTTP request. See metrics.py.
+        self.hooks = list(config.get('hooks', []))
+        # Per-endpoint request metrics, unless disabled.
+        self.metrics = None
+        if config.get('metrics', True):
+            self.metrics = MetricsRegistry()
+            self.hooks.append(self.metrics)
+        # Spans for client operations: off unless given exporters.
+        self.tracer = resolve_tracer(config.get('tracing'))
+        self.hooks.append(self.tracer)
+        self._print_hook = None
+
+    @property
+    def trace(self):
+        """
+        Whether requests are printed as they are sent. Handy for debugging.
+        """
+        return self._print_hook is not None
+
+    @trace.setter
+    def trace(self, option):
+        if option and self._print_hook is None:
+            self._print_hook = PrintHook()
+            self.add_hook(self._print_hook)
+        elif not option and self._print_hook is not None:
+            self.remove_hook(self._print_hook)
+            self._print_hook = None
+
+    def add_hook(self, hook):
+        """
+        Adds a request hook, a `druid_client.client.metrics.RequestHook`.
+        """
+        # Copy on write: requests in flight iterate over the old list.
+        self.hooks = self.hooks + [hook]
 
-        # Enable this option to see the URLs as they are sent.
-        # Handy for debugging.
-        self.trace = False
+    def remove_hook(self, hook):
+        self.hooks = [h for h in self.hooks if h is not hook]
 
     def map_endpoint(self, remote_url):
         """
@@ -148,6 +218,13 @@ class ClusterConfig:
         scheme, host, port = self.service_mapper.url_for(host, http_port, tls_port, False)
         return service_url(scheme, host, port)
 
+    def node_failed(self, endpoint):
+        """
+        Called when a request to the service at `endpoint` fails to connect.
+        """
+        if self.cluster is not None:
+            self.cluster.node_failed(endpoint)
+
     def client_for(self, client, extn):
         return self.extensions.client_for(client, extn)
 
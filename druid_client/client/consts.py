@@ -69,6 +69,15 @@ SQL_CSV = 'csv'
 HEADERS_KEY = 'headers'
 SQL_TYPE_HEADERS_KEY = 'sqlTypesHeader'
 DRUID_TYPE_HEADERS_KEY = 'typesHeader'
+SQL_QUERY_ID_KEY = 'sqlQueryId'
+QUERY_ID_KEY = 'queryId'
+TIMEOUT_KEY = 'timeout'
+
+# Response header which returns the SQL query ID
+SQL_QUERY_ID_HEADER = 'X-Druid-SQL-Query-Id'
+
+# Response header which returns the native query ID
+QUERY_ID_HEADER = 'X-Druid-Query-Id'
 
 # Type names as known to Druid and mentioned in documentation.
 DRUID_STRING_TYPE = "string"
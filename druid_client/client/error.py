@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import requests
+
 class ClientError(Exception):
     """
     Indicates an error with usage of the API.
@@ -25,6 +27,135 @@ class DruidError(Exception):
     def __init__(self, msg):
         self.message = msg
 
+#-------- Query Errors --------
+
+class QueryError(DruidError):
+    """
+    A query failed in Druid. `error` is the error object returned by Druid
+    (or the error text), `status_code` the HTTP status and `query_id` the
+    query ID, if known. `retryable` reports if the failure is transient,
+    such as load shedding, so that the same query may succeed if retried.
+    """
+
+    retryable = False
+
+    def __init__(self, msg, query_id=None, error=None, status_code=None):
+        DruidError.__init__(self, msg)
+        Exception.__init__(self, msg)
+        self.query_id = query_id
+        self.error = error
+        self.status_code = status_code
+
+    def code(self):
+        """
+        Returns the Druid error code, such as "Query capacity exceeded".
+        """
+        if type(self.error) is not dict:
+            return None
+        return self.error.get('errorCode') or self.error.get('error')
+
+class QueryCapacityError(QueryError):
+    """
+    Druid rejected the query because the Broker has too many queries
+    running or queued (HTTP 429, "Query capacity exceeded").
+    """
+
+    retryable = True
+
+class QueryTimeoutError(QueryError):
+    """
+    The query did not complete in time: either Druid timed it out ("Query
+    timeout"), or it did not complete before its client-side deadline, in
+    which case the client cancelled it before raising the error.
+    """
+
+    retryable = True
+
+class ResourceLimitError(QueryError):
+    """
+    The query exceeded a Druid resource limit, such as the merge buffers
+    for a groupBy ("Resource limit exceeded").
+    """
+
+    retryable = True
+
+class QueryUnavailableError(QueryError):
+    """
+    The service was unavailable, or the query was interrupted, as when a
+    node shuts down.
+    """
+
+    retryable = True
+
+class QueryCancelledError(QueryError):
+    """
+    The query was cancelled.
+    """
+
+class QueryValidationError(QueryError):
+    """
+    Druid could not parse, validate or plan the query, or the query uses
+    an unsupported feature. Retrying will not help.
+    """
+
+# Legacy Druid error codes ("error" field of the response)
+query_error_codes = {
+    'Query capacity exceeded': QueryCapacityError,
+    'Query timeout': QueryTimeoutError,
+    'Resource limit exceeded': ResourceLimitError,
+    'Query interrupted': QueryUnavailableError,
+    'Query cancelled': QueryCancelledError,
+    'SQL parse failed': QueryValidationError,
+    'Plan validation failed': QueryValidationError,
+    'Unsupported operation': QueryValidationError,
+    'Query not supported': QueryValidationError,
+    }
+
+# Error categories of newer Druid versions ("category" field)
+query_error_categories = {
+    'CAPACITY_EXCEEDED': QueryCapacityError,
+    'TIMEOUT': QueryTimeoutError,
+    'CANCELED': QueryCancelledError,
+    'INVALID_INPUT': QueryValidationError,
+    'UNSUPPORTED': QueryValidationError,
+    }
+
+query_error_statuses = {
+    requests.codes.too_many_requests: QueryCapacityError,
+    requests.codes.gateway_timeout: QueryTimeoutError,
+    requests.codes.service_unavailable: QueryUnavailableError,
+    requests.codes.bad_gateway: QueryUnavailableError,
+    }
+
+def query_error(status_code, error, msg, query_id=None) -> QueryError:
+    """
+    Returns the typed `QueryError` for a failed query given the HTTP status
+    code, the error object from the response (or the error text) and the
+    error message.
+    """
+    cls = None
+    if type(error) is dict:
+        cls = query_error_codes.get(error.get('error'))
+        if cls is None:
+            cls = query_error_categories.get(error.get('category'))
+    if cls is None:
+        cls = query_error_statuses.get(status_code, QueryError)
+    return cls(msg, query_id, error, status_code)
+
+class CircuitOpenError(DruidError, requests.exceptions.ConnectionError):
+    """
+    Raised, without contacting the service, when the circuit breaker for
+    a service endpoint is open because of repeated failures. A subclass of
+    the `requests` `ConnectionError` so that it is handled as an
+    unreachable service. The endpoint is in `endpoint`.
+    """
+
+    def __init__(self, endpoint):
+        msg = "Circuit open for {}: too many recent failures".format(endpoint)
+        DruidError.__init__(self, msg)
+        requests.exceptions.ConnectionError.__init__(self, msg)
+        self.endpoint = endpoint
+
 class ConfigError(Exception):
     
     def __init__(self, msg):
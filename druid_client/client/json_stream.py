@@ -0,0 +1,188 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Parser states
+START = 0
+KEY = 1
+COLON = 2
+VALUE = 3
+MEMBER_SEP = 4
+FIRST_ROW = 5
+ROW = 6
+ROW_SEP = 7
+DONE = 8
+
+class RowStreamParser:
+    """
+    Incremental parser for a JSON array of rows.
+
+    Druid returns SQL results as a JSON array of rows (the `object` and
+    `array` formats), or as an object with the rows in a member named
+    `results` (the `arrayWithTrailer` format, and scan queries in
+    `compactedList` format which return an array of batches.) This parser
+    accepts the response text in arbitrary chunks, via `feed()`, and
+    returns the rows completed by each chunk, so the caller holds only
+    the rows not yet consumed, plus at most one partial row.
+
+    For the object form, the members other than the rows array are
+    collected in `trailer`.
+    """
+
+    def __init__(self, rows_key=None, decoder=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        rows_key : str, default = None
+            If `None`, the payload is a JSON array of rows. Otherwise, the
+            payload is an object and the rows are in the member with this name.
+
+        decoder : json.JSONDecoder, default = None
+            Decoder used to parse each row. Defaults to the stdlib decoder.
+        """
+        self.rows_key = rows_key
+        self.trailer = {}
+        self._decoder = json.JSONDecoder() if decoder is None else decoder
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._state = START
+        self._key = None
+
+    def feed(self, chunk) -> list:
+        """
+        Parse the next chunk of the payload, which may be `str`, or `bytes`
+        or a `memoryview` (assumed to be UTF-8). Returns the list of rows
+        completed by this chunk, possibly empty.
+        """
+        if not isinstance(chunk, str):
+            chunk = self._text_decoder.decode(chunk)
+        if self._pos > 0:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += chunk
+        rows = []
+        self._parse(rows, False)
+        return rows
+
+    def close(self) -> list:
+        """
+        Signals the end of the payload. Returns any final rows, and raises
+        a `ValueError` if the payload is incomplete or malformed.
+        """
+        rows = []
+        self._buf = self._buf[self._pos:] + self._text_decoder.decode(b'', final=True)
+        self._pos = 0
+        self._parse(rows, True)
+        self._skip_ws()
+        if self._state != DONE or self._pos < len(self._buf):
+            raise ValueError("Incomplete or malformed JSON result at: " + self._buf[self._pos:self._pos + 40])
+        return rows
+
+    def done(self):
+        return self._state == DONE
+
+    def _skip_ws(self):
+        self._pos = WHITESPACE.match(self._buf, self._pos).end()
+        return self._pos < len(self._buf)
+
+    def _decode(self, final):
+        """
+        Decode the next complete JSON value, returning `(True, value)`, or
+        `(False, None)` if more input is needed.
+        """
+        try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return (False, None)
+        # A scalar which ends at the end of the buffer may be truncated.
+        if end == len(self._buf) and not final and type(value) not in (dict, list, str):
+            return (False, None)
+        self._pos = end
+        return (True, value)
+
+    def _expect(self, c):
+        if self._buf[self._pos] != c:
+            raise ValueError("Expected '{}' in JSON result at: {}".format(c, self._buf[self._pos:self._pos + 40]))
+        self._pos += 1
+
+    def _parse(self, rows, final):
+        while self._state != DONE and self._skip_ws():
+            c = self._buf[self._pos]
+            state = self._state
+            if state == START:
+                if self.rows_key is None:
+                    self._expect('[')
+                    self._state = FIRST_ROW
+                else:
+                    self._expect('{')
+                    self._state = KEY
+            elif state == KEY:
+                if c == '}':
+                    self._pos += 1
+                    self._state = DONE
+                    continue
+                ok, key = self._decode(final)
+                if not ok:
+                    return
+                self._key = key
+                self._state = COLON
+            elif state == COLON:
+                self._expect(':')
+                self._state = VALUE
+            elif state == VALUE:
+                if self._key == self.rows_key and c == '[':
+                    self._pos += 1
+                    self._state = FIRST_ROW
+                    continue
+                ok, value = self._decode(final)
+                if not ok:
+                    return
+                self.trailer[self._key] = value
+                self._state = MEMBER_SEP
+            elif state == MEMBER_SEP:
+                if c == ',':
+                    self._pos += 1
+                    self._state = KEY
+                else:
+                    self._expect('}')
+                    self._state = DONE
+            elif state == FIRST_ROW or state == ROW:
+                if c == ']' and state == FIRST_ROW:
+                    self._end_rows()
+                    continue
+                ok, row = self._decode(final)
+                if not ok:
+                    return
+                rows.append(row)
+                self._state = ROW_SEP
+            elif state == ROW_SEP:
+                if c == ',':
+                    self._pos += 1
+                    self._state = ROW
+                else:
+                    self._end_rows()
+
+    def _end_rows(self):
+        self._expect(']')
+        self._state = DONE if self.rows_key is None else MEMBER_SEP
@@ -0,0 +1,350 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-request instrumentation.
+
+Each HTTP request (each attempt, if retried) produces a `RequestEvent`
+which is passed to the request hooks of the cluster configuration. A hook
+sees the event twice: `before_request()` when the request is about to be
+sent, and `after_request()` once the response is read, or the request
+fails. Hooks include:
+
+* `MetricsRegistry`, installed by default, which keeps per-endpoint
+  counters and latency histograms, exportable as a dictionary or in
+  Prometheus text format.
+* `PrintHook`, installed by `trace()`, which prints each request.
+
+Latency is split into phases which add up to the total:
+
+* `connect`: opening the TCP (and TLS) connection, zero if a pooled
+  connection was reused. Not measured for asynchronous clients.
+* `ttfb`: from sending the request to receiving the response headers,
+  that is, the time Druid took to start answering.
+* `download`: reading the response body. For a streamed result, this
+  includes the time the caller spends between reads.
+"""
+
+import math
+import threading
+
+# Histogram bucket bounds, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LATENCY = 'latency'
+CONNECT = 'connect'
+TTFB = 'ttfb'
+DOWNLOAD = 'download'
+PHASES = [LATENCY, CONNECT, TTFB, DOWNLOAD]
+
+class RequestEvent:
+    """
+    One HTTP request attempt.
+
+    `endpoint` is the service base URL; `template` is the REST path with
+    `{}` placeholders, such as `/druid/indexer/v1/task/{}`, so that all the
+    requests for one API group together. `status` is `None`, and `error`
+    the exception, if no response was received. Timings are in seconds;
+    byte counts are of the body only, with `bytes_received` as read from
+    the wire and `body_bytes` after decompression.
+    """
+
+    def __init__(self, method, endpoint, template, url, body=None, attempt=1):
+        self.method = method
+        self.endpoint = endpoint
+        self.template = url if template is None else template
+        self.url = url
+        self.body = body
+        self.attempt = attempt
+        self.streamed = False
+        self.started = None
+        self.status = None
+        self.error = None
+        self.bytes_sent = 0
+        self.bytes_received = None
+        self.body_bytes = None
+        self.latency = None
+        self.connect = None
+        self.ttfb = None
+        self.download = None
+
+    def ok(self):
+        return self.error is None and self.status is not None and self.status < 400
+
+    def phase(self, name):
+        return getattr(self, name)
+
+    def to_dict(self):
+        return {
+            'method': self.method,
+            'endpoint': self.endpoint,
+            'template': self.template,
+            'url': self.url,
+            'attempt': self.attempt,
+            'status': self.status,
+            'error': None if self.error is None else str(self.error),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'body_bytes': self.body_bytes,
+            'latency': self.latency,
+            'connect': self.connect,
+            'ttfb': self.ttfb,
+            'download': self.download,
+            }
+
+    def __str__(self):
+        outcome = self.status if self.error is None else type(self.error).__name__
+        latency = '' if self.latency is None else ' {:.1f} ms'.format(self.latency * 1000)
+        return "{} {} -> {}{}".format(self.method, self.url, outcome, latency)
+
+class RequestHook:
+    """
+    Base class for request hooks. Override either method. A hook must not
+    raise exceptions: any it raises are ignored.
+    """
+
+    def before_request(self, event):
+        pass
+
+    def after_request(self, event):
+        pass
+
+class PrintHook(RequestHook):
+    """
+    Prints each request and its outcome. Handy for debugging.
+    """
+
+    def before_request(self, event):
+        print("{}: {}".format(event.method, event.url))
+        if event.body is not None:
+            print("body:", event.body)
+
+    def after_request(self, event):
+        print(str(event))
+
+def body_size(data) -> int:
+    """
+    Returns the size, in bytes, of a request body as sent.
+    """
+    if data is None:
+        return 0
+    if type(data) is str:
+        return len(data.encode('utf-8'))
+    try:
+        return len(data)
+    except TypeError:
+        # A file or generator.
+        return 0
+
+def fire_before(hooks, event):
+    for hook in hooks:
+        try:
+            hook.before_request(event)
+        except Exception:
+            pass
+
+def fire_after(hooks, event):
+    for hook in hooks:
+        try:
+            hook.after_request(event)
+        except Exception:
+            pass
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket bounds, as in Prometheus.
+    """
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def mean(self):
+        return None if self.count == 0 else self.sum / self.count
+
+    def quantile(self, q):
+        """
+        Estimates the `q` quantile (0 to 1) by interpolating within the
+        bucket which holds it. Values above the last bound are reported as
+        the last bound.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n > 0 and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = 0.0 if i == 0 else self.bounds[i - 1]
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def buckets(self):
+        """
+        Returns the cumulative counts as (bound, count) pairs, ending
+        with `inf`.
+        """
+        result = []
+        total = 0
+        for bound, n in zip(self.bounds + [math.inf], self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.mean(),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            }
+
+class EndpointMetrics:
+    """
+    Counters and histograms for one REST endpoint (method and template).
+    """
+
+    def __init__(self, method, template, bounds=DEFAULT_BUCKETS):
+        self.method = method
+        self.template = template
+        self.requests = 0
+        self.errors = 0
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.body_bytes = 0
+        self.histograms = {phase: Histogram(bounds) for phase in PHASES}
+
+    def record(self, event):
+        self.requests += 1
+        if not event.ok():
+            self.errors += 1
+        status = 'error' if event.status is None else str(event.status)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes_sent += event.bytes_sent or 0
+        self.bytes_received += event.bytes_received or 0
+        self.body_bytes += event.body_bytes or 0
+        for phase in PHASES:
+            value = event.phase(phase)
+            if value is not None:
+                self.histograms[phase].observe(value)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'statuses': dict(self.statuses),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'body_bytes': self.body_bytes,
+            'latency': {phase: h.to_dict() for phase, h in self.histograms.items()},
+            }
+
+def prom_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels) + '}'
+
+def prom_bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+class MetricsRegistry(RequestHook):
+    """
+    In-process metrics for all the requests of a cluster, keyed by
+    HTTP method and endpoint template.
+
+    Obtain the registry via `client.metrics()`. Use `to_dict()` to inspect
+    the metrics, or `to_prometheus()` to expose them to a Prometheus scraper.
+    """
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def after_request(self, event):
+        key = (event.method, event.template)
+        with self._lock:
+            metrics = self._endpoints.get(key)
+            if metrics is None:
+                metrics = EndpointMetrics(event.method, event.template, self.bounds)
+                self._endpoints[key] = metrics
+            metrics.record(event)
+
+    def endpoint(self, method, template) -> EndpointMetrics:
+        return self._endpoints.get((method, template))
+
+    def endpoints(self) -> list:
+        with self._lock:
+            return list(self._endpoints.values())
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def to_dict(self):
+        """
+        Returns the metrics as a map from "METHOD template" to the
+        endpoint's counters and latency summaries.
+        """
+        with self._lock:
+            return {"{} {}".format(m.method, m.template): m.to_dict() for m in self._endpoints.values()}
+
+    def to_prometheus(self, prefix='druid_client') -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            endpoints = sorted(self._endpoints.values(), key=lambda m: (m.template, m.method))
+            lines.append('# HELP {}_requests_total HTTP requests by endpoint and status.'.format(prefix))
+            lines.append('# TYPE {}_requests_total counter'.format(prefix))
+            for m in endpoints:
+                for status, n in sorted(m.statuses.items()):
+                    labels = [('method', m.method), ('endpoint', m.template), ('status', status)]
+                    lines.append('{}_requests_total{} {}'.format(prefix, prom_labels(labels), n))
+            lines.append('# HELP {}_bytes_total Body bytes by endpoint and direction.'.format(prefix))
+            lines.append('# TYPE {}_bytes_total counter'.format(prefix))
+            for m in endpoints:
+                for direction, n in [('sent', m.bytes_sent), ('received', m.bytes_received), ('decoded', m.body_bytes)]:
+                    labels = [('method', m.method), ('endpoint', m.template), ('direction', direction)]
+                    lines.append('{}_bytes_total{} {}'.format(prefix, prom_labels(labels), n))
+            lines.append('# HELP {}_request_seconds Request latency by endpoint and phase.'.format(prefix))
+            lines.append('# TYPE {}_request_seconds histogram'.format(prefix))
+            for m in endpoints:
+                for phase in PHASES:
+                    h = m.histograms[phase]
+                    if h.count == 0:
+                        continue
+                    labels = [('method', m.method), ('endpoint', m.template), ('phase', phase)]
+                    for bound, n in h.buckets():
+                        lines.append('{}_request_seconds_bucket{} {}'.format(
+                            prefix, prom_labels(labels + [('le', prom_bound(bound))]), n))
+                    lines.append('{}_request_seconds_sum{} {}'.format(prefix, prom_labels(labels), repr(h.sum)))
+                    lines.append('{}_request_seconds_count{} {}'.format(prefix, prom_labels(labels), h.count))
+        return '\n'.join(lines) + '\n'
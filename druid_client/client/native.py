@@ -0,0 +1,455 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Native (JSON) queries.
+
+Build a query from the client, then run it:
+
+    rows = (client.timeseries('wikipedia')
+        .with_interval('2022-01-01', '2022-02-01')
+        .with_granularity('day')
+        .with_aggregations(count('rows'), long_sum('added'))
+        .run()
+        .rows())
+
+The results have the same API as SQL results (`rows()`, `schema()`,
+`columnar()`, `df()`), with Druid's nested result objects flattened to
+one dictionary per row: timeseries, topN and groupBy rows carry the
+bucket `timestamp` plus the aggregates and dimensions.
+
+Scan queries are for bulk extraction. They use the `compactedList` result
+format, in which each batch of rows lists its column names once, followed
+by the rows as arrays: far less JSON per row than the object format. The
+response is streamed: rows are parsed batch by batch as they arrive, in
+constant memory, as `sql_stream()` does for SQL. Specify the columns
+(`with_columns()`) for a stable schema: otherwise, the schema is that of
+the first batch, and columns which appear only in later batches (from
+segments with other columns) are dropped.
+"""
+
+import copy
+import uuid
+from . import consts
+from .error import ClientError
+from .json_stream import RowStreamParser
+from .sql import ColumnSchema, SqlQueryResult, SqlStreamResult, AbstractSqlQueryResult, parse_object_schema
+from .util import druid_range
+
+ETERNITY = '-146136543-09-08T08:23:32.096Z/146140482-04-24T15:36:27.903Z'
+
+SCAN_COMPACTED_LIST = 'compactedList'
+SCAN_LIST = 'list'
+
+#-------- Aggregators and Filters --------
+
+def count(name='count'):
+    return {'type': 'count', 'name': name}
+
+def field_aggregator(type):
+    def agg(name, field=None):
+        return {'type': type, 'name': name, 'fieldName': name if field is None else field}
+    return agg
+
+long_sum = field_aggregator('longSum')
+long_min = field_aggregator('longMin')
+long_max = field_aggregator('longMax')
+double_sum = field_aggregator('doubleSum')
+double_min = field_aggregator('doubleMin')
+double_max = field_aggregator('doubleMax')
+
+def selector(dimension, value):
+    return {'type': 'selector', 'dimension': dimension, 'value': value}
+
+def in_filter(dimension, values):
+    return {'type': 'in', 'dimension': dimension, 'values': list(values)}
+
+def and_filter(*filters):
+    return {'type': 'and', 'fields': list(filters)}
+
+def or_filter(*filters):
+    return {'type': 'or', 'fields': list(filters)}
+
+def not_filter(filter):
+    return {'type': 'not', 'field': filter}
+
+#-------- Queries --------
+
+class NativeQuery:
+    """
+    A native query: a builder for the JSON query object.
+
+    The `with_*()` methods set the common members, and each return the
+    query. `with_spec()` sets any other member. The query is sent as built
+    at the time it runs.
+    """
+
+    query_type = None
+
+    def __init__(self, client, datasource=None, spec=None):
+        self.client = client
+        self.spec = {} if spec is None else dict(spec)
+        if self.query_type is not None:
+            self.spec['queryType'] = self.query_type
+        if datasource is not None:
+            self.spec['dataSource'] = datasource
+        self.context = self.spec.pop('context', None)
+        self.query_id = None
+        self.timeout = None
+
+    def with_spec(self, key, value):
+        self.spec[key] = value
+        return self
+
+    def with_interval(self, start, end):
+        """
+        Sets the query interval [start, end), as datetimes or ISO strings.
+        """
+        return self.with_intervals([druid_range(start, end)])
+
+    def with_intervals(self, intervals):
+        return self.with_spec('intervals', list(intervals))
+
+    def with_filter(self, filter):
+        return self.with_spec('filter', filter)
+
+    def with_context(self, context):
+        if self.context is None:
+            self.context = context
+        else:
+            self.context.update(context)
+        return self
+
+    def with_query_id(self, query_id):
+        return self.with_context({consts.QUERY_ID_KEY: query_id})
+
+    def with_timeout(self, seconds):
+        """
+        Sets a deadline, in seconds, as for `SqlRequest.with_timeout()`.
+        """
+        self.timeout = seconds
+        return self
+
+    def copy(self):
+        """
+        Returns a copy of this query, with its own spec and context.
+        """
+        query = copy.copy(self)
+        query.spec = dict(self.spec)
+        query.query_id = None
+        if self.context is not None:
+            query.context = dict(self.context)
+        return query
+
+    def query_type_name(self):
+        return self.spec.get('queryType')
+
+    def to_request(self):
+        """
+        Returns the JSON query object. Assigns the query ID, as for
+        `SqlRequest.to_request()`.
+        """
+        query_obj = dict(self.spec)
+        if self.query_type_name() != 'segmentMetadata':
+            query_obj.setdefault('intervals', [ETERNITY])
+        context = {} if self.context is None else dict(self.context)
+        self.query_id = context.get(consts.QUERY_ID_KEY)
+        if self.query_id is None:
+            self.query_id = str(uuid.uuid4())
+            context[consts.QUERY_ID_KEY] = self.query_id
+        if self.timeout is not None and consts.TIMEOUT_KEY not in context:
+            context[consts.TIMEOUT_KEY] = int(self.timeout * 1000)
+        query_obj['context'] = context
+        return query_obj
+
+    def format(self):
+        return consts.SQL_OBJECT
+
+    def header_context(self):
+        return {}
+
+    def flatten(self, results) -> list:
+        """
+        Converts the response to a list of rows.
+        """
+        return results
+
+    def run(self):
+        return self.client.native_query(self)
+
+class AggregateQuery(NativeQuery):
+    """
+    Base for the queries which aggregate over time buckets.
+    """
+
+    def __init__(self, client, datasource=None, spec=None):
+        NativeQuery.__init__(self, client, datasource, spec)
+        self.spec.setdefault('granularity', 'all')
+
+    def with_granularity(self, granularity):
+        return self.with_spec('granularity', granularity)
+
+    def with_aggregations(self, *aggregations):
+        return self.with_spec('aggregations', list(aggregations))
+
+    def with_post_aggregations(self, *post_aggregations):
+        return self.with_spec('postAggregations', list(post_aggregations))
+
+class TimeseriesQuery(AggregateQuery):
+
+    query_type = 'timeseries'
+
+    def with_descending(self, descending=True):
+        return self.with_spec('descending', descending)
+
+    def flatten(self, results):
+        return [{'timestamp': r.get('timestamp'), **r.get('result', {})} for r in results]
+
+class TopNQuery(AggregateQuery):
+
+    query_type = 'topN'
+
+    def with_dimension(self, dimension):
+        return self.with_spec('dimension', dimension)
+
+    def with_metric(self, metric):
+        return self.with_spec('metric', metric)
+
+    def with_threshold(self, threshold):
+        return self.with_spec('threshold', threshold)
+
+    def flatten(self, results):
+        rows = []
+        for bucket in results:
+            for r in bucket.get('result', []):
+                rows.append({'timestamp': bucket.get('timestamp'), **r})
+        return rows
+
+class GroupByQuery(AggregateQuery):
+
+    query_type = 'groupBy'
+
+    def with_dimensions(self, *dimensions):
+        return self.with_spec('dimensions', list(dimensions))
+
+    def with_having(self, having):
+        return self.with_spec('having', having)
+
+    def with_limit(self, limit, order_by=None):
+        """
+        Limits the result to `limit` rows, ordered by the given columns
+        (names or `OrderByColumnSpec` objects), if any.
+        """
+        return self.with_spec('limitSpec', {'type': 'default', 'limit': limit, 'columns': order_by or []})
+
+    def flatten(self, results):
+        return [{'timestamp': r.get('timestamp'), **r.get('event', {})} for r in results]
+
+class SegmentMetadataQuery(NativeQuery):
+    """
+    Returns one row per segment (or one in all, if merged) describing its
+    columns, size and row count.
+    """
+
+    query_type = 'segmentMetadata'
+
+    def with_analysis_types(self, *types):
+        return self.with_spec('analysisTypes', list(types))
+
+    def with_merge(self, merge=True):
+        return self.with_spec('merge', merge)
+
+class ScanQuery(NativeQuery):
+    """
+    Returns raw rows. Runs as a stream: see `ScanStreamResult`.
+    """
+
+    query_type = 'scan'
+
+    def __init__(self, client, datasource=None, spec=None):
+        NativeQuery.__init__(self, client, datasource, spec)
+        self.spec.setdefault('resultFormat', SCAN_COMPACTED_LIST)
+
+    def with_columns(self, *columns):
+        return self.with_spec('columns', list(columns))
+
+    def with_limit(self, limit):
+        return self.with_spec('limit', limit)
+
+    def with_order(self, order):
+        """
+        Orders by `__time`: 'ascending', 'descending' or 'none'.
+        """
+        return self.with_spec('order', order)
+
+    def with_batch_size(self, rows):
+        return self.with_spec('batchSize', rows)
+
+    def with_result_format(self, format):
+        return self.with_spec('resultFormat', format)
+
+    def columns(self):
+        return self.spec.get('columns') or None
+
+    def format(self):
+        if self.spec.get('resultFormat') == SCAN_COMPACTED_LIST:
+            return consts.SQL_ARRAY
+        return consts.SQL_OBJECT
+
+    def flatten(self, results):
+        rows = []
+        for batch in results:
+            events = batch.get('events', [])
+            if self.format() == consts.SQL_ARRAY:
+                columns = batch.get('columns', [])
+                rows.extend(dict(zip(columns, event)) for event in events)
+            else:
+                rows.extend(events)
+        return rows
+
+    def run(self):
+        return self.client.native_stream(self)
+
+    def stream(self, chunk_size=None):
+        return self.client.native_stream(self, chunk_size)
+
+query_classes = {
+    'timeseries': TimeseriesQuery,
+    'topN': TopNQuery,
+    'groupBy': GroupByQuery,
+    'segmentMetadata': SegmentMetadataQuery,
+    'scan': ScanQuery,
+}
+
+def native_query_for(client, query) -> NativeQuery:
+    """
+    Returns a query object for a query object or a JSON query dictionary.
+    """
+    if isinstance(query, NativeQuery):
+        return query
+    if type(query) is not dict:
+        raise ClientError("A native query must be a NativeQuery or a dictionary.")
+    cls = query_classes.get(query.get('queryType'), NativeQuery)
+    return cls(client, spec=query)
+
+#-------- Results --------
+
+class NativeQueryResult(SqlQueryResult):
+    """
+    Result of a native query, read in full, with the rows flattened per
+    the query type. A scan query, run this way, returns dictionaries.
+    """
+
+    def id(self):
+        if self.http_response is None:
+            return self.request.query_id
+        return self.http_response.headers.get(consts.QUERY_ID_HEADER, self.request.query_id)
+
+    def format(self):
+        return consts.SQL_OBJECT
+
+    def rows(self):
+        if self._rows is None:
+            json = self.json()
+            if json is None:
+                return self.http_response.text
+            self._rows = self.request.flatten(json)
+        return self._rows
+
+    def schema(self):
+        if self._schema is None:
+            self._schema = parse_object_schema(self.rows())
+        return self._schema
+
+    def columnar(self):
+        if self._columnar is None:
+            self._columnar = AbstractSqlQueryResult.columnar(self)
+        return self._columnar
+
+class ScanBatchParser:
+    """
+    Parses a streamed scan response, an array of batches, and returns the
+    rows of each batch. In the `compactedList` format, rows are arrays
+    ordered as in `columns`: the columns requested, else those of the
+    first batch.
+    """
+
+    def __init__(self, compacted, columns=None):
+        self.compacted = compacted
+        self.columns = columns
+        self.trailer = {}
+        self._parser = RowStreamParser()
+
+    def feed(self, chunk) -> list:
+        return self._expand(self._parser.feed(chunk))
+
+    def close(self) -> list:
+        return self._expand(self._parser.close())
+
+    def _expand(self, batches):
+        rows = []
+        for batch in batches:
+            events = batch.get('events', [])
+            if not self.compacted:
+                rows.extend(events)
+                continue
+            columns = batch.get('columns', [])
+            if self.columns is None:
+                self.columns = columns
+            if columns == self.columns:
+                rows.extend(events)
+                continue
+            index = {name: i for i, name in enumerate(columns)}
+            posns = [index.get(name) for name in self.columns]
+            rows.extend([None if p is None else event[p] for p in posns] for event in events)
+        return rows
+
+class ScanStreamResult(SqlStreamResult):
+    """
+    Streamed result of a scan query. Iterate over the result to obtain
+    the rows, as for `SqlStreamResult`: arrays in the `compactedList`
+    format, dictionaries in the `list` format. The schema is available
+    once the first batch arrives, or at once if the query lists its columns.
+    """
+
+    def __init__(self, request, response, chunk_size=None, deadline=None, on_complete=None):
+        SqlStreamResult.__init__(self, request, response, chunk_size, deadline, on_complete)
+        self._batches = ScanBatchParser(request.format() == consts.SQL_ARRAY, request.columns())
+        if self._parser is not None:
+            self._parser = self._batches
+
+    def id(self):
+        if self.http_response is None:
+            return self.request.query_id
+        return self.http_response.headers.get(consts.QUERY_ID_HEADER, self.request.query_id)
+
+    def _cancel_query(self, query_id):
+        return self.request.client.cancel_native(query_id)
+
+    def schema(self):
+        if self._schema is not None:
+            return self._schema
+        if not self.ok():
+            return []
+        if self.format() == consts.SQL_OBJECT:
+            self._fill(1)
+            self._schema = parse_object_schema(list(self._pending)[:1])
+            return self._schema
+        if self._batches.columns is None:
+            self._fill(1)
+        # Scan returns `__time` as milliseconds since the epoch.
+        self._schema = [
+            ColumnSchema(name, 'TIMESTAMP', consts.DRUID_LONG_TYPE) if name == consts.TIME_COL else ColumnSchema(name, None, None)
+            for name in self._batches.columns or []]
+        return self._schema
@@ -0,0 +1,210 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keyset pagination of large query results.
+
+An export of millions of rows can exceed the Broker's result limits, and
+paging with OFFSET rescans every skipped row. Instead, each page is a
+query which orders by a key and starts where the previous page ended:
+
+    SELECT * FROM wikipedia
+    WHERE {keyset} AND channel = '#en.wikipedia'
+
+The `{keyset}` placeholder marks where the predicate on the key belongs:
+`TRUE` for the first page, then `key >= last` where `last` is the key of
+the last row of the previous page. The pager appends the ORDER BY and
+LIMIT clauses, so the query must not have its own.
+
+The key need not be unique, as `__time` usually is not: rows which share
+the boundary value are returned again by the next page, and are dropped
+there. A compound key, such as `['__time', 'id']`, narrows the ties. A
+page which consists entirely of one key value cannot be advanced past, so
+the page size must exceed the largest number of rows which share a key.
+
+While the caller processes one page, the next is fetched on a background
+thread.
+"""
+
+import json
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from . import consts
+from .error import ClientError
+from .sql import AbstractSqlQueryResult, SqlQueryResult
+from .tracing import in_current_context
+from .util import as_datetime, datetime_to_sql, quote_col
+
+KEYSET_PLACEHOLDER = '{keyset}'
+
+def key_literal(col, value) -> str:
+    """
+    Returns a SQL literal for a key value from a result row.
+    """
+    if value is None:
+        raise ClientError("Cannot page on column {}: the boundary row has a null value.".format(col))
+    if col == consts.TIME_COL:
+        if type(value) is int:
+            return 'MILLIS_TO_TIMESTAMP({})'.format(value)
+        return "TIMESTAMP '{}'".format(datetime_to_sql(as_datetime(value)))
+    if type(value) is int or type(value) is float:
+        return repr(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+def keyset_predicate(keys, values) -> str:
+    """
+    Returns a predicate which selects rows whose key is at or after the
+    given values in lexicographic order. For keys (a, b):
+    `(a > x) OR (a = x AND b >= y)`.
+    """
+    literals = [key_literal(k, v) for k, v in zip(keys, values)]
+    terms = []
+    for i in range(len(keys)):
+        op = '>=' if i == len(keys) - 1 else '>'
+        parts = ['{} = {}'.format(quote_col(keys[j]), literals[j]) for j in range(i)]
+        parts.append('{} {} {}'.format(quote_col(keys[i]), op, literals[i]))
+        terms.append('(' + ' AND '.join(parts) + ')')
+    return ' OR '.join(terms)
+
+def page_sql(sql, keys, values, page_size) -> str:
+    predicate = 'TRUE' if values is None else keyset_predicate(keys, values)
+    return '{} ORDER BY {} LIMIT {}'.format(
+        sql.replace(KEYSET_PLACEHOLDER, '(' + predicate + ')').rstrip().rstrip(';'),
+        ', '.join(quote_col(k) for k in keys), page_size)
+
+def row_identity(row) -> str:
+    return json.dumps(row, sort_keys=True, default=str)
+
+class PageResult(SqlQueryResult):
+    """
+    One page of a paged query: the result of the page query, less the rows
+    which the previous page already returned.
+    """
+
+    def __init__(self, result, rows):
+        SqlQueryResult.__init__(self, result.request, result.http_response)
+        self._json = result.json()
+        self._rows = rows
+
+    def columnar(self):
+        if self._columnar is None:
+            self._columnar = AbstractSqlQueryResult.columnar(self)
+        return self._columnar
+
+class KeysetPager:
+    """
+    Runs the page queries for `Client.sql_pages()`.
+    """
+
+    def __init__(self, client, request, page_size, keys, prefetch):
+        self.client = client
+        self.request = request
+        self.page_size = page_size
+        self.keys = keys
+        self.prefetch = prefetch
+        # Key of the last row returned, and the rows returned with that key.
+        self._boundary = None
+        self._seen = Counter()
+
+    def _page_request(self):
+        request = self.request.derive(page_sql(self.request.sql, self.keys, self._boundary, self.page_size))
+        # A page query must not be answered from the result cache: the
+        # page boundaries depend on the rows the previous pages returned.
+        request.with_cache(False)
+        # Each page needs its own query ID, so that an abandoned prefetch
+        # can be cancelled.
+        return request.with_query_id(str(uuid.uuid4()))
+
+    def _fetch(self, request):
+        result = self.client.sql_query(request)
+        result.raise_for_error()
+        return result
+
+    def _key_of(self, result):
+        if result.format() == consts.SQL_OBJECT:
+            return lambda row: tuple(row.get(k) for k in self.keys)
+        names = [c.name for c in result.schema()]
+        missing = [k for k in self.keys if k not in names]
+        if missing:
+            raise ClientError("The result does not include the order key columns: " + ', '.join(missing))
+        index = [names.index(k) for k in self.keys]
+        return lambda row: tuple(row[i] for i in index)
+
+    def _advance(self, result):
+        """
+        Drops rows returned by the previous page and moves the boundary to
+        the last row. Returns the page, and `True` if there may be more pages.
+        """
+        rows = result.rows()
+        if not rows:
+            return result, False
+        key_of = self._key_of(result)
+        last = key_of(rows[-1])
+        if self._boundary is not None and key_of(rows[0]) == last == self._boundary and len(rows) >= self.page_size:
+            raise ClientError("More than {} rows share the order key value {}: use a larger page size or a more selective key.".format(
+                self.page_size, last))
+        fresh = []
+        for row in rows:
+            if self._boundary is not None and key_of(row) == self._boundary:
+                identity = row_identity(row)
+                if self._seen[identity] > 0:
+                    self._seen[identity] -= 1
+                    continue
+            fresh.append(row)
+        more = len(rows) >= self.page_size
+        self._seen = Counter()
+        for row in fresh:
+            if key_of(row) == last:
+                self._seen[row_identity(row)] += 1
+        self._boundary = last
+        return PageResult(result, fresh), more
+
+    def pages(self):
+        if not self.prefetch:
+            while True:
+                page, more = self._advance(self._fetch(self._page_request()))
+                yield page
+                if not more:
+                    return
+        executor = ThreadPoolExecutor(max_workers=1)
+        request = self._page_request()
+        future = executor.submit(in_current_context(self._fetch), request)
+        try:
+            while future is not None:
+                page, more = self._advance(future.result())
+                future = None
+                if more:
+                    request = self._page_request()
+                    future = executor.submit(in_current_context(self._fetch), request)
+                yield page
+        finally:
+            if future is not None and not future.cancel():
+                # The abandoned prefetch is running: cancel its query.
+                self.client._cancel_quietly(request.context[consts.SQL_QUERY_ID_KEY])
+            executor.shutdown(wait=False)
+
+def run_pages(client, request, page_size, order_key, prefetch):
+    if type(request) == str:
+        request = client.sql_request(request)
+    if KEYSET_PLACEHOLDER not in request.sql:
+        raise ClientError("The query must contain a " + KEYSET_PLACEHOLDER + " placeholder.")
+    if page_size < 1:
+        raise ClientError("The page size must be positive.")
+    keys = [order_key] if type(order_key) is str else list(order_key)
+    if not keys:
+        raise ClientError("No order key provided.")
+    if request.format() != consts.SQL_OBJECT and not request.header_context()[consts.HEADERS_KEY]:
+        raise ClientError("Paging a result in an array format requires the header row.")
+    return KeysetPager(client, request, page_size, keys, prefetch).pages()
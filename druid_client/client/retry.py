@@ -0,0 +1,438 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Retries of transient failures, and per-endpoint circuit breakers.
+
+Druid returns 502 or 503 and drops connections during routine events
+such as leader elections and rolling restarts. The `RetryPolicy` retries
+idempotent requests which fail this way, with exponential backoff and
+jitter, honoring any `Retry-After` header. A `CircuitBreaker` per endpoint
+counts consecutive failures: once a node has failed repeatedly, requests
+to it fail at once with a `CircuitOpenError` instead of each waiting for
+a connection timeout, until a trial request after `reset_timeout` succeeds.
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from .error import CircuitOpenError
+
+# HTTP status codes which indicate a transient failure. Druid reports
+# query timeouts as 504: those are left to the QueryRetryPolicy.
+TRANSIENT_STATUS_CODES = frozenset([
+    requests.codes.bad_gateway,
+    requests.codes.service_unavailable,
+    ])
+
+# HTTP methods which are safe to retry.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class Backoff:
+    """
+    Exponential backoff with "full jitter": the delay before retry `n`
+    (from 0) is random between zero and `base * multiplier ** n`, capped at
+    `max_delay`. Jitter spreads out the retries of many clients which
+    failed at the same moment.
+    """
+
+    def __init__(self, base=0.1, multiplier=2.0, max_delay=10.0, jitter=True):
+        self.base = base
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def ceiling(self, attempt) -> float:
+        return min(self.max_delay, self.base * self.multiplier ** attempt)
+
+    def delay(self, attempt) -> float:
+        """
+        Returns the delay, in seconds, before retry number `attempt` (from 0).
+        """
+        ceiling = self.ceiling(attempt)
+        return random.uniform(0, ceiling) if self.jitter else ceiling
+
+def retry_after(response, now=None):
+    """
+    Returns the delay, in seconds, requested by the `Retry-After` header
+    of the response (in seconds or as an HTTP date), or `None`.
+    """
+    headers = getattr(response, 'headers', None)
+    value = None if headers is None else headers.get('Retry-After')
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc) if now is None else now
+    return max(0.0, (when - now).total_seconds())
+
+class RetryMetrics:
+    """
+    Counters for retries, circuit breakers and query retries, shared by
+    all the clients of a cluster.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.recovered = 0
+        self.exhausted = 0
+        self.breaker_opens = 0
+        self.breaker_rejections = 0
+        self.query_retries = 0
+        self.query_recovered = 0
+        self.query_exhausted = 0
+        self._lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'recovered': self.recovered,
+            'exhausted': self.exhausted,
+            'breaker_opens': self.breaker_opens,
+            'breaker_rejections': self.breaker_rejections,
+            'query_retries': self.query_retries,
+            'query_recovered': self.query_recovered,
+            'query_exhausted': self.query_exhausted,
+            }
+
+class RetryPolicy:
+    """
+    Decides whether and when to retry a failed request.
+
+    Only idempotent requests are retried: GET, DELETE and similar, plus
+    POSTs which the caller marks idempotent, such as SQL SELECT queries.
+    A request is retried after a connection error or a transient status
+    code (502, 503), up to `max_attempts` attempts in all.
+    Request timeouts are not retried.
+    """
+
+    def __init__(self, max_attempts=3, backoff=None, status_codes=TRANSIENT_STATUS_CODES,
+            max_retry_after=30.0, sleep=time.sleep):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        max_attempts : int, default = 3
+            Maximum number of attempts, including the first.
+
+        backoff : Backoff, default = Backoff()
+            Delays between attempts.
+
+        status_codes : set, default = 502, 503
+            HTTP status codes which are retried.
+
+        max_retry_after : float, default = 30
+            Upper bound, in seconds, on a delay requested via `Retry-After`.
+
+        sleep : function, default = time.sleep
+            Function used to wait between attempts.
+        """
+        self.max_attempts = max_attempts
+        self.backoff = Backoff() if backoff is None else backoff
+        self.status_codes = status_codes
+        self.max_retry_after = max_retry_after
+        self.sleep = sleep
+
+    def is_retryable(self, method, idempotent=None) -> bool:
+        if idempotent is not None:
+            return idempotent
+        return method in IDEMPOTENT_METHODS
+
+    def delay(self, attempt, response=None) -> float:
+        """
+        Returns the delay before retry number `attempt` (from 0): the backoff
+        delay, or the server's `Retry-After` delay if longer.
+        """
+        delay = self.backoff.delay(attempt)
+        requested = None if response is None else retry_after(response)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_retry_after))
+        return delay
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one endpoint.
+
+    Closed: requests flow; consecutive failures are counted. After
+    `failure_threshold` consecutive failures the breaker opens: requests
+    fail at once with `CircuitOpenError`. After `reset_timeout` seconds
+    the breaker is half open: one trial request is let through. Success
+    closes the breaker, failure opens it again.
+
+    Only connection errors and transient HTTP statuses are failures. A
+    request which ends otherwise, such as with a read timeout or when the
+    caller cancels it, calls `release()` instead, which neither counts a
+    failure nor leaves a half-open breaker waiting on its trial.
+    """
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic, metrics=None):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.metrics = metrics
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Raises `CircuitOpenError` if requests to the endpoint are blocked.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial = False
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+        if self.metrics is not None:
+            self.metrics.incr('breaker_rejections')
+        raise CircuitOpenError(self.endpoint)
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def release(self):
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        opened = False
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self._trial = False
+                opened = True
+        if opened and self.metrics is not None:
+            self.metrics.incr('breaker_opens')
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            }
+
+class CircuitBreakers:
+    """
+    The circuit breakers for the endpoints of a cluster, created on demand.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic, metrics=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.metrics = metrics
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout, self.clock, self.metrics)
+                self._breakers[endpoint] = breaker
+            return breaker
+
+    def states(self):
+        """
+        Returns a map from endpoint to the state of its breaker.
+        """
+        with self._lock:
+            return {endpoint: b.to_dict() for endpoint, b in self._breakers.items()}
+
+def send_with_retry(config, endpoint, send, method, idempotent=None):
+    """
+    Calls `send()`, which issues one HTTP request to `endpoint` and returns
+    the response, retrying per the cluster configuration's retry policy
+    and guarding the endpoint with its circuit breaker.
+    """
+    policy = config.retry_policy
+    metrics = config.retry_metrics
+    breaker = None if config.breakers is None else config.breakers.breaker(endpoint)
+    attempts = 1
+    if policy is not None and policy.is_retryable(method, idempotent):
+        attempts = max(1, policy.max_attempts)
+    metrics.incr('requests')
+    for attempt in range(attempts):
+        if breaker is not None:
+            breaker.before_request()
+        last = attempt == attempts - 1
+        try:
+            response = send()
+        except requests.exceptions.ConnectionError:
+            if breaker is not None:
+                breaker.record_failure()
+            if last:
+                if attempts > 1:
+                    metrics.incr('exhausted')
+                raise
+            metrics.incr('retries')
+            policy.sleep(policy.delay(attempt))
+            continue
+        except BaseException:
+            # Not a failure of the endpoint, such as a read timeout or an
+            # interrupt: not retried, and not counted by the breaker.
+            if breaker is not None:
+                breaker.release()
+            raise
+        codes = TRANSIENT_STATUS_CODES if policy is None else policy.status_codes
+        transient = response.status_code in codes
+        if not transient:
+            if breaker is not None:
+                breaker.record_success()
+            if attempt > 0:
+                metrics.incr('recovered')
+            return response
+        if breaker is not None:
+            breaker.record_failure()
+        if last:
+            if attempts > 1:
+                metrics.incr('exhausted')
+            return response
+        if breaker is not None and breaker.state == OPEN:
+            return response
+        metrics.incr('retries')
+        delay = policy.delay(attempt, response)
+        response.close()
+        policy.sleep(delay)
+
+#-------- Query Retries --------
+
+# Query context keys for the query priority and lane.
+PRIORITY_KEY = 'priority'
+LANE_KEY = 'lane'
+
+class QueryRetryPolicy:
+    """
+    Retries queries which Druid rejects for transient reasons: a Broker
+    shedding load (HTTP 429, "Query capacity exceeded"), a Druid query
+    timeout, a resource limit, or an interrupted query. See the
+    `retryable` attribute of the `QueryError` classes.
+
+    Each retry may run at a lower priority (`priority_step` less than the
+    previous attempt, via the `priority` context key) and in a given query
+    lane (the `lane` context key), so that retries do not compete with
+    fresh queries. When queries run through a `BrokerPool`, each retry
+    goes to a different Broker if one is available.
+
+    Queries with a client-side timeout are not retried.
+    """
+
+    def __init__(self, max_attempts=3, backoff=None, priority_step=0, lane=None,
+            max_retry_after=30.0, sleep=time.sleep):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        max_attempts : int, default = 3
+            Maximum number of attempts, including the first.
+
+        backoff : Backoff, default = Backoff(base=0.5)
+            Delays between attempts.
+
+        priority_step : int, default = 0
+            Amount by which to lower the query priority on each retry.
+
+        lane : str, default = None
+            Query lane for retries, if any.
+
+        max_retry_after : float, default = 30
+            Upper bound, in seconds, on a delay requested via `Retry-After`.
+
+        sleep : function, default = time.sleep
+            Function used to wait between attempts.
+        """
+        self.max_attempts = max_attempts
+        self.backoff = Backoff(base=0.5) if backoff is None else backoff
+        self.priority_step = priority_step
+        self.lane = lane
+        self.max_retry_after = max_retry_after
+        self.sleep = sleep
+
+    def retry_request(self, request):
+        """
+        Returns the request for the next attempt: a copy with the lowered
+        priority and retry lane, if configured, else the request itself.
+        """
+        if not self.priority_step and self.lane is None:
+            return request
+        request = request.copy()
+        context = {}
+        if self.priority_step:
+            priority = (request.context or {}).get(PRIORITY_KEY, 0)
+            context[PRIORITY_KEY] = priority - self.priority_step
+        if self.lane is not None:
+            context[LANE_KEY] = self.lane
+        return request.with_context(context)
+
+    def delay(self, attempt, response=None) -> float:
+        delay = self.backoff.delay(attempt)
+        requested = None if response is None else retry_after(response)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_retry_after))
+        return delay
+
+def run_query_with_retry(policy, metrics, request, run):
+    """
+    Runs a SQL or native query request via `run(request, attempt)`, which
+    returns a query result, retrying retryable Druid errors per `policy`
+    (if not `None`). Returns the first successful result, or the last failure.
+    """
+    attempts = 1 if policy is None or request.timeout is not None else max(1, policy.max_attempts)
+    for attempt in range(attempts):
+        result = run(request, attempt)
+        if result.ok():
+            if attempt > 0:
+                metrics.incr('query_recovered')
+            return result
+        if attempt == attempts - 1 or not result.druid_error().retryable:
+            if attempt > 0:
+                metrics.incr('query_exhausted')
+            return result
+        metrics.incr('query_retries')
+        policy.sleep(policy.delay(attempt, result.http_response))
+        request = policy.retry_request(request)
@@ -12,9 +12,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 from urllib.parse import quote
 import requests
 from .util import is_blank, dict_get
+from .retry import send_with_retry
+from .compression import compress_body, wire_bytes
+from .sessions import reset_connect_time, connect_time
+from .metrics import RequestEvent, body_size, fire_before, fire_after
+from .tracing import current_span, traceparent
+
+def is_ok_status(code):
+    """
+    Returns `True` if the HTTP status code is OK or Accepted.
+    """
+    return code == requests.codes.ok or code == requests.codes.accepted
+
+def error_reason(code, json):
+    """
+    Returns the error message to report for a failed response given
+    the status code and the parsed JSON payload, if any. Returns `None`
+    if the default HTTP reason should be used.
+    """
+    error = None
+    msg = dict_get(json, 'error') if type(json) is dict else None
+    if type(msg) is str and not is_blank(msg):
+        error = msg
+    if code == requests.codes.not_found and error is None:
+        error = "Not found"
+    return error
 
 def check_error(response):
     """
@@ -25,19 +51,14 @@ def check_error(response):
     payload, if any, is returned in the json field of the error.
     """
     code = response.status_code
-    if code == requests.codes.ok or code == requests.codes.accepted:
+    if is_ok_status(code):
         return
-    error = None
     json = None
     try:
         json = response.json()
-        msg = dict_get(json, 'error')
-        if not is_blank(msg):
-            error = msg
     except Exception:
         pass
-    if code == requests.codes.not_found and error is None:
-        error = "Not found"
+    error = error_reason(code, json)
     if error is not None:
         response.reason = error
     try:
@@ -46,22 +67,190 @@ def check_error(response):
         e.json = json
         raise e
 
+JSON_CONTENT_TYPE = 'application/json'
+
 STATUS_BASE = "/status"
 REQ_STATUS = STATUS_BASE
 REQ_HEALTH = STATUS_BASE + "/health"
 REQ_PROPERTIES = STATUS_BASE + "/properties"
 REQ_IN_CLUSTER = STATUS_BASE + "/selfDiscovered/status"
 
+def build_url(endpoint, req, args=None) -> str:
+    """
+    Returns the full URL for a REST call given the service endpoint, the
+    relative request API and optional parameters to fill placeholders
+    within the request URL.
+    """
+    url = endpoint + req
+    if args is not None:
+        quoted = [quote(arg) for arg in args]
+        url = url.format(*quoted)
+    return url
+
 class Service:
 
     def __init__(self, cluster_config, endpoint):
         self.cluster_config = cluster_config
         self.endpoint = endpoint
-        self.session = requests.Session()
-        self.session.verify = cluster_config.tls_cert
+        # The session, and so the connection pool, is shared by all clients
+        # for this endpoint.
+        self.session = cluster_config.sessions.acquire(endpoint)
+        self._released = False
 
     def close(self):
-        self.session.close()
+        """
+        Releases this client's use of the shared session. The session
+        closes when no client for the endpoint uses it.
+        """
+        if not self._released:
+            self._released = True
+            self.cluster_config.sessions.release(self.endpoint)
+
+    def ensure_pool_size(self, size):
+        """
+        Ensures the session's connection pool can hold at least `size`
+        connections to this service, so that `size` threads can issue
+        requests concurrently without discarding connections.
+        """
+        self.cluster_config.sessions.ensure_pool_size(self.endpoint, size)
+
+    def _send(self, method, url, idempotent=None, template=None, body=None, **kwargs) -> requests.Response:
+        """
+        Sends a request, retrying transient failures of idempotent requests
+        per the cluster's retry policy, behind this endpoint's circuit breaker.
+        `idempotent` overrides the choice based on the HTTP method.
+
+        `template`, the request path with placeholders, and `body`, the
+        payload before encoding, describe the request to the request hooks.
+        If a span is active, its IDs are sent in a `traceparent` header.
+        """
+        kwargs['headers'] = self._trace_headers(kwargs.get('headers'))
+        attempts = 0
+        def attempt():
+            nonlocal attempts
+            attempts += 1
+            event = RequestEvent(method, self.endpoint, template, url, body, attempts)
+            return self._send_once(method, url, event, **kwargs)
+        return send_with_retry(self.cluster_config, self.endpoint, attempt, method, idempotent)
+
+    def _send_once(self, method, url, event=None, **kwargs) -> requests.Response:
+        """
+        Sends a request once, reporting it to the request hooks. If the
+        service cannot be reached, tells the cluster configuration so that
+        cached topology which names this service can be refreshed.
+
+        The event for a streamed response is completed by `_stream_complete()`
+        once the caller has read the body.
+        """
+        if event is None:
+            event = RequestEvent(method, self.endpoint, None, url)
+        event.streamed = kwargs.get('stream', False)
+        event.bytes_sent = body_size(kwargs.get('data'))
+        fire_before(self.cluster_config.hooks, event)
+        reset_connect_time()
+        event.started = time.perf_counter()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except Exception as e:
+            if isinstance(e, requests.exceptions.ConnectionError):
+                self.cluster_config.node_failed(self.endpoint)
+            event.error = e
+            event.connect = connect_time()
+            event.latency = time.perf_counter() - event.started
+            fire_after(self.cluster_config.hooks, event)
+            raise
+        # requests measures the time to the response headers.
+        elapsed = getattr(r, 'elapsed', None)
+        headers_secs = time.perf_counter() - event.started if elapsed is None else elapsed.total_seconds()
+        event.status = r.status_code
+        event.connect = connect_time()
+        event.ttfb = max(0.0, headers_secs - event.connect)
+        if event.streamed:
+            r.request_event = event
+        else:
+            self._complete(r, event, len(r.content))
+        return r
+
+    def _trace_headers(self, headers):
+        span = current_span() if self.cluster_config.tracer.enabled() else None
+        if span is None:
+            return headers
+        headers = {} if headers is None else dict(headers)
+        headers['traceparent'] = traceparent(span)
+        return headers
+
+    def _complete(self, response, event, body_bytes):
+        """
+        Records a response whose body, of `body_bytes` decoded bytes, has
+        been read.
+        """
+        self.cluster_config.transfer_stats.note_response(response, body_bytes)
+        if event is None:
+            return
+        wire = wire_bytes(response)
+        event.body_bytes = body_bytes
+        event.bytes_received = body_bytes if wire is None else wire
+        event.latency = time.perf_counter() - event.started
+        event.download = max(0.0, event.latency - (event.connect or 0.0) - (event.ttfb or 0.0))
+        fire_after(self.cluster_config.hooks, event)
+
+    def _stream_complete(self, response, body_bytes):
+        """
+        Called when the caller has finished reading a streamed response,
+        whether or not it read the entire body.
+        """
+        self._complete(response, getattr(response, 'request_event', None), body_bytes)
+
+    def _encode(self, body, headers):
+        """
+        Encodes a request body as JSON with the cluster's codec, gzipped if
+        large enough per the `compress_min_size` option. Returns the payload
+        and the headers, with the content type and encoding added.
+        """
+        if body is None:
+            return None, headers
+        headers = {} if headers is None else dict(headers)
+        headers.setdefault('Content-Type', JSON_CONTENT_TYPE)
+        data = self.cluster_config.codec.dumps(body)
+        sent, headers = compress_body(data, headers, self.cluster_config.compress_min_size)
+        self.cluster_config.transfer_stats.note_request(len(data), len(sent))
+        return sent, headers
+
+    def _decode(self, response):
+        """
+        Decodes a JSON response payload with the cluster's codec.
+        """
+        return self.cluster_config.codec.loads(response.content)
+
+    def retry_stats(self):
+        """
+        Returns the retry counters, and the circuit breaker state of each
+        endpoint, for the cluster.
+        """
+        stats = self.cluster_config.retry_metrics.to_dict()
+        breakers = self.cluster_config.breakers
+        stats['breakers'] = {} if breakers is None else breakers.states()
+        return stats
+
+    def tracer(self):
+        """
+        Returns the cluster's `Tracer`. Add an exporter to start tracing.
+        """
+        return self.cluster_config.tracer
+
+    def metrics(self):
+        """
+        Returns the cluster's `MetricsRegistry` of per-endpoint request
+        metrics, or `None` if disabled by the `metrics=False` option.
+        """
+        return self.cluster_config.metrics
+
+    def transfer_stats(self):
+        """
+        Returns the request and response byte counts for the cluster, on
+        the wire and uncompressed.
+        """
+        return self.cluster_config.transfer_stats.to_dict()
     
     #-------- REST --------
     
@@ -83,11 +272,7 @@ class Service:
             optional list of values to match {} placeholders
             in the URL.
         """
-        url = self.endpoint + req
-        if args is not None:
-            quoted = [quote(arg) for arg in args]
-            url = url.format(*quoted)
-        return url
+        return build_url(self.endpoint, req, args)
     
     def get(self, req, args=None, params=None, require_ok=True) -> requests.Request:
         '''
@@ -118,9 +303,7 @@ class Service:
         The `requests` `Request` object.
         '''
         url = self.build_url(req, args)
-        if self.cluster_config.trace:
-            print("GET:", url)
-        r = self.session.get(url, params=params)
+        r = self._send('GET', url, template=req, params=params)
         if require_ok:
             check_error(r)
         return r
@@ -130,7 +313,7 @@ class Service:
         Generic GET request which expects a JSON response.
         '''
         r = self.get(url_tail, args, params)
-        return r.json()
+        return self._decode(r)
 
     def post(self, req, body, args=None, headers=None, require_ok=True) -> requests.Request:
         """
@@ -139,10 +322,7 @@ class Service:
         parameters.
         """
         url = self.build_url(req, args)
-        if self.cluster_config.trace:
-            print("POST:", url)
-            print("body:", body)
-        r = self.session.post(url, data=body, headers=headers)
+        r = self._send('POST', url, template=req, body=body, data=body, headers=headers)
         if require_ok:
             check_error(r)
         return r
@@ -155,31 +335,37 @@ class Service:
         """
         r = self.post_only_json(req, body, args, headers, params)
         check_error(r)
-        return r.json()
+        return self._decode(r)
 
-    def post_only_json(self, req, body, args=None, headers=None, params=None) -> requests.Request:
+    def post_only_json(self, req, body, args=None, headers=None, params=None, stream=False, timeout=None, idempotent=False) -> requests.Request:
         """
         Issues a POST request for the given URL on this
         node, with the given payload and optional URL query 
         parameters. The payload is serialized to JSON.
 
         Does not parse error messages: that is up to the caller.
+
+        If `stream` is `True`, the response body is not read: the caller
+        reads it incrementally via `iter_content()`.
+
+        `timeout`, in seconds, is passed to `requests`: it limits the time
+        to connect and the time between bytes received, not the total time.
+
+        Set `idempotent` if the request is safe to retry after a transient
+        failure, as for a query.
         """
         url = self.build_url(req, args)
-        if self.cluster_config.trace:
-            print("POST:", url)
-            print("body:", body)
-        return self.session.post(url, json=body, headers=headers, params=params)
+        data, headers = self._encode(body, headers)
+        return self._send('POST', url, idempotent=idempotent, template=req, body=body,
+            data=data, headers=headers, params=params, stream=stream, timeout=timeout)
 
     def delete(self, req, args=None, params=None, headers=None):
         url = self.build_url(req, args)
-        if self.cluster_config.trace:
-            print("DELETE:", url)
-        r = self.session.delete(url, params=params, headers=headers)
+        r = self._send('DELETE', url, template=req, params=params, headers=headers)
         return r
 
     def delete_json(self, req, args=None, params=None, headers=None):
-        return self.delete(req, args=args, params=params, headers=headers).json()
+        return self._decode(self.delete(req, args=args, params=params, headers=headers))
 
     #-------- Common --------
 
@@ -0,0 +1,184 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import requests
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from .compression import ACCEPT_ENCODING
+
+# Default connections kept per node, as for requests.
+DEFAULT_POOL_SIZE = requests.adapters.DEFAULT_POOLSIZE
+
+#-------- Connection timing --------
+
+# Each thread issues one request at a time, so a thread-local total
+# attributes connect time to the request which opened the connection.
+_timing = threading.local()
+
+def reset_connect_time():
+    _timing.connect = 0.0
+
+def connect_time() -> float:
+    """
+    Returns the seconds spent opening connections in this thread since the
+    last `reset_connect_time()`: zero if the request reused a connection.
+    """
+    return getattr(_timing, 'connect', 0.0)
+
+def _timed_connect(connect):
+    start = time.perf_counter()
+    try:
+        connect()
+    finally:
+        _timing.connect = connect_time() + time.perf_counter() - start
+
+class TimedHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        _timed_connect(super().connect)
+
+class TimedHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        # Includes the TLS handshake.
+        _timed_connect(super().connect)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    `requests` adapter whose connections record the time taken to connect.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+            }
+
+#-------- Sessions --------
+
+class SessionEntry:
+
+    def __init__(self, session, pool_size):
+        self.session = session
+        self.pool_size = pool_size
+        self.refs = 0
+
+class SessionRegistry:
+    """
+    Registry of HTTP sessions, one per service endpoint, shared by all the
+    clients for that endpoint.
+
+    A node which runs several roles, such as a combined Coordinator and
+    Overlord, has a client per role, but all use one `requests.Session`
+    and so one connection pool. A session lives as long as any client
+    uses it: clients retained across `Cluster.refresh()` keep their
+    connections.
+
+    Options (from the cluster configuration):
+
+    * `pool_size`: connections kept per node (default 10).
+    * `pool_block`: if `True`, `pool_size` is also the maximum number of
+      concurrent connections per node: requests beyond the limit wait
+      for a free connection. Otherwise extra connections are opened, then
+      discarded after use.
+    * `keep_alive`: if `False`, connections are closed after each request.
+    * `accept_encoding`: the response encodings to request.
+    """
+
+    def __init__(self, tls_cert=None, pool_size=DEFAULT_POOL_SIZE, pool_block=False, keep_alive=True, accept_encoding=ACCEPT_ENCODING):
+        self.tls_cert = tls_cert
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.accept_encoding = accept_encoding
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _mount(self, session, size):
+        adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=size, pool_block=self.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def _create(self):
+        session = requests.Session()
+        session.verify = self.tls_cert
+        session.headers['Accept-Encoding'] = self.accept_encoding
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        self._mount(session, self.pool_size)
+        return SessionEntry(session, self.pool_size)
+
+    def acquire(self, endpoint) -> requests.Session:
+        """
+        Returns the session for the endpoint, creating it if needed. Each
+        call must be matched by a call to `release()`.
+        """
+        with self._lock:
+            entry = self._entries.get(endpoint)
+            if entry is None:
+                entry = self._create()
+                self._entries[endpoint] = entry
+            entry.refs += 1
+            return entry.session
+
+    def release(self, endpoint):
+        """
+        Releases a use of the session for the endpoint, closing the session
+        when no client uses it.
+        """
+        with self._lock:
+            entry = self._entries.get(endpoint)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del self._entries[endpoint]
+        entry.session.close()
+
+    def ensure_pool_size(self, endpoint, size):
+        """
+        Ensures the session for the endpoint can hold at least `size`
+        connections, so that `size` threads can issue requests concurrently
+        without discarding connections.
+        """
+        with self._lock:
+            entry = self._entries.get(endpoint)
+            if entry is None or size <= entry.pool_size:
+                return
+            old = entry.session.get_adapter('http://')
+            self._mount(entry.session, size)
+            entry.pool_size = size
+        # Release the replaced adapter's pooled connections. Requests in
+        # flight on them complete, then their connections are discarded.
+        old.close()
+
+    def pool_size_for(self, endpoint):
+        entry = self._entries.get(endpoint)
+        return None if entry is None else entry.pool_size
+
+    def endpoints(self):
+        return list(self._entries.keys())
+
+    def __len__(self):
+        return len(self._entries)
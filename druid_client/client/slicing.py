@@ -0,0 +1,205 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time-sliced execution of queries over large time ranges.
+
+A query over months of data can exceed Broker timeouts, or produce one
+giant response. Instead, split the time range into slices aligned to a
+Druid granularity, run one query per slice concurrently, and stitch the
+results back together in time order. For queries which aggregate across
+time, the per-slice aggregates can be re-merged: SUM and COUNT by summing,
+MIN and MAX by taking the min or max.
+
+The query provides a `{time_range}` placeholder where the time predicate
+for each slice belongs:
+
+    SELECT channel, COUNT(*) AS "cnt", MAX("added") AS "max_added"
+    FROM wikipedia
+    WHERE {time_range}
+    GROUP BY channel
+"""
+
+from . import consts
+from .error import ClientError
+from .util import as_datetime, floor_time, next_time, time_range_sql
+
+TIME_RANGE_PLACEHOLDER = '{time_range}'
+
+SUM_MERGE = 'sum'
+COUNT_MERGE = 'count'
+MIN_MERGE = 'min'
+MAX_MERGE = 'max'
+
+def merge_sum(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+def merge_min(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+def merge_max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+mergers = {
+    SUM_MERGE: merge_sum,
+    COUNT_MERGE: merge_sum,
+    MIN_MERGE: merge_min,
+    MAX_MERGE: merge_max,
+}
+
+def time_slices(start, end, grain=consts.DAY_GRAIN, max_slices=None) -> list:
+    """
+    Splits the time range [start, end) into a list of (start, end) datetime
+    pairs. Interior slice boundaries fall on granularity boundaries; the
+    first and last slices are clipped to the range. If `max_slices` is
+    given, each slice spans as many granularity periods as needed to
+    produce at most that many slices.
+    """
+    start = as_datetime(start)
+    end = as_datetime(end)
+    if end <= start:
+        raise ClientError("The end of the time range must be after the start.")
+    if grain not in consts.druid_grains:
+        raise ClientError("Unsupported granularity: " + str(grain))
+    bounds = [start]
+    t = next_time(floor_time(start, grain), grain)
+    while t < end:
+        bounds.append(t)
+        t = next_time(t, grain)
+    bounds.append(end)
+    if max_slices is not None and len(bounds) - 1 > max_slices:
+        step = -(-(len(bounds) - 1) // max_slices)
+        bounds = bounds[:-1:step] + [end]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+def slice_sql(sql, start, end, time_col=consts.TIME_COL):
+    return sql.replace(TIME_RANGE_PLACEHOLDER, time_range_sql(start, end, time_col))
+
+def merge_rows(rows, merge) -> list:
+    """
+    Re-merges rows of decomposable aggregates from multiple slices. Rows
+    (dictionaries) with equal values for all columns not in `merge` are
+    combined using the merge function named in `merge` for each aggregate
+    column. Rows are returned in order of first appearance.
+    """
+    funcs = {col: mergers[fn.lower()] for col, fn in merge.items()}
+    merged = {}
+    for row in rows:
+        key = tuple((k, v) for k, v in row.items() if k not in funcs)
+        current = merged.get(key)
+        if current is None:
+            merged[key] = dict(row)
+            continue
+        for col, fn in funcs.items():
+            current[col] = fn(current.get(col), row.get(col))
+    return list(merged.values())
+
+class SlicedQueryResult:
+    """
+    The combined result of a time-sliced query. `results` holds the
+    per-slice `SqlQueryResult` objects, in time order, and `slices` the
+    corresponding (start, end) pairs.
+    """
+
+    def __init__(self, slices, results, merge=None):
+        self.slices = slices
+        self.results = results
+        self.merge = merge
+        self._rows = None
+
+    def ok(self):
+        return all(r.ok() for r in self.results)
+
+    def errors(self):
+        """
+        Returns a list of (slice, result) pairs for the failed slices.
+        """
+        return [(s, r) for s, r in zip(self.slices, self.results) if not r.ok()]
+
+    def error_msg(self):
+        errors = self.errors()
+        if len(errors) == 0:
+            return None
+        (start, end), result = errors[0]
+        return "Slice {}/{} failed: {}".format(start, end, result.error_msg())
+
+    def schema(self):
+        for result in self.results:
+            if result.ok():
+                return result.schema()
+        return []
+
+    def rows(self):
+        """
+        Returns the rows of all slices in time order, re-merged if the
+        query was run with a merge specification. Raises a `ClientError`
+        if any slice failed.
+        """
+        if self._rows is not None:
+            return self._rows
+        if not self.ok():
+            raise ClientError(self.error_msg())
+        rows = []
+        for result in self.results:
+            rows.extend(result.rows())
+        if self.merge:
+            rows = merge_rows(rows, self.merge)
+        self._rows = rows
+        return rows
+
+def slice_request(request, sql, index):
+    """
+    Returns the request for one slice of a query. A query ID set by the
+    caller gets a per-slice suffix, so that each of the concurrent slices
+    has its own ID, by which it can be cancelled.
+    """
+    derived = request.derive(sql)
+    query_id = (request.context or {}).get(consts.SQL_QUERY_ID_KEY)
+    if query_id is not None:
+        derived.with_query_id('{}-{}'.format(query_id, index))
+    return derived
+
+def slice_requests(client, request, start, end, grain, merge, max_slices, time_col):
+    """
+    Validates a sliced query, and returns its slices and the request for
+    each slice.
+    """
+    if type(request) == str:
+        request = client.sql_request(request)
+    if TIME_RANGE_PLACEHOLDER not in request.sql:
+        raise ClientError("The query must contain a " + TIME_RANGE_PLACEHOLDER + " placeholder.")
+    if merge and request.format() != consts.SQL_OBJECT:
+        raise ClientError("Merging slices requires the object result format.")
+    for fn in (merge or {}).values():
+        if fn.lower() not in mergers:
+            raise ClientError("Unsupported merge function: " + fn)
+    slices = time_slices(start, end, grain, max_slices)
+    return slices, [slice_request(request, slice_sql(request.sql, s, e, time_col), i) for i, (s, e) in enumerate(slices)]
+
+def run_sliced(client, request, start, end, grain, merge, max_slices, max_concurrency, time_col):
+    slices, requests = slice_requests(client, request, start, end, grain, merge, max_slices, time_col)
+    results = client.sql_many(requests, max_concurrency=max_concurrency)
+    return SlicedQueryResult(slices, results, merge)
@@ -14,9 +14,21 @@
 
 import requests
 import json
+import copy
+import time
+import uuid
+from collections import deque
 from . import consts
+from .error import ClientError, QueryError, QueryTimeoutError, query_error
 from .util import filter_null_cols
 from .text_table import TextTable
+from .json_stream import RowStreamParser
+from .columnar import ColumnarFrame, frame_from_stream
+from .codec import STDLIB
+
+# Default number of bytes to read from the network per chunk when
+# streaming results.
+DEFAULT_STREAM_CHUNK_SIZE = 64 * 1024
 
 class ColumnSchema:
 
@@ -40,13 +52,16 @@ class SqlRequest:
         self.headers = None
         self.types = None
         self.sqlTypes = None
+        self.use_cache = True
+        self.query_id = None
+        self.timeout = None
     
     def with_format(self, format):
-        self.format = format
+        self.result_format = format
         return self
     
     def with_headers(self, sqlTypes=False, druidTypes=False):
-        self.headers = True
+        self.header = True
         self.types = druidTypes
         self.sqlTypes = sqlTypes
         return self
@@ -58,8 +73,43 @@ class SqlRequest:
             self.context.update(context)
         return self
 
-    def with_format(self, format):
-        self.format = format
+    def with_query_id(self, query_id):
+        """
+        Sets the SQL query ID. By default, each run of the request is
+        assigned a new, unique ID.
+        """
+        return self.with_context({consts.SQL_QUERY_ID_KEY: query_id})
+
+    def with_timeout(self, seconds):
+        """
+        Sets a deadline, in seconds, for the query. The deadline is passed
+        to Druid as the query timeout, and is also enforced by the client:
+        if no result arrives in time, the client cancels the query and
+        raises a `QueryTimeoutError`.
+        """
+        self.timeout = seconds
+        return self
+
+    def derive(self, sql):
+        """
+        Returns a copy of this request, with its own context, for the
+        given SQL text.
+        """
+        request = copy.copy(self)
+        request.sql = sql
+        request.query_id = None
+        if self.context is not None:
+            request.context = dict(self.context)
+        return request
+
+    def copy(self):
+        return self.derive(self.sql)
+
+    def with_cache(self, use_cache=True):
+        """
+        Sets whether the query may use the client's result cache, if any.
+        """
+        self.use_cache = use_cache
         return self
 
     def response_header(self):
@@ -69,9 +119,20 @@ class SqlRequest:
         self.headers = headers
     
     def to_request(self):
+        """
+        Returns the JSON request object for the query. Assigns the query
+        ID, available afterwards as `query_id`: the `sqlQueryId` from the
+        context, if set, else a new UUID for each call.
+        """
         query_obj = {"query": self.sql}
-        if self.context is not None and len(self.context) > 0:
-            query_obj['context'] = self.context
+        context = {} if self.context is None else dict(self.context)
+        self.query_id = context.get(consts.SQL_QUERY_ID_KEY)
+        if self.query_id is None:
+            self.query_id = str(uuid.uuid4())
+            context[consts.SQL_QUERY_ID_KEY] = self.query_id
+        if self.timeout is not None and consts.TIMEOUT_KEY not in context:
+            context[consts.TIMEOUT_KEY] = int(self.timeout * 1000)
+        query_obj['context'] = context
         if self.params is not None and len(self.params) > 0:
             query_obj['parameters'] = self.params
         if self.header:
@@ -87,11 +148,34 @@ class SqlRequest:
     def format(self):
         if self.result_format is None:
             return consts.SQL_OBJECT
-        return self.result_format.lower()
+        fmt = self.result_format.lower()
+        if fmt == consts.SQL_ARRAY_WITH_TRAILER.lower():
+            return consts.SQL_ARRAY_WITH_TRAILER
+        return fmt
+
+    def header_context(self):
+        """
+        Returns the response header options as a dictionary of the form
+        expected by `parse_rows()` and `parse_schema()`. Options set on
+        the request take precedence over those in the query context.
+        """
+        context = {} if self.context is None else self.context
+        return {
+            consts.HEADERS_KEY: self.header or context.get(consts.HEADERS_KEY, False),
+            consts.SQL_TYPE_HEADERS_KEY: bool(self.sqlTypes) or context.get(consts.SQL_TYPE_HEADERS_KEY, False),
+            consts.DRUID_TYPE_HEADERS_KEY: bool(self.types) or context.get(consts.DRUID_TYPE_HEADERS_KEY, False),
+            }
 
     def run(self):
         return self.client.sql_query(self)
 
+    def stream(self, chunk_size=None):
+        """
+        Runs the query, returning a `SqlStreamResult` which parses rows
+        as they arrive.
+        """
+        return self.client.sql_stream(self, chunk_size=chunk_size)
+
 def parse_object_schema(results):
     schema = []
     if len(results) == 0:
@@ -109,31 +193,51 @@ def parse_object_schema(results):
         schema.append(ColumnSchema(k, sql_type, druid_type))
     return schema
 
+def header_row_count(context):
+    """
+    Returns the number of header rows which precede the data rows in
+    the `array` and `arrayWithTrailer` formats: the column names, then
+    the Druid types and the SQL types if requested.
+    """
+    if context is None or not context.get(consts.HEADERS_KEY, False):
+        return 0
+    count = 1
+    if context.get(consts.DRUID_TYPE_HEADERS_KEY, False):
+        count += 1
+    if context.get(consts.SQL_TYPE_HEADERS_KEY, False):
+        count += 1
+    return count
+
 def parse_array_schema(context, results):
     schema = []
     if len(results) == 0:
         return schema
-    has_headers = context.get(consts.HEADERS_KEY, False)
-    if not has_headers:
+    if header_row_count(context) == 0:
         return schema
-    has_sql_types = context.get(consts.SQL_TYPES_HEADERS_KEY, False)
     has_druid_types = context.get(consts.DRUID_TYPE_HEADERS_KEY, False)
+    has_sql_types = context.get(consts.SQL_TYPE_HEADERS_KEY, False)
+    druid_types = results[1] if has_druid_types else None
+    sql_types = None
+    if has_sql_types:
+        sql_types = results[2] if has_druid_types else results[1]
     size = len(results[0])
     for i in range(size):
         druid_type = None
-        if has_druid_types:
-            druid_type = results[1][i]
+        if druid_types is not None:
+            druid_type = druid_types[i]
         sql_type = None
-        if has_sql_types:
-            sql_type = results[2][i]
+        if sql_types is not None:
+            sql_type = sql_types[i]
         schema.append(ColumnSchema(results[0][i], sql_type, druid_type))
     return schema
 
 def parse_schema(fmt, context, results):
     if fmt == consts.SQL_OBJECT:
         return parse_object_schema(results)
-    elif fmt == consts.SQL_ARRAY or fmt == consts.consts.SQL_ARRAY_WITH_TRAILER:
+    elif fmt == consts.SQL_ARRAY:
         return parse_array_schema(context, results)
+    elif fmt == consts.SQL_ARRAY_WITH_TRAILER:
+        return parse_array_schema(context, results['results'])
     else:
         return []
 
@@ -144,15 +248,18 @@ def parse_rows(fmt, context, results):
         rows = results
     else:
         return results
-    if not context.get(consts.HEADERS_KEY, False):
+    header_size = header_row_count(context)
+    if header_size == 0:
         return rows
-    header_size = 1
-    if context.get(consts.SQL_TYPES_HEADERS_KEY, False):
-        header_size += 1
-    if context.get(consts.DRUID_TYPE_HEADERS_KEY, False):
-        header_size += 1
     return rows[header_size:]
 
+def request_codec(request):
+    """
+    Returns the JSON codec configured for the client which runs the request.
+    """
+    config = getattr(request.client, 'cluster_config', None)
+    return getattr(config, 'codec', STDLIB)
+
 class AbstractSqlQueryResult:
     """
     Defines the core protocol for Druid SQL queries.
@@ -209,6 +316,24 @@ class AbstractSqlQueryResult:
             return msg
         return msg + ": " + text
 
+    def druid_error(self) -> QueryError:
+        """
+        If the query failed, returns the error as a typed `QueryError`, such
+        as `QueryCapacityError`, classified from the Druid error code and
+        HTTP status. Returns `None` if the query succeeded.
+        """
+        if self.ok():
+            return None
+        status = None if self.http_response is None else self.http_response.status_code
+        return query_error(status, self.error(), self.error_msg(), self.id())
+
+    def raise_for_error(self):
+        """
+        Raises the typed `QueryError` if the query failed.
+        """
+        if not self.ok():
+            raise self.druid_error()
+
     def id(self):
         """
         Returns the unique identifier for the query.
@@ -248,15 +373,27 @@ class AbstractSqlQueryResult:
         """
         if not self.ok():
             return None
-        import pandas as pd
         fmt = self.format()
-        if fmt == consts.SQL_ARRAY or fmt == consts.SQL_OBJECT:
-            return pd.read_json(self.request.text)
-        elif fmt == consts.ARRAY_WITH_TRAILER:
-            return pd.DataFrame(self.rows())
+        if fmt == consts.SQL_ARRAY or fmt == consts.SQL_OBJECT or fmt == consts.SQL_ARRAY_WITH_TRAILER:
+            return self.columnar().to_pandas()
         else:
             return None
 
+    def columnar(self) -> ColumnarFrame:
+        """
+        Returns the result as a `ColumnarFrame`: one typed buffer per column,
+        with strings dictionary-encoded. Column kinds come from the type
+        header rows, if requested, else are inferred from the data.
+
+        Convert the frame with `to_numpy()`, `to_pandas()` or `to_arrow()`.
+        """
+        if not self.ok():
+            return None
+        rows = self.rows()
+        if self.format() != consts.SQL_OBJECT:
+            return frame_from_stream(self.schema(), rows)
+        return frame_from_stream(None, rows)
+
     def non_null(self):
         if not self.ok():
             return None
@@ -298,6 +435,7 @@ class SqlQueryResult(AbstractSqlQueryResult):
         self._json = None
         self._rows = None
         self._schema = None
+        self._columnar = None
 
     def error(self):
         if self.ok():
@@ -312,17 +450,14 @@ class SqlQueryResult(AbstractSqlQueryResult):
 
     def id(self):
         if self.http_response is None:
-            return None
-        try:
-            return self.http_response.headers['X-Druid-SQL-Query-Id']
-        except KeyError:
-            return None
+            return self.request.query_id
+        return self.http_response.headers.get(consts.SQL_QUERY_ID_HEADER, self.request.query_id)
     
     def json(self):
         if not self.ok():
             return None
         if self._json is None:
-            self._json = self.http_response.json()
+            self._json = request_codec(self.request).loads(self.http_response.content)
         return self._json
     
     def rows(self):
@@ -330,14 +465,26 @@ class SqlQueryResult(AbstractSqlQueryResult):
             json = self.json()
             if json is None:
                 return self.http_response.text
-            self._rows = parse_rows(self.format(), self.request.context, json)
+            self._rows = parse_rows(self.format(), self.request.header_context(), json)
         return self._rows
 
     def schema(self):
         if self._schema is None:
-            self._schema = parse_schema(self.format(), self.request.context, self.json())
+            self._schema = parse_schema(self.format(), self.request.header_context(), self.json())
         return self._schema
 
+    def columnar(self) -> ColumnarFrame:
+        """
+        Returns the result as a `ColumnarFrame`. The payload, already in
+        memory, is decoded once with the client's JSON codec, and the frame
+        built from the decoded rows.
+        """
+        if not self.ok():
+            return None
+        if self._columnar is None:
+            self._columnar = AbstractSqlQueryResult.columnar(self)
+        return self._columnar
+
     def profile(self):
         """
         Experimental feature to return the query profile.
@@ -355,6 +502,270 @@ class SqlQueryResult(AbstractSqlQueryResult):
         except KeyError:
             return None
     
+class FailedQueryResult(SqlQueryResult):
+    """
+    Result of a query which failed in the client, such as with a connection
+    error, before Druid returned a response. The error is that of the
+    exception, which is available as `exception`.
+    """
+
+    def __init__(self, request, exception):
+        self.request = request
+        self.http_response = None
+        self.exception = exception
+        self._error = {'error': type(exception).__name__, 'errorMessage': str(exception)}
+        self._json = None
+        self._rows = None
+        self._schema = None
+        self._columnar = None
+
+    def ok(self):
+        return False
+
+    def is_response_ok(self):
+        return False
+
+    def druid_error(self) -> QueryError:
+        if isinstance(self.exception, QueryError):
+            return self.exception
+        return QueryError(self.error_msg(), self.request.query_id, self._error)
+
+    def rows(self):
+        return None
+
+class SqlStreamResult(AbstractSqlQueryResult):
+    """
+    Result of a SQL query which parses rows incrementally as they arrive
+    from Druid, rather than reading the entire response into memory.
+
+    Iterate over the result to obtain rows, or use `batches()` to obtain
+    lists of rows. The result can be iterated only once. Memory use is
+    bounded by the chunk size plus the rows of one chunk, regardless of
+    the size of the result.
+
+    Supports the `object`, `array` and `arrayWithTrailer` formats. For
+    the array formats, request headers (`SqlRequest.with_headers()`) to
+    obtain the schema. Use the result as a context manager, or call
+    `close()`, to release the connection if the rows are not all read.
+    Closing the result before all rows are read, or abandoning an
+    iteration part way through, cancels the query in Druid.
+
+    If `deadline` is set (a `time.monotonic()` value), reading rows
+    past the deadline cancels the query and raises a `QueryTimeoutError`.
+
+    A compressed response is decompressed chunk by chunk as it is read.
+    Once the response is read or released, `on_complete`, if given, is
+    called with the response and the number of body bytes read.
+    """
+
+    def __init__(self, request, response, chunk_size=None, deadline=None, on_complete=None):
+        AbstractSqlQueryResult.__init__(self, request, response)
+        self.chunk_size = DEFAULT_STREAM_CHUNK_SIZE if chunk_size is None else chunk_size
+        self.deadline = deadline
+        self.on_complete = on_complete
+        self.body_bytes = 0
+        self._header_context = request.header_context()
+        self._pending = deque()
+        self._headers = None
+        self._schema = None
+        self._row_count = 0
+        self._started = False
+        self._trailer = None
+        if not self.ok():
+            self._parser = None
+            self.body_bytes = len(response.content)
+            self._completed()
+            return
+        fmt = self.format()
+        if fmt == consts.SQL_ARRAY_WITH_TRAILER:
+            self._parser = RowStreamParser(rows_key='results')
+        elif fmt == consts.SQL_OBJECT or fmt == consts.SQL_ARRAY:
+            self._parser = RowStreamParser()
+        else:
+            response.close()
+            raise ClientError("Cannot stream results in format " + fmt)
+        self._chunks = response.iter_content(chunk_size=self.chunk_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Release the HTTP connection. Any unread rows are discarded and,
+        if Druid has not yet sent the entire result, the query is cancelled.
+        """
+        if self._parser is not None:
+            self.cancel()
+            return
+        self._release()
+
+    def _release(self):
+        if self.http_response is not None:
+            self.http_response.close()
+        self._parser = None
+        self._pending.clear()
+        self._completed()
+
+    def _completed(self):
+        if self.on_complete is not None:
+            on_complete, self.on_complete = self.on_complete, None
+            on_complete(self.http_response, self.body_bytes)
+
+    def cancel(self):
+        """
+        Cancels the query in Druid and releases the HTTP connection.
+        Returns `True` if Druid cancelled the query.
+        """
+        self._release()
+        query_id = self.id()
+        if query_id is None:
+            return False
+        try:
+            return self._cancel_query(query_id)
+        except Exception:
+            # The query may have completed or the Broker gone away:
+            # either way, there is nothing more to do.
+            return False
+
+    def _cancel_query(self, query_id):
+        return self.request.client.cancel_sql(query_id)
+
+    def id(self):
+        if self.http_response is None:
+            return self.request.query_id
+        return self.http_response.headers.get(consts.SQL_QUERY_ID_HEADER, self.request.query_id)
+
+    def _check_deadline(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self._timed_out()
+
+    def _timed_out(self):
+        self.cancel()
+        raise QueryTimeoutError("Query did not complete before its deadline", self.id())
+
+    def _read_chunk(self):
+        """
+        Reads the next chunk from the network into the pending row queue.
+        Returns `False` at the end of the response.
+        """
+        if self._parser is None:
+            return False
+        self._check_deadline()
+        try:
+            chunk = next(self._chunks)
+            self.body_bytes += len(chunk)
+            self._pending.extend(self._parser.feed(chunk))
+        except requests.exceptions.RequestException:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self._timed_out()
+            raise
+        except StopIteration:
+            self._pending.extend(self._parser.close())
+            self._trailer = self._parser.trailer
+            self._parser = None
+            self._completed()
+            return False
+        return True
+
+    def _fill(self, n):
+        while len(self._pending) < n and self._read_chunk():
+            pass
+        return len(self._pending) >= n
+
+    def _read_headers(self):
+        if self._headers is not None:
+            return
+        count = 0
+        if self.format() != consts.SQL_OBJECT:
+            count = header_row_count(self._header_context)
+        self._fill(count)
+        self._headers = [self._pending.popleft() for _ in range(min(count, len(self._pending)))]
+
+    def __iter__(self):
+        if self._started:
+            raise ClientError("A streaming result can be read only once.")
+        self._started = True
+        if not self.ok():
+            return
+        self._read_headers()
+        try:
+            while True:
+                while self._pending:
+                    self._row_count += 1
+                    yield self._pending.popleft()
+                if not self._read_chunk() and not self._pending:
+                    break
+        except GeneratorExit:
+            # The consumer stopped reading early.
+            self.close()
+            raise
+
+    def batches(self, size=1000):
+        """
+        Yields the rows in lists of at most `size` rows.
+        """
+        batch = []
+        for row in self:
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def rows(self):
+        """
+        Reads all remaining rows into a list. Defeats the purpose of
+        streaming: prefer to iterate over the result.
+        """
+        return list(self)
+
+    def row_count(self):
+        """
+        Returns the number of rows read so far.
+        """
+        return self._row_count
+
+    def schema(self):
+        """
+        Returns the schema from the header rows (array formats) or from
+        the first row (object format). Reading the schema does not
+        consume any data rows.
+        """
+        if self._schema is not None:
+            return self._schema
+        if not self.ok():
+            return []
+        fmt = self.format()
+        if fmt == consts.SQL_OBJECT:
+            self._fill(1)
+            self._schema = parse_object_schema(list(self._pending)[:1])
+        else:
+            self._read_headers()
+            self._schema = parse_array_schema(self._header_context, self._headers)
+        return self._schema
+
+    def columnar(self) -> ColumnarFrame:
+        """
+        Reads the remaining rows into a `ColumnarFrame`, without holding the
+        rows themselves in memory.
+        """
+        if not self.ok():
+            return None
+        schema = None
+        if self.format() != consts.SQL_OBJECT:
+            schema = self.schema()
+        return frame_from_stream(schema, self)
+
+    def trailer(self):
+        """
+        For the `arrayWithTrailer` format, returns the members which follow
+        the rows, such as the query context. Available once all rows are read.
+        """
+        return self._trailer
 
 PLAN_MARKER = 'DruidQueryRel(query=['
 SIG_MARKER = '], signature=[{'
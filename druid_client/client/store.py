@@ -0,0 +1,369 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Disk-backed store for SQL query results.
+
+Each result is saved as a directory of NumPy `.npy` files, one (or a few)
+per column, in the columnar layout of `ColumnarFrame`, plus a small
+`meta.json` file which describes the columns. Results are reloaded by
+memory-mapping the column files, so a stored result costs neither a
+Broker round trip nor JSON parsing, and its pages are shared by all
+processes on the host which read it.
+
+Entries are written to a temporary directory then renamed into place,
+so readers never see a partial entry. Eviction runs under an exclusive
+`flock()` on a lock file in the store directory so that several worker
+processes can share one store. Requires NumPy.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from . import consts
+from .cache import cache_key
+from .columnar import Column, ColumnarFrame, format_timestamp, \
+    LONG_KIND, DOUBLE_KIND, TIMESTAMP_KIND, STRING_KIND, OBJECT_KIND
+from .sql import AbstractSqlQueryResult, ColumnSchema
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+TEMP_PREFIX = '.tmp-'
+FORMAT_VERSION = 1
+
+# NumPy types for the stored column buffers. Timestamps are stored as
+# milliseconds since the epoch.
+storage_types = {
+    LONG_KIND: 'int64',
+    TIMESTAMP_KIND: 'int64',
+    DOUBLE_KIND: 'float64',
+    STRING_KIND: 'int32',
+}
+
+class StoreLock:
+    """
+    Exclusive inter-process lock on the store directory. A no-op on platforms
+    without `fcntl`.
+    """
+
+    def __init__(self, root):
+        self.path = os.path.join(root, LOCK_FILE)
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+def dir_size(path):
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            size += entry.stat().st_size
+    return size
+
+def column_values(column) -> list:
+    """
+    Returns the values of a stored column as Python objects, as in a live
+    result, rather than as NumPy scalars. Timestamps are ISO strings.
+    """
+    if column.kind == STRING_KIND or column.kind == OBJECT_KIND:
+        return column.values()
+    values = column.data.tolist()
+    if column.nulls is not None:
+        values = [None if n else v for v, n in zip(values, column.nulls.tolist())]
+    if column.kind == TIMESTAMP_KIND:
+        values = [None if v is None else format_timestamp(v) for v in values]
+    return values
+
+class StoredQueryResult(AbstractSqlQueryResult):
+    """
+    A successful SQL query result reloaded from a `DiskResultStore`. The
+    data is available as a memory-mapped `ColumnarFrame` via `columnar()`,
+    or as rows in the request's format via `rows()`.
+    """
+
+    def __init__(self, request, frame, query_id=None):
+        self.request = request
+        self.http_response = None
+        self._error = None
+        self._frame = frame
+        self._query_id = query_id
+        self._rows = None
+
+    def ok(self):
+        return True
+
+    def is_response_ok(self):
+        return True
+
+    def id(self):
+        return self._query_id
+
+    def columnar(self) -> ColumnarFrame:
+        return self._frame
+
+    def schema(self):
+        return self._frame.schema
+
+    def rows(self):
+        if self._rows is None:
+            columns = [column_values(column) for column in self._frame.columns]
+            if self.format() == consts.SQL_OBJECT:
+                names = self._frame.names()
+                self._rows = [dict(zip(names, row)) for row in zip(*columns)]
+            else:
+                self._rows = [list(row) for row in zip(*columns)]
+        return self._rows
+
+class DiskResultStore:
+    """
+    Persistent, size-bounded store of SQL query results.
+
+    Use as the second tier of a `ResultCache`:
+
+        store = DiskResultStore('/tmp/druid-results', max_bytes=10 * consts.ONE_GB)
+        client = dcl.connect(url, result_cache=ResultCache(store=store))
+
+    Results are keyed as for the in-memory cache. Only results which took
+    at least `min_seconds` to run are stored, so cheap queries do not churn
+    the store. When the store exceeds `max_bytes`, the least-recently-read
+    entries are removed.
+    """
+
+    def __init__(self, root, max_bytes=consts.ONE_GB, ttl=24 * consts.SECS_PER_HOUR, min_seconds=1.0):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        root : str
+            Directory for the store, created if it does not exist.
+
+        max_bytes : int, default = 1 GB
+            Size limit for the store.
+
+        ttl : float, default = one day
+            Default time-to-live, in seconds, of each entry.
+
+        min_seconds : float, default = 1.0
+            Minimum query run time for a result to be stored.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.min_seconds = min_seconds
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, request):
+        """
+        Returns the stored result for the request as a `StoredQueryResult`,
+        or `None` if not stored or expired.
+        """
+        key = cache_key(request)
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+            if meta['key'] != key:
+                return None
+            if meta['expires'] <= time.time():
+                self._remove_expired(path)
+                return None
+            frame = self._load(path, meta)
+            os.utime(os.path.join(path, META_FILE))
+        except (OSError, ValueError, KeyError):
+            # Missing, or removed by another process while reading.
+            return None
+        return StoredQueryResult(request, frame, meta.get('query_id'))
+
+    def _load(self, path, meta):
+        import numpy as np
+        columns = []
+        for i, col in enumerate(meta['columns']):
+            base = os.path.join(path, 'c{}'.format(i))
+            kind = col['kind']
+            nulls = None
+            dictionary = None
+            if kind == OBJECT_KIND:
+                with open(base + '.json') as f:
+                    data = json.load(f)
+            else:
+                data = np.load(base + '.npy', mmap_mode='r')
+            if col.get('nulls', False):
+                nulls = np.load(base + '.nulls.npy', mmap_mode='r')
+            if kind == STRING_KIND:
+                offsets = np.load(base + '.offsets.npy', mmap_mode='r')
+                with open(base + '.dict', 'rb') as f:
+                    blob = f.read()
+                dictionary = [blob[offsets[j]:offsets[j + 1]].decode('utf-8') for j in range(len(offsets) - 1)]
+            columns.append(Column(col['name'], kind, data, nulls, dictionary))
+        schema = [ColumnSchema(c['name'], c.get('sql_type'), c.get('druid_type')) for c in meta['columns']]
+        return ColumnarFrame(columns, schema)
+
+    def should_store(self, result):
+        if not result.ok() or result.http_response is None:
+            return False
+        elapsed = getattr(result.http_response, 'elapsed', None)
+        return elapsed is None or elapsed.total_seconds() >= self.min_seconds
+
+    def put(self, request, result, ttl=None):
+        """
+        Writes a result to the store, if it ran long enough to be worth storing.
+        Returns `True` if stored.
+        """
+        if not self.should_store(result):
+            return False
+        frame = result.columnar()
+        if frame is None:
+            return False
+        key = cache_key(request)
+        temp = os.path.join(self.root, TEMP_PREFIX + uuid.uuid4().hex)
+        os.makedirs(temp)
+        try:
+            self._write(temp, key, frame, result.id(), self.ttl if ttl is None else ttl)
+            with StoreLock(self.root):
+                path = self._path(key)
+                if os.path.exists(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                os.rename(temp, path)
+                self._evict()
+        finally:
+            if os.path.exists(temp):
+                shutil.rmtree(temp, ignore_errors=True)
+        return True
+
+    def _write(self, path, key, frame, query_id, ttl):
+        import numpy as np
+        schema = {c.name: c for c in frame.schema} if frame.schema is not None else {}
+        cols = []
+        for i, column in enumerate(frame.columns):
+            base = os.path.join(path, 'c{}'.format(i))
+            col_schema = schema.get(column.name)
+            desc = {
+                'name': column.name,
+                'kind': column.kind,
+                'sql_type': None if col_schema is None else col_schema.sql_type,
+                'druid_type': None if col_schema is None else col_schema.druid_type,
+                'nulls': column.nulls is not None,
+                }
+            if column.kind == OBJECT_KIND:
+                with open(base + '.json', 'w') as f:
+                    json.dump(column.data, f)
+            else:
+                np.save(base + '.npy', np.frombuffer(column.data, dtype=storage_types[column.kind]))
+            if column.nulls is not None:
+                np.save(base + '.nulls.npy', np.frombuffer(column.nulls, dtype=np.uint8))
+            if column.kind == STRING_KIND:
+                encoded = [s.encode('utf-8') for s in column.dictionary]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(b) for b in encoded], out=offsets[1:])
+                np.save(base + '.offsets.npy', offsets)
+                with open(base + '.dict', 'wb') as f:
+                    f.write(b''.join(encoded))
+            cols.append(desc)
+        meta = {
+            'version': FORMAT_VERSION,
+            'key': key,
+            'query_id': query_id,
+            'expires': time.time() + ttl,
+            'rows': len(frame),
+            'columns': cols,
+            }
+        with open(os.path.join(path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name.startswith(TEMP_PREFIX):
+                continue
+            try:
+                mtime = os.stat(os.path.join(entry.path, META_FILE)).st_mtime
+                entries.append((mtime, entry.path, dir_size(entry.path)))
+            except OSError:
+                continue
+        return entries
+
+    def size(self):
+        """
+        Returns the total size, in bytes, of the stored results.
+        """
+        return sum(e[2] for e in self._entries())
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(e[2] for e in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _remove_expired(self, path):
+        # Under the lock, as for put(), which may have replaced the entry
+        # since it was read: remove it only if it is still expired.
+        with StoreLock(self.root):
+            try:
+                with open(os.path.join(path, META_FILE)) as f:
+                    expired = json.load(f)['expires'] <= time.time()
+            except (OSError, ValueError, KeyError):
+                return
+            if expired:
+                self._remove(path)
+
+    def invalidate(self, request):
+        with StoreLock(self.root):
+            self._remove(self._path(cache_key(request)))
+
+    def invalidate_matching(self, predicate):
+        """
+        Removes all entries for which `predicate(sql)` returns `True`, where
+        `sql` is the normalized SQL text.
+        """
+        with StoreLock(self.root):
+            for _, path, _ in self._entries():
+                try:
+                    with open(os.path.join(path, META_FILE)) as f:
+                        sql = json.loads(json.load(f)['key'])['sql']
+                except (OSError, ValueError, KeyError):
+                    continue
+                if predicate(sql):
+                    self._remove(path)
+
+    def clear(self):
+        with StoreLock(self.root):
+            for _, path, _ in self._entries():
+                self._remove(path)
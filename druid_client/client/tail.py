@@ -0,0 +1,152 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Live tail of the rows arriving in a table.
+
+The tail keeps a `__time` watermark, the latest row time seen, and polls
+with a query for the rows at or after the watermark:
+
+    for row in client.table('wikipedia').tail(['channel', 'added']):
+        print(row)
+
+Rows which arrive late, with a time before the watermark, are found by
+re-reading a `lookback` window before the watermark on each poll. Rows
+already returned are remembered for the window and dropped when read
+again, so each row is yielded once. Rows which arrive later than the
+lookback are missed. In a rolled-up table, a late row merges into an
+existing row, and the merged row is yielded again with its new values.
+
+The poll interval adapts to the arrival rate: a poll which returns a full
+batch is followed at once by the next, a poll with new rows waits the base
+interval, and each empty poll waits longer, per the `Backoff`, up to its
+maximum.
+"""
+
+from collections import Counter
+from datetime import timedelta
+import time
+from . import consts
+from .error import ClientError
+from .paging import row_identity
+from .retry import Backoff
+from .util import as_datetime, datetime_to_sql, quote_col, utc_now
+
+DEFAULT_TAIL_ROWS = 10000
+
+def tail_sql(table, columns, where, low, limit) -> str:
+    """
+    Returns the query for the rows of a table at or after `low`, in time
+    order.
+    """
+    if columns:
+        cols = ', '.join(quote_col(c) for c in columns)
+    else:
+        cols = '*'
+    predicate = "{} >= TIMESTAMP '{}'".format(quote_col(consts.TIME_COL), datetime_to_sql(low))
+    if where is not None:
+        predicate += ' AND ({})'.format(where)
+    return 'SELECT {} FROM {} WHERE {} ORDER BY {} LIMIT {}'.format(
+        cols, quote_col(table), predicate, quote_col(consts.TIME_COL), limit)
+
+class TablePoller:
+    """
+    Runs the polls for `TableMetadata.tail()`.
+    """
+
+    def __init__(self, client, table, columns=None, interval=1.0, lookback=0, start=None,
+            where=None, max_rows=DEFAULT_TAIL_ROWS, max_interval=30.0, backoff=None, sleep=time.sleep):
+        if backoff is None:
+            if interval <= 0:
+                raise ClientError("The poll interval must be positive.")
+            backoff = Backoff(base=interval, max_delay=max(interval, max_interval), jitter=False)
+        if max_rows < 1:
+            raise ClientError("The maximum rows per poll must be positive.")
+        if lookback < 0:
+            raise ClientError("The lookback cannot be negative.")
+        self.client = client
+        self.table = table
+        if columns is not None and consts.TIME_COL not in columns:
+            columns = [consts.TIME_COL] + list(columns)
+        self.columns = columns
+        self.where = where
+        self.start = utc_now() if start is None else as_datetime(start)
+        self.lookback = timedelta(seconds=lookback)
+        self.max_rows = max_rows
+        self.backoff = backoff
+        self.sleep = sleep
+        self.watermark = self.start
+        self.polls = 0
+        self.returned = 0
+        # Rows in the current lookback window, already returned.
+        self._seen = Counter()
+
+    def _low(self, watermark):
+        return max(self.start, watermark - self.lookback)
+
+    def poll(self):
+        """
+        Runs one poll. Returns the new rows, and whether the poll read a
+        full batch, so that more rows may be waiting.
+        """
+        low = self._low(self.watermark)
+        request = self.client.sql_request(tail_sql(self.table, self.columns, self.where, low, self.max_rows))
+        # The result cache would hide new rows.
+        result = self.client.sql_query(request.with_cache(False))
+        result.raise_for_error()
+        rows = result.rows()
+        self.polls += 1
+        if not rows:
+            return [], False
+        times = []
+        for row in rows:
+            value = row.get(consts.TIME_COL)
+            if value is None:
+                raise ClientError("The tail query result has no {} column.".format(consts.TIME_COL))
+            times.append(as_datetime(value))
+        full = len(rows) >= self.max_rows
+        watermark = max(self.watermark, times[-1])
+        next_low = self._low(watermark)
+        if full and next_low <= low:
+            raise ClientError("More than {} rows fall within the lookback window at {}: use a larger batch or a shorter lookback.".format(
+                self.max_rows, low))
+        fresh = []
+        seen = self._seen
+        self._seen = Counter()
+        for row, t in zip(rows, times):
+            identity = row_identity(row)
+            if t >= next_low:
+                self._seen[identity] += 1
+            if seen[identity] > 0:
+                seen[identity] -= 1
+                continue
+            fresh.append(row)
+        self.watermark = watermark
+        self.returned += len(fresh)
+        return fresh, full
+
+    def tail(self):
+        """
+        Polls without end, yielding the new rows, and waiting between polls
+        per the backoff.
+        """
+        idle = 0
+        while True:
+            fresh, full = self.poll()
+            yield from fresh
+            if full:
+                idle = 0
+                continue
+            idle = 0 if fresh else idle + 1
+            self.sleep(self.backoff.delay(idle))
@@ -0,0 +1,306 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bucket-aligned cache for time series queries.
+
+A dashboard panel which shows the last day by hour re-runs its query on
+every refresh, although only the latest hour has changed. This cache
+keeps the rows of such a query per time bucket, and on each request runs
+SQL only for the buckets which are not cached, or whose entries have
+expired, then splices the cached and new rows together in time order.
+
+The query aggregates by a `TIME_FLOOR()` bucket at the cache granularity,
+and provides a `{time_range}` placeholder for the time predicate, as for
+`Client.sql_sliced()`:
+
+    SELECT TIME_FLOOR("__time", 'PT1H') AS "__time", channel, COUNT(*) AS "cnt"
+    FROM wikipedia
+    WHERE {time_range}
+    GROUP BY 1, 2
+
+    cache = TimeseriesCache(client)
+    result = cache.query(sql, start, end, consts.HOUR_GRAIN)
+
+Buckets which may still receive data, those which end less than
+`seal_delay` seconds ago or later, are "open" and expire after the short
+`open_ttl`. Older, "sealed" buckets keep for `sealed_ttl`. Contiguous
+missing buckets are fetched by one query, and separate runs of missing
+buckets run concurrently.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from . import consts
+from .cache import CacheStats, cache_key
+from .columnar import frame_from_stream
+from .error import ClientError
+from .slicing import TIME_RANGE_PLACEHOLDER, slice_request, slice_sql
+from .sql import parse_object_schema
+from .util import as_datetime, floor_time, next_time, utc_now
+
+EPOCH = datetime(1970, 1, 1)
+
+def bucket_starts(start, end, grain) -> list:
+    """
+    Returns the starts of the buckets of the given granularity which
+    overlap [start, end).
+    """
+    t = floor_time(start, grain)
+    starts = []
+    while t < end:
+        starts.append(t)
+        t = next_time(t, grain)
+    return starts
+
+def bucket_time(value) -> datetime:
+    """
+    Converts a bucket column value (an ISO timestamp or milliseconds since
+    the epoch) to a naive UTC datetime.
+    """
+    if type(value) is int:
+        return EPOCH + timedelta(milliseconds=value)
+    return as_datetime(value)
+
+def missing_runs(starts, cached, grain) -> list:
+    """
+    Groups the bucket starts which are not cached into runs of adjacent
+    buckets, as (start, end) pairs.
+    """
+    runs = []
+    for t in starts:
+        if t in cached:
+            continue
+        end = next_time(t, grain)
+        if runs and runs[-1][1] == t:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((t, end))
+    return runs
+
+class BucketEntry:
+
+    def __init__(self, key, rows, expires):
+        self.key = key
+        self.rows = rows
+        self.expires = expires
+
+class TimeseriesResult:
+    """
+    Rows spliced from cached and newly fetched buckets, in bucket order.
+    """
+
+    def __init__(self, rows, buckets, cached, queries):
+        self._rows = rows
+        self.buckets = buckets
+        self.cached = cached
+        self.queries = queries
+
+    def ok(self):
+        return True
+
+    def rows(self):
+        return self._rows
+
+    def schema(self):
+        return parse_object_schema(self._rows)
+
+    def columnar(self):
+        return frame_from_stream(None, self._rows)
+
+    def df(self):
+        return self.columnar().to_pandas()
+
+class TimeseriesCache:
+    """
+    Cache of time series query results by time bucket. The cache is
+    thread-safe.
+    """
+
+    def __init__(self, client, open_ttl=10, sealed_ttl=3600, seal_delay=0,
+            max_buckets=100000, clock=time.monotonic, now=utc_now):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        client : Client
+            Client which runs the queries.
+
+        open_ttl : float, default = 10
+            Time-to-live, in seconds, of buckets which may still change.
+
+        sealed_ttl : float, default = 3600
+            Time-to-live, in seconds, of sealed buckets.
+
+        seal_delay : float, default = 0
+            Seconds after its end at which a bucket is sealed: allow for
+            late-arriving data.
+
+        max_buckets : int, default = 100000
+            Maximum cached buckets, across all queries. The least recently
+            used are evicted.
+
+        clock : function, default = time.monotonic
+            Time source, in seconds, for expiry.
+
+        now : function, default = current UTC time
+            Returns the current time as a naive UTC datetime, to decide
+            which buckets are sealed.
+        """
+        self.client = client
+        self.open_ttl = open_ttl
+        self.sealed_ttl = sealed_ttl
+        self.seal_delay = seal_delay
+        self.max_buckets = max_buckets
+        self.clock = clock
+        self.now = now
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key, starts):
+        """
+        Returns the cached rows by bucket start, for the buckets cached
+        and not expired.
+        """
+        found = {}
+        now = self.clock()
+        with self._lock:
+            for t in starts:
+                entry = self._entries.get((key, t))
+                if entry is not None and entry.expires <= now:
+                    del self._entries[entry.key]
+                    self.stats.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.stats.misses += 1
+                    continue
+                self._entries.move_to_end(entry.key)
+                self.stats.hits += 1
+                found[t] = entry.rows
+        return found
+
+    def _store(self, key, buckets, grain):
+        sealed_before = self.now() - timedelta(seconds=self.seal_delay)
+        now = self.clock()
+        with self._lock:
+            for t, rows in buckets.items():
+                sealed = next_time(t, grain) <= sealed_before
+                expires = now + (self.sealed_ttl if sealed else self.open_ttl)
+                self._entries[(key, t)] = BucketEntry((key, t), rows, expires)
+                self._entries.move_to_end((key, t))
+                self.stats.puts += 1
+            while len(self._entries) > self.max_buckets:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def _fetch(self, request, runs, grain, bucket_col, time_col):
+        """
+        Runs one query per run of missing buckets, and splits the rows by
+        bucket. Every bucket in a run is returned, empty if it has no rows.
+        """
+        # The result cache would hold open buckets past their TTL.
+        requests = [slice_request(request, slice_sql(request.sql, s, e, time_col), i).with_cache(False)
+            for i, (s, e) in enumerate(runs)]
+        results = self.client.sql_many(requests)
+        buckets = {}
+        for (s, e), result in zip(runs, results):
+            result.raise_for_error()
+            for t in bucket_starts(s, e, grain):
+                buckets[t] = []
+            for row in result.rows():
+                value = row.get(bucket_col)
+                if value is None:
+                    raise ClientError("Result row has no bucket column: " + bucket_col)
+                t = floor_time(bucket_time(value), grain)
+                if t not in buckets:
+                    raise ClientError("Bucket {} is outside the range queried: the query must bucket by {}.".format(value, grain))
+                buckets[t].append(row)
+        return buckets
+
+    def query(self, request, start, end, grain=consts.HOUR_GRAIN,
+            bucket_col=consts.TIME_COL, time_col=consts.TIME_COL) -> TimeseriesResult:
+        """
+        Returns the rows of a query over [start, end), widened to whole
+        buckets, from the cache where possible.
+
+        Parameters
+        ----------
+        request : str or SqlRequest
+            The query, with a `{time_range}` placeholder, which returns
+            rows in the `object` format.
+
+        start, end : datetime or str
+            The time range, as UTC datetimes or Druid ISO timestamps.
+
+        grain : str, default = consts.HOUR_GRAIN
+            Bucket granularity, a key of `consts.druid_grains`: that of the
+            `TIME_FLOOR()` in the query.
+
+        bucket_col : str, default = '__time'
+            Column which holds the bucket timestamp of each row.
+
+        time_col : str, default = '__time'
+            Time column used in the time range predicate.
+        """
+        if type(request) == str:
+            request = self.client.sql_request(request)
+        if TIME_RANGE_PLACEHOLDER not in request.sql:
+            raise ClientError("The query must contain a " + TIME_RANGE_PLACEHOLDER + " placeholder.")
+        if request.format() != consts.SQL_OBJECT:
+            raise ClientError("The time series cache requires the object result format.")
+        if grain not in consts.druid_grains:
+            raise ClientError("Unsupported granularity: " + str(grain))
+        start = as_datetime(start)
+        end = as_datetime(end)
+        if end <= start:
+            raise ClientError("The end of the time range must be after the start.")
+        key = (cache_key(request), grain, time_col)
+        starts = bucket_starts(start, end, grain)
+        buckets = self._lookup(key, starts)
+        cached = len(buckets)
+        runs = missing_runs(starts, buckets, grain)
+        if runs:
+            fetched = self._fetch(request, runs, grain, bucket_col, time_col)
+            self._store(key, fetched, grain)
+            buckets.update(fetched)
+        rows = []
+        for t in starts:
+            rows.extend(buckets.get(t, []))
+        return TimeseriesResult(rows, len(starts), cached, len(runs))
+
+    def invalidate(self, start, end):
+        """
+        Removes the buckets, of all queries, which overlap [start, end), as
+        after re-ingesting or compacting the data in that range.
+        """
+        start = as_datetime(start)
+        end = as_datetime(end)
+        with self._lock:
+            for entry_key in list(self._entries):
+                (_, grain, _), t = entry_key
+                if t < end and next_time(t, grain) > start:
+                    del self._entries[entry_key]
+                    self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.stats.invalidations += len(self._entries)
+            self._entries.clear()
@@ -0,0 +1,281 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Span-style tracing of client operations.
+
+A span times one operation, such as `Cluster.ingest()`, `Task.join()` or
+a SQL query, and carries attributes such as the table, task ID or query
+ID. Spans nest: a span started while another is active (in the same
+thread or `asyncio` task) is its child and shares its trace ID. Each REST
+call made within a span becomes a child `http` span, so a trace shows
+which step of a workflow, and which REST call within it, took the time.
+
+Tracing is off until an exporter is added, either via the `tracing` option
+of `connect()` or with `client.tracer().add_exporter()`. Finished spans go
+to each exporter: `InMemoryExporter` keeps them in a list;
+`JsonLinesExporter` appends them, one JSON object per line, to a file.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from .metrics import RequestHook
+
+_current_span = contextvars.ContextVar('druid_span', default=None)
+
+def current_span():
+    """
+    Returns the active span in this context, or `None`.
+    """
+    return _current_span.get()
+
+def new_id(n_bytes):
+    return os.urandom(n_bytes).hex()
+
+class Span:
+    """
+    One timed operation. Use as a context manager, via `Tracer.span()`.
+
+    An exception which escapes the span marks it as failed.
+    """
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = new_id(16) if parent is None else parent.trace_id
+        self.span_id = new_id(8)
+        self.parent_id = None if parent is None else parent.span_id
+        self.attributes = {} if attributes is None else dict(attributes)
+        self.start = None
+        self.duration = None
+        self.error = None
+        self._started = None
+        self._token = None
+
+    def set(self, key, value):
+        """
+        Sets an attribute. Returns the span.
+        """
+        self.attributes[key] = value
+        return self
+
+    def update(self, attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def begin(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def end(self, error=None):
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = "{}: {}".format(type(error).__name__, error)
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Ended in a different context than it began.
+                pass
+            self._token = None
+        self.tracer.export(self)
+
+    def ok(self):
+        return self.error is None
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end(exc_value)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'error': self.error,
+            'attributes': self.attributes,
+            }
+
+    def __str__(self):
+        duration = '' if self.duration is None else ' {:.1f} ms'.format(self.duration * 1000)
+        return "{}{}{}".format(self.name, duration, '' if self.error is None else ' [' + self.error + ']')
+
+class NullSpan:
+    """
+    Span used when tracing is off: records nothing.
+    """
+
+    def set(self, key, value):
+        return self
+
+    def update(self, attributes):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Tracer(RequestHook):
+    """
+    Creates spans and sends finished spans to the exporters.
+
+    The tracer is also a request hook: each REST request made while a
+    span is active is recorded as a child `http` span.
+    """
+
+    def __init__(self, exporters=None):
+        self.exporters = [] if exporters is None else list(exporters)
+
+    def enabled(self):
+        return len(self.exporters) > 0
+
+    def add_exporter(self, exporter):
+        self.exporters = self.exporters + [exporter]
+        return exporter
+
+    def remove_exporter(self, exporter):
+        self.exporters = [e for e in self.exporters if e is not exporter]
+
+    def span(self, name, **attributes):
+        """
+        Returns a span, a context manager, for an operation, as a child
+        of the active span, if any.
+        """
+        if not self.exporters:
+            return NULL_SPAN
+        return Span(self, name, current_span(), attributes)
+
+    def export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                pass
+
+    def after_request(self, event):
+        parent = current_span()
+        if parent is None or not self.exporters:
+            return
+        span = Span(self, 'http', parent, {
+            'method': event.method,
+            'template': event.template,
+            'url': event.url,
+            'status': event.status,
+            'attempt': event.attempt,
+            'bytes_received': event.bytes_received,
+            })
+        span.duration = event.latency
+        span.start = None if event.latency is None else time.time() - event.latency
+        if event.error is not None:
+            span.error = "{}: {}".format(type(event.error).__name__, event.error)
+        self.export(span)
+
+class InMemoryExporter:
+    """
+    Keeps finished spans in memory, in the order they finish (children
+    before parents).
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def find(self, name) -> list:
+        return [s for s in self.spans if s.name == name]
+
+    def children(self, span) -> list:
+        return [s for s in self.spans if s.parent_id == span.span_id]
+
+    def slowest(self, n=5) -> list:
+        return sorted(self.spans, key=lambda s: s.duration or 0, reverse=True)[:n]
+
+    def format_tree(self) -> str:
+        """
+        Returns the spans as an indented tree, one line per span, with
+        children in start order.
+        """
+        lines = []
+        def visit(span, depth):
+            lines.append('  ' * depth + str(span))
+            for child in sorted(self.children(span), key=lambda s: s.start or 0):
+                visit(child, depth + 1)
+        ids = set(s.span_id for s in self.spans)
+        roots = [s for s in self.spans if s.parent_id not in ids]
+        for root in sorted(roots, key=lambda s: s.start or 0):
+            visit(root, 0)
+        return '\n'.join(lines)
+
+class JsonLinesExporter:
+    """
+    Appends each finished span, as a JSON object, to a file: one span per
+    line. Attribute values which are not JSON types are written as strings.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+def resolve_tracer(option) -> Tracer:
+    """
+    Returns a tracer for the `tracing` configuration option: `None` (off),
+    an exporter, or a list of exporters.
+    """
+    if option is None:
+        return Tracer()
+    if type(option) is list:
+        return Tracer(option)
+    return Tracer([option])
+
+def in_current_context(fn):
+    """
+    Returns a wrapper which runs `fn` in a copy of the current context, so
+    that work handed to another thread, such as an executor, runs within
+    the active span.
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+def traceparent(span) -> str:
+    """
+    Returns the W3C Trace Context `traceparent` header value for a span.
+    """
+    return '00-{}-{}-01'.format(span.trace_id, span.span_id)
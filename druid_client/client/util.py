@@ -12,8 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
 from urllib.parse import urlparse
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from . import consts
 
 #-------- Misc. --------
@@ -88,6 +89,36 @@ def sql_equality(s):
     s = s.replace("'", "''")
     return "= '" + s + "'"
 
+# Tokens for SQL normalization: quoted strings and identifiers, which
+# are preserved as-is, and runs of whitespace.
+SQL_TOKENS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+)")
+
+def normalize_sql(sql):
+    '''
+    Normalize a SQL statement for use as a cache key: collapses runs of
+    whitespace outside quoted strings and identifiers to a single space,
+    and strips leading and trailing whitespace and any trailing semicolon.
+    '''
+    parts = []
+    for token in SQL_TOKENS.split(sql.strip().rstrip(';').strip()):
+        if len(token) == 0:
+            continue
+        if token[0] != "'" and token[0] != '"' and token.isspace():
+            parts.append(' ')
+        else:
+            parts.append(token)
+    return ''.join(parts)
+
+READ_ONLY_PREFIXES = ('SELECT', 'WITH')
+
+def is_read_only_sql(sql) -> bool:
+    """
+    Returns `True` if the statement is a query (SELECT or WITH), and so
+    is safe to run twice.
+    """
+    text = normalize_sql(sql).lstrip('(').lstrip()
+    return text[:6].upper().startswith(READ_ONLY_PREFIXES)
+
 def datetime_to_sql(dt):
     return dt.isoformat().replace('T', ' ')
 
@@ -176,6 +207,69 @@ def druid_range(start, end):
         end= druid_timestamp(end)
     return start + "/" + end
 
+def as_datetime(ts) -> datetime:
+    '''
+    Convert a Druid ISO timestamp string, or a datetime, to a naive
+    datetime in UTC, the convention used by this library.
+    '''
+    if type(ts) == datetime:
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        return ts
+    if ts.endswith('Z'):
+        return to_datetime(ts)
+    return as_datetime(datetime.fromisoformat(ts))
+
+def utc_now() -> datetime:
+    '''
+    Returns the current time as a naive UTC datetime.
+    '''
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+MONTHS_PER_GRAIN = {
+    consts.MONTH_GRAIN: 1,
+    consts.QUARTER_GRAIN: 3,
+    consts.YEAR_GRAIN: 12,
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+def floor_time(dt, grain) -> datetime:
+    '''
+    Round a UTC datetime down to the start of its Druid granularity
+    bucket. Weeks start on Monday; months, quarters and years are
+    calendar periods, as in Druid.
+    '''
+    if grain in MONTHS_PER_GRAIN:
+        months = MONTHS_PER_GRAIN[grain]
+        month = ((dt.month - 1) // months) * months + 1
+        return datetime(dt.year, month, 1)
+    day = datetime(dt.year, dt.month, dt.day)
+    if grain == consts.WEEK_GRAIN:
+        return day - timedelta(days=dt.weekday())
+    if grain == consts.DAY_GRAIN:
+        return day
+    size = consts.druid_grains[grain]
+    return EPOCH + ((dt - EPOCH) // size) * size
+
+def next_time(dt, grain, n=1) -> datetime:
+    '''
+    Returns the datetime `n` granularity periods after the given datetime.
+    '''
+    if grain in MONTHS_PER_GRAIN:
+        months = dt.month - 1 + n * MONTHS_PER_GRAIN[grain]
+        return dt.replace(year=dt.year + months // 12, month=months % 12 + 1)
+    return dt + n * consts.druid_grains[grain]
+
+def time_range_sql(start, end, col=consts.TIME_COL) -> str:
+    '''
+    Returns a SQL predicate which selects the half-open time range
+    [start, end) of the given time column.
+    '''
+    return "{} >= TIMESTAMP '{}' AND {} < TIMESTAMP '{}'".format(
+        quote_col(col), datetime_to_sql(as_datetime(start)),
+        quote_col(col), datetime_to_sql(as_datetime(end)))
+
 def delta_to_period(delta) -> timedelta:
     return secs_to_period(delta.total_seconds())
 
@@ -0,0 +1,373 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client-side load balancing of queries across the Brokers of a cluster.
+"""
+
+import threading
+import time
+import requests
+from ..client.error import ClientError, DruidError
+from ..client import consts
+from ..client.retry import run_query_with_retry
+from .broker import Broker
+
+# Balancing policies
+LEAST_OUTSTANDING = 'least_outstanding'
+LATENCY_WEIGHTED = 'latency_weighted'
+
+policies = [LEAST_OUTSTANDING, LATENCY_WEIGHTED]
+
+class BrokerNode:
+    """
+    Load and health state of one Broker in a `BrokerPool`.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.url = service.url()
+        self.outstanding = 0
+        self.latency = None
+        self.queries = 0
+        self.failures = 0
+        self.healthy = True
+        self.retry_at = None
+        self.pooled = None
+
+    def client(self):
+        return self.service.client(consts.BROKER)
+
+    def close(self):
+        if self.pooled is not None:
+            self.pooled.close()
+            self.pooled = None
+
+    def record_latency(self, secs, alpha):
+        if self.latency is None:
+            self.latency = secs
+        else:
+            self.latency = alpha * secs + (1 - alpha) * self.latency
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'latency': self.latency,
+            'queries': self.queries,
+            'failures': self.failures,
+            }
+
+class PooledBroker(Broker):
+    """
+    Client for one Broker of a `BrokerPool`. The pool tracks the SQL queries
+    run through this client, as it does those run by `BrokerPool.sql_query()`,
+    so that they count toward the Broker's load, latency and health.
+    """
+
+    def __init__(self, pool, node):
+        Broker.__init__(self, node.client().cluster_config, node.url)
+        self.pool = pool
+        self.node = node
+
+    def _run_sql(self, request):
+        return self.pool._track(self.node, lambda: Broker._run_sql(self, request))
+
+class BrokerPool:
+    """
+    Routes queries across all the Brokers in a cluster.
+
+    Each query goes to the healthy Broker with the fewest queries in flight
+    from this pool (`LEAST_OUTSTANDING`, the default), or with the lowest
+    product of in-flight queries and the moving average of its query
+    latency (`LATENCY_WEIGHTED`). A Broker which fails with a connection
+    error or an unavailable (503) response is ejected from the pool. After
+    `eject_secs`, the next selection starts a background probe of the Broker
+    with `is_healthy()`, which re-admits it if it has recovered.
+
+    The set of Brokers is refreshed from the cluster every `refresh_secs`.
+    The pool is thread-safe: use it with `Client.sql_many()` or from
+    multiple threads.
+
+        pool = cluster.broker_pool()
+        rows = pool.sql('SELECT COUNT(*) FROM wikipedia')
+    """
+
+    def __init__(self, cluster, policy=LEAST_OUTSTANDING, eject_secs=30, refresh_secs=60, alpha=0.2, clock=time.monotonic):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        cluster : Cluster
+            The cluster which provides the Brokers.
+
+        policy : str, default = LEAST_OUTSTANDING
+            The balancing policy: `LEAST_OUTSTANDING` or `LATENCY_WEIGHTED`.
+
+        eject_secs : float, default = 30
+            Time, in seconds, before an ejected Broker is probed for recovery.
+
+        refresh_secs : float, default = 60
+            Time, in seconds, between refreshes of the Broker list.
+
+        alpha : float, default = 0.2
+            Weight of the most recent query in the latency moving average.
+
+        clock : function, default = time.monotonic
+            Time source, in seconds.
+        """
+        self.cluster = cluster
+        self.set_policy(policy)
+        self.eject_secs = eject_secs
+        self.refresh_secs = refresh_secs
+        self.alpha = alpha
+        self.clock = clock
+        self._nodes = {}
+        self._refreshed_at = None
+        self._next = 0
+        self._probes = {}
+        self._lock = threading.Lock()
+        self.hedge_policy = None
+        self._executor = None
+
+    def set_policy(self, policy):
+        if policy not in policies:
+            raise ClientError("Unknown balancing policy: " + str(policy))
+        self.policy = policy
+
+    #-------- Membership --------
+
+    def refresh(self):
+        """
+        Updates the pool from the current set of Brokers in the cluster.
+        Keeps the state of Brokers which remain.
+        """
+        services = self.cluster.for_role(consts.BROKER)
+        with self._lock:
+            nodes = {}
+            for service in services:
+                node = self._nodes.get(service.url())
+                if node is None:
+                    node = BrokerNode(service)
+                else:
+                    node.service = service
+                nodes[node.url] = node
+            removed = [n for url, n in self._nodes.items() if url not in nodes]
+            self._nodes = nodes
+            self._refreshed_at = self.clock()
+        for node in removed:
+            node.close()
+
+    def on_topology_event(self, event):
+        """
+        Topology subscriber: picks up added or removed Brokers on the next
+        selection, without blocking the refresh.
+        """
+        if event.service is not None and event.service.is_a(consts.BROKER):
+            self._refreshed_at = None
+
+    def _maybe_refresh(self):
+        if self._refreshed_at is None or self.clock() - self._refreshed_at >= self.refresh_secs:
+            self.refresh()
+
+    def nodes(self):
+        return list(self._nodes.values())
+
+    def stats(self):
+        """
+        Returns a list of dictionaries with the state of each Broker.
+        """
+        with self._lock:
+            return [node.to_dict() for node in self._nodes.values()]
+
+    #-------- Health --------
+
+    def eject(self, node):
+        with self._lock:
+            node.healthy = False
+            node.failures += 1
+            node.retry_at = self.clock() + self.eject_secs
+
+    def _probe(self, node):
+        """
+        Checks an ejected Broker, re-admitting it if healthy.
+        """
+        try:
+            ok = node.client().is_healthy()
+        except Exception:
+            ok = False
+        with self._lock:
+            if ok:
+                node.healthy = True
+                node.retry_at = None
+            else:
+                node.retry_at = self.clock() + self.eject_secs
+        return ok
+
+    def check_health(self):
+        """
+        Probes every Broker now, ejecting those which are not healthy and
+        re-admitting those which are.
+        """
+        for node in self.nodes():
+            if not self._probe(node):
+                with self._lock:
+                    node.healthy = False
+
+    #-------- Selection --------
+
+    def _score(self, node):
+        if self.policy == LATENCY_WEIGHTED:
+            # Untried Brokers score zero so that they are tried first.
+            return (node.outstanding + 1) * (node.latency or 0.0)
+        return node.outstanding
+
+    def _start_probes(self):
+        """
+        Starts a background probe of each ejected Broker which is due for
+        one, so that a slow probe does not delay the query being routed.
+        """
+        now = self.clock()
+        with self._lock:
+            due = [n for n in self._nodes.values() if not n.healthy and n.retry_at is not None and n.retry_at <= now]
+            # Not due again until the probe reports.
+            for node in due:
+                node.retry_at = None
+        for node in due:
+            self._probes[node.url] = self.executor().submit(self._probe, node)
+
+    def choose(self, exclude=None) -> BrokerNode:
+        """
+        Returns the Broker which should receive the next query, per the
+        balancing policy, other than those in `exclude`. Raises a
+        `DruidError` if no Broker is healthy.
+        """
+        self._maybe_refresh()
+        self._start_probes()
+        with self._lock:
+            candidates = [n for n in self._nodes.values() if n.healthy and (exclude is None or n not in exclude)]
+            if len(candidates) == 0:
+                raise DruidError("No healthy Broker is available.")
+            # Rotate the starting point so that ties are broken round-robin.
+            self._next = (self._next + 1) % len(candidates)
+            candidates = candidates[self._next:] + candidates[:self._next]
+            return min(candidates, key=self._score)
+
+    def client(self) -> PooledBroker:
+        """
+        Returns a client for the Broker which would receive the next query.
+        The pool tracks the SQL queries run through the client.
+        """
+        node = self.choose()
+        with self._lock:
+            if node.pooled is None:
+                node.pooled = PooledBroker(self, node)
+            return node.pooled
+
+    #-------- Query --------
+
+    def sql_query(self, request):
+        """
+        Runs a SQL query on the Broker selected by the balancing policy.
+        See `Client.sql_query()`. If Druid rejects the query for a transient
+        reason, the query is retried, per the `query_retry` policy of the
+        cluster configuration, on another Broker if one is available.
+        """
+        node = self.choose()
+        if type(request) == str:
+            request = node.client().sql_request(request)
+        tried = []
+
+        def run(request, attempt):
+            target = node
+            if attempt > 0:
+                try:
+                    target = self.choose(exclude=tried)
+                except DruidError:
+                    target = self.choose()
+            tried.append(target)
+            return self.run_on(target, request, retry=False)
+
+        config = self.cluster.client().cluster_config
+        return run_query_with_retry(config.query_retry, config.retry_metrics, request, run)
+
+    def run_on(self, node, request, retry=True):
+        """
+        Runs a SQL query on the given Broker, tracking its load and health.
+        """
+        return self._track(node, lambda: node.client().sql_query(request, retry=retry))
+
+    def _track(self, node, run):
+        with self._lock:
+            node.outstanding += 1
+            node.queries += 1
+        start = self.clock()
+        try:
+            result = run()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.eject(node)
+            raise
+        finally:
+            with self._lock:
+                node.outstanding -= 1
+        if result.http_response is not None and result.http_response.status_code == requests.codes.service_unavailable:
+            self.eject(node)
+        else:
+            with self._lock:
+                node.record_latency(self.clock() - start, self.alpha)
+        return result
+
+    def enable_hedging(self, policy=None):
+        """
+        Sets the hedging policy used by `hedged_sql_query()`. Returns the policy.
+        """
+        from .hedging import HedgePolicy
+        self.hedge_policy = HedgePolicy() if policy is None else policy
+        return self.hedge_policy
+
+    def hedged_sql_query(self, request):
+        """
+        Runs a read-only SQL query on the selected Broker and, if it has not
+        answered within the hedge delay, sends a duplicate to another Broker.
+        Returns the first successful result and cancels the other query.
+        Queries other than SELECT or WITH are not hedged. See `HedgePolicy`.
+        """
+        from .hedging import run_hedged
+        if self.hedge_policy is None:
+            self.enable_hedging()
+        return run_hedged(self, request, self.hedge_policy)
+
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(thread_name_prefix='druid-pool')
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for node in self.nodes():
+            node.close()
+
+    def sql(self, sql, *args):
+        if len(args) > 0:
+            sql = sql.format(*args)
+        resp = self.sql_query(sql)
+        resp.raise_for_error()
+        return resp.rows()
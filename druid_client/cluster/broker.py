@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from ..client.client import Client
+from ..client.async_client import AsyncClient
 from ..client import consts
 from ..client.util import dict_get
 
@@ -56,3 +57,15 @@ class Broker(Client):
         """
         json = self.get_json(REQ_BROKER_STATUS)
         return dict_get(json, 'inventoryInitialized', False)
+
+class AsyncBroker(AsyncClient, Broker):
+    """
+    Coroutine-based Broker client.
+    """
+
+    def __init__(self, cluster_config, endpoint):
+        AsyncClient.__init__(self, cluster_config, endpoint)
+
+    async def is_ready(self):
+        json = await self.get_json(REQ_BROKER_STATUS)
+        return dict_get(json, 'inventoryInitialized', False)
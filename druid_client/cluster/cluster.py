@@ -13,17 +13,21 @@
 # limitations under the License.
 
 import json
-from ..client.util import endpoint, service_url
+import threading
+import time
+from ..client.util import endpoint, service_url, dict_get
 from ..client.error import ConfigError, DruidError, ClientError
 from ..client import consts
-from .coord import Coordinator
-from .overlord import Overlord
-from .router import Router
-from .broker import Broker
+from .coord import Coordinator, AsyncCoordinator
+from .overlord import Overlord, AsyncOverlord
+from .router import Router, AsyncRouter
+from .broker import Broker, AsyncBroker
 from .metadata import ClusterMetadata
 from .table import TableMetadata
 from .task import Task
 from .catalog import Catalog
+from .balancer import BrokerPool, LEAST_OUTSTANDING
+from .watcher import TopologyWatcher, diff_topology, leaders, NODE_REMOVED, LEADER_CHANGED
 
 service_map = {
     consts.COORDINATOR: Coordinator,
@@ -32,6 +36,13 @@ service_map = {
     consts.BROKER: Broker
     }
 
+async_service_map = {
+    consts.COORDINATOR: AsyncCoordinator,
+    consts.OVERLORD: AsyncOverlord,
+    consts.ROUTER: AsyncRouter,
+    consts.BROKER: AsyncBroker
+    }
+
 extensions_loaded = False
 
 def register_service(role, service_class):
@@ -48,6 +59,20 @@ def register_service(role, service_class):
     """
     service_map[role] = service_class
 
+def register_async_service(role, service_class):
+    """
+    Registers a custom asynchronous service client class.
+
+    Parameters
+    ----------
+    role : str
+        The role name to register.
+
+    service_class : class
+        The subclass of the AsyncService class to register for the role.
+    """
+    async_service_map[role] = service_class
+
 def service_key(host, port):
     if port == -1:
         return None
@@ -66,11 +91,15 @@ class Role:
        self.role = record['server_type']
        self.is_lead = record['is_leader']
        self.client = None
+       self.async_client = None
 
     def close(self):
         if self.client is not None:
             self.client.close()
             self.client = None
+        # The async client must be closed from its event loop: see
+        # Cluster.aclose().
+        self.async_client = None
 
 class ServiceConfig:
 
@@ -131,8 +160,27 @@ class ServiceConfig:
         role_def.client = cls(self.cluster_config, self._url)
         return role_def.client
 
+    def async_client(self, role):
+        try:
+            role_def = self._roles[role]
+        except KeyError:
+            raise ClientError("Server {} does not provide role {}".format(self._url, role))
+        if role_def.async_client is not None:
+            return role_def.async_client
+        cls = async_service_map.get(role)
+        if cls is None:
+            raise ConfigError("No async client class defined for role " + role)
+        role_def.async_client = cls(self.cluster_config, self._url)
+        return role_def.async_client
+
+    async def aclose(self):
+        for role in self._roles.values():
+            if role.async_client is not None:
+                await role.async_client.close()
+                role.async_client = None
+
     def close(self):
-        for role in self._roles.values:
+        for role in self._roles.values():
             role.close()
 
 class Cluster:
@@ -149,11 +197,17 @@ class Cluster:
         self._config = client.cluster_config
         self._config.cluster = self
         self._services = {}
-        self._broker = None
+        self._broker_pool = None
         self._coordinator = None
         self._overlord = None
         self._metadata = None
         self._table_metadata = {}
+        self._refreshed_at = None
+        self._stale = False
+        self._refreshing = False
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._watcher = None
         self._config.register_services(service_map)
         self.refresh()
     
@@ -167,33 +221,150 @@ class Cluster:
         """
         Update the set of services within the cluster.
 
-        Call this if nodes are added, removed or if the lead service changes.
+        The topology is cached for the `topology_ttl` configuration option,
+        so there is no need to call this for the usual lookups. Call this
+        if nodes are added, removed or if the lead service changes.
         """
-        self._servers = self._client.sql('SELECT * FROM sys.servers')
+        server_rows = self._client.sql('SELECT * FROM sys.servers')
         servers = {}
-        for server_row in self._servers:
+        for server_row in server_rows:
             service = ServiceConfig(self._config, server_row)
             try:
                 server = servers[service.index_key]
                 server._roles.update(service._roles)
             except KeyError:
                  servers[service.index_key] = service
-        old_services = self._services
-        self._services = {}
-        for key, service in servers.items():
-            old_service = old_services.get(key, None)
-            if old_service is None or not old_service.has_roles(service.roles()):
-                service.map_url()
-                self._services[key] = service
-            else:
-                self._services[key] = old_service
-                if self._coordinator == old_service:
-                    self._coordinator = None
-                if self._overlord == old_service:
-                    self._overlord = None
-        for key, service in old_services.items():
-            if key not in self._services:
-                service.close()
+        with self._lock:
+            old_services = self._services
+            old_leaders = leaders(old_services)
+            services = {}
+            for key, service in servers.items():
+                old_service = old_services.get(key, None)
+                if old_service is None or not old_service.has_roles(service.roles()):
+                    service.map_url()
+                    services[key] = service
+                else:
+                    # Keep the existing clients, but take the new leadership.
+                    for role in service._roles.values():
+                        old_service._roles[role.role].is_lead = role.is_lead
+                    services[key] = old_service
+                    if self._coordinator == old_service:
+                        self._coordinator = None
+                    if self._overlord == old_service:
+                        self._overlord = None
+            self._servers = server_rows
+            self._services = services
+            self._refreshed_at = time.monotonic()
+            self._stale = False
+            events = diff_topology(old_services, old_leaders, services)
+        for event in events:
+            if event.kind == NODE_REMOVED:
+                event.service.close()
+        self._publish(events)
+
+    #-------- Topology Events --------
+
+    def subscribe(self, callback):
+        """
+        Registers a function to be called with each `TopologyEvent` when
+        a refresh finds that a node was added or removed, or that a role
+        changed leader. Callbacks run on the thread which refreshed the
+        topology, which may be a background thread, and should be quick.
+        Returns the callback, for use with `unsubscribe()`.
+        """
+        with self._lock:
+            self._subscribers = self._subscribers + [callback]
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not callback]
+
+    def _publish(self, events):
+        for event in events:
+            if event.kind == LEADER_CHANGED:
+                self._leader_changed(event.role)
+            for callback in self._subscribers:
+                try:
+                    callback(event)
+                except Exception:
+                    # A faulty subscriber must not break the refresh.
+                    pass
+
+    def _leader_changed(self, role):
+        with self._lock:
+            if role == consts.COORDINATOR:
+                self._coordinator = None
+            elif role == consts.OVERLORD:
+                self._overlord = None
+
+    def watch(self, interval=10) -> TopologyWatcher:
+        """
+        Starts a background thread which refreshes the topology every
+        `interval` seconds, publishing changes to subscribers. Returns
+        the watcher, which is stopped by `stop_watching()`.
+        """
+        if self._watcher is None:
+            self._watcher = TopologyWatcher(self, interval)
+        self._watcher.interval = interval
+        self._watcher.start()
+        return self._watcher
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def _ensure_topology(self):
+        """
+        Refreshes the topology if it has been invalidated, or in the background
+        if it is older than the TTL. In the latter case, lookups continue to use
+        the cached topology until the refresh completes.
+        """
+        ttl = self._config.topology_ttl
+        if self._stale or not ttl:
+            self.refresh()
+            return
+        if time.monotonic() - self._refreshed_at < ttl:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._background_refresh, name='druid-topology', daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            # Keep the cached topology: a later lookup will try again.
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def invalidate(self):
+        """
+        Marks the cached topology as out of date so that the next lookup
+        refreshes it.
+        """
+        self._stale = True
+
+    def node_failed(self, endpoint):
+        """
+        Called when a request to a service fails to connect. If the service is
+        in the cached topology, invalidates the topology.
+        """
+        with self._lock:
+            for service in self._services.values():
+                if service.url() == endpoint:
+                    self._stale = True
+                    if self._coordinator == service:
+                        self._coordinator = None
+                    if self._overlord == service:
+                        self._overlord = None
+                    return
     
     def servers(self):
         """
@@ -211,7 +382,7 @@ class Cluster:
         return None
     
     def for_role(self, role):
-        self.refresh()
+        self._ensure_topology()
         services = []
         for service in self._services.values():
             if service.is_a(role):
@@ -229,6 +400,7 @@ class Cluster:
         Returns the client for the lead Coordinator.
         """
         if self._coordinator is None:
+            self._ensure_topology()
             self._coordinator = self.lead(consts.COORDINATOR)
             if self._coordinator is None:
                 raise DruidError("No lead Coordinator is available.")
@@ -239,6 +411,7 @@ class Cluster:
         Returns the client for the lead Overlord.
         """
         if self._overlord is None:
+            self._ensure_topology()
             self._overlord = self.lead(consts.OVERLORD)
             if self._overlord is None:
                 raise DruidError("No lead Overlord is available.")
@@ -246,15 +419,23 @@ class Cluster:
 
     def broker(self):
         """
-        Returns a client for a Broker.
+        Returns a client for the Broker which the Broker pool would
+        choose for the next query: the least loaded healthy Broker. The
+        pool tracks the SQL queries run through the client.
+        """
+        return self.broker_pool().client()
+
+    def broker_pool(self, policy=None) -> BrokerPool:
+        """
+        Returns the pool which balances queries across all Brokers. See
+        `BrokerPool`. If `policy` is given, it becomes the pool's policy.
         """
-        if self._broker is None:
-            brokers = self.for_role(consts.BROKER)
-            if len(brokers) == 0:
-                raise DruidError("No Broker is available.")
-            # Arbitrarily pick the first one
-            self._broker = brokers[0]
-        return self._broker.client(consts.BROKER)
+        if self._broker_pool is None:
+            self._broker_pool = BrokerPool(self, LEAST_OUTSTANDING if policy is None else policy)
+            self.subscribe(self._broker_pool.on_topology_event)
+        elif policy is not None:
+            self._broker_pool.set_policy(policy)
+        return self._broker_pool
 
     def router(self):
         """
@@ -266,6 +447,48 @@ class Cluster:
         # Arbitrarily pick the first one
         return routers[0].client(consts.ROUTER)
 
+    #-------- Async Clients --------
+
+    def async_coordinator(self) -> AsyncCoordinator:
+        """
+        Returns an asynchronous client for the lead Coordinator.
+        """
+        self.coordinator()
+        return self._coordinator.async_client(consts.COORDINATOR)
+
+    def async_overlord(self) -> AsyncOverlord:
+        """
+        Returns an asynchronous client for the lead Overlord.
+        """
+        self.overlord()
+        return self._overlord.async_client(consts.OVERLORD)
+
+    def async_broker(self) -> AsyncBroker:
+        """
+        Returns an asynchronous client for the least loaded healthy Broker.
+        """
+        return self.broker_pool().choose().service.async_client(consts.BROKER)
+
+    def async_router(self) -> AsyncRouter:
+        """
+        Returns an asynchronous client for a Router.
+        """
+        routers = self.for_role(consts.ROUTER)
+        if len(routers) == 0:
+            raise DruidError("No Router is available.")
+        return routers[0].async_client(consts.ROUTER)
+
+    def async_clients_for_role(self, role):
+        return [service.async_client(role) for service in self.for_role(role)]
+
+    async def aclose(self):
+        """
+        Closes the sessions for all asynchronous clients. Must be called
+        from the event loop which used the clients.
+        """
+        for service in self._services.values():
+            await service.aclose()
+
     def metadata(self) -> ClusterMetadata:
         if self._metadata is None:
             self._metadata = ClusterMetadata(self)
@@ -289,7 +512,11 @@ class Cluster:
                 spec = json.load(f)
         if type(spec) is str:
             spec = json.loads(spec)
-        return Task(self, self.overlord().submit_task(spec), spec=spec)
+        table = dict_get(dict_get(dict_get(spec, 'spec', {}), 'dataSchema', {}), 'dataSource')
+        with self._config.tracer.span('cluster.ingest', table=table) as span:
+            task_id = self.overlord().submit_task(spec)['task']
+            span.set('task_id', task_id)
+        return Task(self, task_id, spec=spec)
 
     def catalog(self):
         return Catalog(self.coordinator())
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from ..client.service import Service
+from ..client.async_service import AsyncService
 from ..client import consts
 from ..client.util import encode_interval
 from ..client import error
@@ -878,3 +879,50 @@ class Coordinator(Service):
     def catalog_table_names(self):
         return self.get_json(REQ_CAT_LIST_TABLE_NAMES)
 
+
+class AsyncCoordinator(AsyncService, Coordinator):
+    """
+    Coroutine-based Coordinator client.
+
+    All `Coordinator` methods are available: each returns an awaitable.
+    Those which do more than return the response are overridden here.
+    """
+
+    def __init__(self, cluster_config, endpoint):
+        AsyncService.__init__(self, cluster_config, endpoint)
+
+    async def lead(self) -> str:
+        r = await self.get(REQ_COORD_LEADER)
+        return r.text
+
+    async def is_lead(self) -> bool:
+        body = await self.get_json(REQ_IS_COORD_LEADER)
+        return body["leader"]
+
+    async def lookup_tiers(self, dynamic=False):
+        params = None
+        if dynamic:
+            params = {'discover': 'true'}
+        try:
+            return await self.get_json(REQ_LU_CONFIG, params=params)
+        except Exception:
+            return []
+
+    async def all_lookups(self):
+        try:
+            return await self.get_json(REQ_LU_ALL_LOOKUPS)
+        except Exception:
+            return {}
+
+    async def lookups_for_tier(self, tier=consts.DEFAULT_TIER):
+        try:
+            return await self.get_json(REQ_LU_TIER_CONFIG, args=[tier])
+        except Exception:
+            raise error.NotFoundError("tier = " + tier)
+
+    async def lookup(self, tier, id, detailed=False):
+        params = {'detailed': ''} if detailed else None
+        try:
+            return await self.get_json(REQ_LU_LOOKUP_CONFIG, args=[tier, id], params=params)
+        except Exception:
+            raise error.NotFoundError("tier = {}, lookup id = {}".format(tier, id))
@@ -0,0 +1,205 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Hedged requests: when a query is slow to answer, send a duplicate to a
+second Broker and use whichever answers first.
+"""
+
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from ..client import consts
+from ..client.error import DruidError
+from ..client.util import is_read_only_sql
+from ..client.tracing import in_current_context
+
+class HedgePolicy:
+    """
+    Decides when to hedge a query, and limits how many queries are hedged.
+
+    The hedge delay is the given percentile of recent query latencies,
+    clamped to [min_delay, max_delay], or `initial_delay` until enough
+    latencies are known. So, at the 95th percentile, only the slowest
+    5% or so of queries are hedged.
+
+    The budget caps the extra load: each query earns `budget` hedge tokens,
+    up to `burst` tokens, and each hedge spends one. A budget of 0.05
+    allows at most about 5% of queries to be duplicated, even if the
+    cluster as a whole slows down.
+    """
+
+    def __init__(self, percentile=95, budget=0.05, burst=10, initial_delay=1.0,
+            min_delay=0.01, max_delay=10.0, window=1000, min_samples=20):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        percentile : float, default = 95
+            Latency percentile used as the hedge delay.
+
+        budget : float, default = 0.05
+            Fraction of queries which may be hedged.
+
+        burst : int, default = 10
+            Maximum number of hedges which may be saved up.
+
+        initial_delay : float, default = 1.0
+            Hedge delay, in seconds, until `min_samples` latencies are known.
+
+        min_delay, max_delay : float, default = 0.01, 10.0
+            Bounds, in seconds, on the hedge delay.
+
+        window : int, default = 1000
+            Number of recent latencies kept.
+
+        min_samples : int, default = 20
+            Number of latencies needed before using the percentile.
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    def record(self, secs):
+        with self._lock:
+            self._latencies.append(secs)
+
+    def delay(self) -> float:
+        """
+        Returns the time, in seconds, to wait for the first attempt before hedging.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            latencies = sorted(self._latencies)
+        index = max(0, math.ceil(self.percentile / 100 * len(latencies)) - 1)
+        return min(self.max_delay, max(self.min_delay, latencies[index]))
+
+    def note_query(self):
+        with self._lock:
+            self.queries += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def try_hedge(self) -> bool:
+        """
+        Spends one hedge token, if available. Returns `True` if the query
+        may be hedged.
+        """
+        with self._lock:
+            if self._tokens < 1:
+                self.denied += 1
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def note_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        return {
+            'queries': self.queries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'denied': self.denied,
+            'delay': self.delay(),
+            }
+
+def cancel_quietly(client, query_id):
+    try:
+        client.cancel_sql(query_id)
+    except Exception:
+        pass
+
+def new_attempt(request):
+    """
+    Returns a copy of the request with its own query ID, so that each
+    attempt can be cancelled separately.
+    """
+    return request.derive(request.sql).with_query_id(str(uuid.uuid4()))
+
+def run_hedged(pool, request, policy):
+    """
+    Runs a query on the Brokers of `pool`, hedged per `policy`. See
+    `BrokerPool.hedged_sql_query()`.
+    """
+    primary = pool.choose()
+    if type(request) == str:
+        request = primary.client().sql_request(request)
+    if not is_read_only_sql(request.sql):
+        return pool.run_on(primary, request)
+    policy.note_query()
+    executor = pool.executor()
+    attempt = new_attempt(request)
+    start = time.monotonic()
+    first = executor.submit(in_current_context(pool.run_on), primary, attempt)
+    attempts = {first: (primary, attempt, start)}
+    done, _ = wait([first], timeout=policy.delay())
+    if not done and policy.try_hedge():
+        try:
+            node = pool.choose(exclude=[primary])
+            attempt = new_attempt(request)
+            attempts[executor.submit(in_current_context(pool.run_on), node, attempt)] = (node, attempt, time.monotonic())
+        except DruidError:
+            # No other Broker is available: wait for the first attempt.
+            pass
+
+    # Take the first successful result, else the last failure.
+    pending = set(attempts)
+    winner = None
+    fallback = None
+    error = None
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            try:
+                result = f.result()
+            except Exception as e:
+                error = e
+                continue
+            if result.ok():
+                winner = f
+                break
+            fallback = result
+    for f in pending:
+        node, attempt, _ = attempts[f]
+        f.cancel()
+        # The attempt's query_id is set only once it runs: use the ID
+        # assigned by new_attempt(), which Druid knows the query by.
+        executor.submit(cancel_quietly, node.client(), attempt.context[consts.SQL_QUERY_ID_KEY])
+    if winner is None:
+        if fallback is not None:
+            return fallback
+        raise error
+    _, _, started = attempts[winner]
+    policy.record(time.monotonic() - started)
+    if winner is not first:
+        policy.note_win()
+    return winner.result()
@@ -103,11 +103,14 @@ class ClusterMetadata:
 
         Equivalent to  `/druid/coordinator/v1/metadata/datasources`
         """
-        rows = self._client.sql(
-            'SELECT "TABLE_NAME" FROM {} WHERE "TABLE_SCHEMA" {}', 
-            consts.TABLES_TABLE,
-            sql_equality(consts.DRUID_SCHEMA))
-        return [row['TABLE_NAME'] for row in rows]
+        with self._cluster._config.tracer.span('metadata.table_names') as span:
+            rows = self._client.sql(
+                'SELECT "TABLE_NAME" FROM {} WHERE "TABLE_SCHEMA" {}', 
+                consts.TABLES_TABLE,
+                sql_equality(consts.DRUID_SCHEMA))
+            names = [row['TABLE_NAME'] for row in rows]
+            span.set('tables', len(names))
+            return names
 
     def table_details(self):
         """
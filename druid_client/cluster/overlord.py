@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from ..client.service import Service
+from ..client.async_service import AsyncService
 from ..client import consts
 
 OVERLORD_BASE = '/druid/indexer/v1'
@@ -207,7 +208,7 @@ class Overlord(Service):
         """
         Submit a task or supervisor specs to the Overlord.
         
-        Returns the taskId of the submitted task.
+        Returns the Overlord response, `{"task": <task ID>}`.
 
         Parameters
         ----------
@@ -361,3 +362,22 @@ class Overlord(Service):
     def extern_failed(self, id, msg):
         body = {'error': msg}
         return self.post_json(REQ_EXTERN_FAILED, body, args=[id])
+
+class AsyncOverlord(AsyncService, Overlord):
+    """
+    Coroutine-based Overlord client.
+
+    All `Overlord` methods are available: each returns an awaitable.
+    Those which do more than return the response are overridden here.
+    """
+
+    def __init__(self, cluster_config, endpoint):
+        AsyncService.__init__(self, cluster_config, endpoint)
+
+    async def lead(self) -> str:
+        r = await self.get(REQ_OL_LEADER)
+        return r.text
+
+    async def is_lead(self) -> bool:
+        lead = await self.lead()
+        return self.endpoint == self.cluster_config.map_endpoint(lead)
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from ..client.client import Client
+from ..client.async_client import AsyncClient
 from ..client import consts
 
 ROUTER_BASE = '/druid/router/v1'
@@ -48,3 +49,10 @@ class Router(Client):
     def servers(self):
         return self.get_json(REQ_CLUSTER)
 
+class AsyncRouter(AsyncClient, Router):
+    """
+    Coroutine-based Router client.
+    """
+
+    def __init__(self, cluster_config, endpoint):
+        AsyncClient.__init__(self, cluster_config, endpoint)
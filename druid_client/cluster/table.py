@@ -138,6 +138,52 @@ class TableMetadata:
     def drop(self):
         return self._coord().drop_data_source(self._name)
 
+    #-------- Live Tail --------
+
+    def tail(self, columns=None, interval=1.0, lookback=0, start=None, where=None,
+            max_rows=10000, max_interval=30.0, backoff=None):
+        """
+        Returns a generator which polls for, and yields, the rows which
+        arrive in this table, as dictionaries, without end. See `tail.py`.
+
+        Parameters
+        ----------
+        columns : list, default = None
+            Columns to return, `__time` always among them. All columns if
+            not set.
+
+        interval : float, default = 1.0
+            Seconds between polls while rows arrive. Each empty poll doubles
+            the wait, up to `max_interval`.
+
+        lookback : float, default = 0
+            Seconds before the latest row time to re-read on each poll, to
+            catch rows which arrive late.
+
+        start : datetime or str, default = None
+            Time of the earliest row to return. The current time if not set.
+
+        where : str, default = None
+            SQL predicate which filters the rows.
+
+        max_rows : int, default = 10000
+            Maximum rows per poll. A full poll is followed at once by the
+            next.
+
+        max_interval : float, default = 30.0
+            Maximum seconds between polls.
+
+        backoff : Backoff, default = None
+            Sets the poll intervals instead of `interval` and
+            `max_interval`: the wait after `n` empty polls is
+            `backoff.delay(n)`.
+        """
+        from ..client.tail import TablePoller
+        poller = TablePoller(self.client, self._name, columns=columns, interval=interval,
+            lookback=lookback, start=start, where=where, max_rows=max_rows,
+            max_interval=max_interval, backoff=backoff)
+        return poller.tail()
+
     #-------- Tasks --------
 
     def tasks(self, state=None, type=None, max=None, created_time_interval=None):
@@ -32,12 +32,17 @@ class Task:
         return self.state() == consts.SUCCESS_STATE
 
     def join(self, poll_secs=1):
-        if not self.done():
-            self.status()
-            while not self.done():
-                time.sleep(poll_secs)
+        with self.cluster._config.tracer.span('task.join', task_id=self._id) as span:
+            polls = 0
+            if not self.done():
                 self.status()
-        return self.finished()
+                polls += 1
+                while not self.done():
+                    time.sleep(poll_secs)
+                    self.status()
+                    polls += 1
+            span.update({'polls': polls, 'state': self.state()})
+            return self.finished()
 
     def wait_done(self):
         if self.join():
@@ -0,0 +1,129 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Change events for the cluster topology, and a watcher thread which keeps
+the topology current.
+"""
+
+import threading
+
+# Event kinds
+NODE_ADDED = 'added'
+NODE_REMOVED = 'removed'
+LEADER_CHANGED = 'leader_changed'
+
+class TopologyEvent:
+    """
+    A change to the cluster topology.
+
+    For `NODE_ADDED` and `NODE_REMOVED`, `service` is the `ServiceConfig`
+    of the node and `role` is `None`. For `LEADER_CHANGED`, `service` is
+    the new leader, or `None` if the role has no leader, and `role` is the
+    role which changed leader.
+    """
+
+    def __init__(self, kind, service, role=None):
+        self.kind = kind
+        self.service = service
+        self.role = role
+
+    def url(self):
+        return None if self.service is None else self.service.url()
+
+    def __str__(self):
+        if self.role is None:
+            return "{{{} {}}}".format(self.kind, self.url())
+        return "{{{} {}: {}}}".format(self.kind, self.role, self.url())
+
+def leaders(services) -> dict:
+    """
+    Returns a map from role to the key of the lead service for that role,
+    for the roles which have a leader.
+    """
+    leads = {}
+    for key, service in services.items():
+        for role in service.roles():
+            if service.is_lead(role):
+                leads[role] = key
+    return leads
+
+def diff_topology(old_services, old_leaders, new_services) -> list:
+    """
+    Returns the list of `TopologyEvent`s which take the topology from
+    `old_services`, with the given leaders, to `new_services`. Both are
+    maps from index key to `ServiceConfig`. A service replaced by a new
+    `ServiceConfig` (because its roles changed) is reported as removed
+    then added.
+    """
+    events = []
+    for key, service in old_services.items():
+        if new_services.get(key) is not service:
+            events.append(TopologyEvent(NODE_REMOVED, service))
+    for key, service in new_services.items():
+        if old_services.get(key) is not service:
+            events.append(TopologyEvent(NODE_ADDED, service))
+    new_leaders = leaders(new_services)
+    for role in sorted(set(old_leaders) | set(new_leaders)):
+        key = new_leaders.get(role)
+        if old_leaders.get(role) != key:
+            events.append(TopologyEvent(LEADER_CHANGED, None if key is None else new_services[key], role))
+    return events
+
+class TopologyWatcher:
+    """
+    Background thread which refreshes the cluster topology every `interval`
+    seconds so that the cluster publishes change events to its subscribers
+    as nodes come and go, rather than on the next lookup.
+
+    Start the watcher via `Cluster.watch()`.
+    """
+
+    def __init__(self, cluster, interval=10):
+        self.cluster = cluster
+        self.interval = interval
+        self.errors = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='druid-topology-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the watcher, waiting up to `timeout` seconds for the thread
+        to exit.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.cluster.refresh()
+            except Exception as e:
+                # The cluster may be briefly unreachable: try again next interval.
+                self.errors += 1
+                self.last_error = e
@@ -0,0 +1,755 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An in-process fake Druid cluster.
+
+Each node is a local HTTP server which serves the subset of the Druid
+REST API which this library calls: `/status`, SQL (including
+`sys.servers`, so that `Cluster` discovers the fake nodes), native
+queries, query cancellation, Coordinator and Broker load status, leader
+lookups, tasks and supervisors. Results are synthetic: set
+`FakeCluster.sql_handler` and `native_handler` to control query results,
+and `task_duration` to control how long tasks run.
+
+Each node can be given a latency distribution, an error rate and an
+outage, and leaders can be moved between nodes, so that retries, load
+balancing, hedging and throughput can be exercised on one machine.
+Latencies and injected errors draw from per-node random generators
+seeded from the cluster seed, so a single-threaded run is repeatable.
+
+Typical usage:
+
+    with FakeCluster(brokers=3) as fake:
+        client = druid_client.connect(fake.url())
+        fake.node('broker-1').latency = lognormal(0.010, 0.5)
+        fake.node('broker-2').fault = Fault(rate=0.1, status=429)
+        ...
+        fake.set_leader('coordinator', 'master-2')
+"""
+
+import gzip
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+from ..client import consts
+
+#-------- Latency distributions --------
+
+# A latency distribution is a function which, given a `random.Random`,
+# returns a delay in seconds.
+
+def fixed(secs):
+    return lambda rnd: secs
+
+def uniform(low, high):
+    return lambda rnd: rnd.uniform(low, high)
+
+def exponential(mean):
+    return lambda rnd: rnd.expovariate(1.0 / mean)
+
+def lognormal(median, sigma):
+    """
+    Log-normal latency: most requests near `median` seconds, with a
+    long tail which grows with `sigma`.
+    """
+    mu = math.log(median)
+    return lambda rnd: rnd.lognormvariate(mu, sigma)
+
+#-------- Faults --------
+
+CAPACITY_ERROR = 'Query capacity exceeded'
+
+class Fault:
+    """
+    Injected failure: a fraction `rate` of requests to the node, optionally
+    only those whose path starts with `path`, fail with `status`. A 429
+    carries Druid's "Query capacity exceeded" error. A `status` of `None`
+    drops the connection without a response.
+    """
+
+    def __init__(self, rate=1.0, status=503, path=None):
+        self.rate = rate
+        self.status = status
+        self.path = path
+
+    def applies(self, path):
+        return self.path is None or path.startswith(self.path)
+
+    def payload(self):
+        if self.status == 429:
+            return {'error': CAPACITY_ERROR, 'errorMessage': 'Too many concurrent queries', 'errorClass': 'QueryCapacityExceededException'}
+        return {'error': 'Injected fault', 'errorMessage': 'HTTP {} injected by the fake cluster'.format(self.status)}
+
+#-------- Nodes --------
+
+class FakeServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # A client which abandons a request, as on a cancel or timeout,
+        # closes the connection before the reply is written.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+class FakeNode:
+    """
+    One fake Druid service: an HTTP server on a local port with one or
+    more roles.
+
+    Attributes which tests may change at any time:
+
+    * `latency`: latency distribution for each request (default none).
+    * `fault`: a `Fault`, or `None`.
+    * `down`: if `True`, every request fails with a dropped connection.
+    """
+
+    def __init__(self, fake, name, roles, seed):
+        self.fake = fake
+        self.name = name
+        self.roles = list(roles)
+        self.latency = None
+        self.fault = None
+        self.down = False
+        self.requests = 0
+        self.faults = 0
+        self.paths = {}
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = FakeServer(('127.0.0.1', 0), FakeHandler)
+        self._server.daemon_threads = True
+        self._server.node = self
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def start(self):
+        # A short poll interval keeps `stop()` fast.
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), name='fake-druid-' + self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread = None
+
+    def has_role(self, role):
+        return role in self.roles
+
+    def is_leader(self, role):
+        return self.fake.leader(role) is self
+
+    def _next_delay(self):
+        with self._lock:
+            return 0.0 if self.latency is None else max(0.0, self.latency(self._rnd))
+
+    def _should_fail(self, path):
+        with self._lock:
+            fault = self.fault
+            return fault is not None and fault.applies(path) and self._rnd.random() < fault.rate
+
+    def _count(self, path):
+        with self._lock:
+            self.requests += 1
+            self.paths[path] = self.paths.get(path, 0) + 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = 0
+            self.faults = 0
+            self.paths = {}
+
+    def sys_servers_rows(self):
+        rows = []
+        for role in self.roles:
+            rows.append({
+                'server': '127.0.0.1:{}'.format(self.port),
+                'host': '127.0.0.1',
+                'plaintext_port': self.port,
+                'tls_port': -1,
+                'server_type': role,
+                'tier': '_default_tier' if role == consts.HISTORICAL else None,
+                'curr_size': 0,
+                'max_size': 0,
+                'is_leader': 1 if self.is_leader(role) else (0 if role in LEADER_ROLES else None),
+                })
+        return rows
+
+    def __str__(self):
+        return "{}{}".format(self.name, self.roles)
+
+LEADER_ROLES = [consts.COORDINATOR, consts.OVERLORD]
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """
+    Dispatches requests for a `FakeNode`.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes: without this, delayed ACKs
+    # add tens of milliseconds to each keep-alive request.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def node(self) -> FakeNode:
+        return self.server.node
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length == 0:
+            return None
+        data = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+    def reply(self, status, payload=None, headers=None):
+        # A string payload is sent as plain text, as Druid does for leader URLs.
+        if type(payload) is str:
+            body, content_type = payload.encode('utf-8'), 'text/plain'
+        else:
+            body, content_type = b'' if payload is None else json.dumps(payload).encode('utf-8'), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def drop(self):
+        self.close_connection = True
+        try:
+            self.connection.shutdown(2)
+        except OSError:
+            pass
+
+    def handle_request(self, method):
+        node = self.node
+        parts = urlsplit(self.path)
+        path = parts.path
+        node._count(path)
+        body = self.read_body() if method == 'POST' else None
+        if node.down:
+            self.drop()
+            return
+        delay = node._next_delay()
+        if delay > 0:
+            time.sleep(delay)
+        if node._should_fail(path):
+            with node._lock:
+                node.faults += 1
+            if node.fault.status is None:
+                self.drop()
+            else:
+                self.reply(node.fault.status, node.fault.payload())
+            return
+        route = self.node.fake.route(node, method, path)
+        if route is None:
+            self.reply(404, {'error': 'Not found'})
+            return
+        handler, args = route
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        try:
+            result = handler(node, *args, body=body, params=params)
+        except Exception as e:
+            self.reply(500, {'error': 'Unknown exception', 'errorMessage': str(e)})
+            return
+        if isinstance(result, Redirect):
+            self.reply(307, None, {'Location': result.location + self.path})
+            return
+        status, payload, headers = result
+        self.reply(status, payload, headers)
+
+class Redirect:
+    """
+    Handler result which redirects the client to the leader, as a
+    non-leader Coordinator or Overlord does.
+    """
+
+    def __init__(self, location):
+        self.location = location
+
+#-------- Cluster state --------
+
+class FakeTask:
+
+    def __init__(self, id, spec, datasource, created, duration, fail):
+        self.id = id
+        self.spec = spec
+        self.datasource = datasource
+        self.created = created
+        self.duration = duration
+        self.fail = fail
+        self.shutdown = False
+
+    def state(self, now):
+        if self.shutdown:
+            return consts.FAILED_STATE
+        if now - self.created < self.duration:
+            return consts.RUNNING_STATE
+        return consts.FAILED_STATE if self.fail else consts.SUCCESS_STATE
+
+    def status(self, now):
+        state = self.state(now)
+        return {
+            'id': self.id,
+            'type': self.spec.get('type', 'index_parallel') if type(self.spec) is dict else 'index_parallel',
+            'statusCode': state,
+            'status': state,
+            'runnerStatusCode': 'RUNNING' if state == consts.RUNNING_STATE else 'NONE',
+            'duration': -1 if state == consts.RUNNING_STATE else int(self.duration * 1000),
+            'dataSource': self.datasource,
+            'errorMsg': 'Injected task failure' if state == consts.FAILED_STATE else None,
+            }
+
+def default_sql_handler(sql, context):
+    """
+    Default synthetic query result: `rows` rows (10 unless the context
+    sets `fakeRows`) of a small wikipedia-like table.
+    """
+    count = int(context.get('fakeRows', 10))
+    return [{'__time': '2022-01-01T00:00:{:02d}.000Z'.format(i % 60), 'channel': '#en.wikipedia', 'added': i} for i in range(count)]
+
+def default_native_handler(query):
+    """
+    Default synthetic native query result: for scan queries, the rows of
+    `default_sql_handler()` in batches of `batchSize` (in the requested
+    result format); for other query types, no results.
+    """
+    if query.get('queryType') != 'scan':
+        return []
+    rows = default_sql_handler(None, query.get('context', {}))
+    columns = query.get('columns') or (list(rows[0].keys()) if rows else [])
+    size = query.get('batchSize', 20480)
+    compacted = query.get('resultFormat', 'list') == 'compactedList'
+    batches = []
+    for i in range(0, len(rows), size):
+        events = rows[i:i + size]
+        if compacted:
+            events = [[row.get(c) for c in columns] for row in events]
+        else:
+            events = [{c: row.get(c) for c in columns} for row in events]
+        batches.append({'segmentId': 'fake_segment', 'columns': columns, 'events': events})
+    return batches
+
+def column_types(value):
+    if type(value) is bool or type(value) is str or value is None:
+        return 'STRING', 'VARCHAR'
+    if type(value) is int:
+        return 'LONG', 'BIGINT'
+    return 'DOUBLE', 'DOUBLE'
+
+def format_rows(rows, query):
+    """
+    Formats object rows per the request's result format and header
+    options, as Druid does.
+    """
+    fmt = query.get('resultFormat', consts.SQL_OBJECT)
+    if fmt == consts.SQL_OBJECT:
+        return rows
+    columns = list(rows[0].keys()) if rows else []
+    results = []
+    if query.get('header'):
+        results.append(columns)
+        first = rows[0] if rows else {}
+        if query.get('typesHeader'):
+            results.append([column_types(first.get(c))[0] for c in columns])
+        if query.get('sqlTypesHeader'):
+            results.append([column_types(first.get(c))[1] for c in columns])
+    results.extend([row.get(c) for c in columns] for row in rows)
+    if fmt == consts.SQL_ARRAY_WITH_TRAILER:
+        return {'results': results, 'context': {}}
+    return results
+
+OVERLORD_BASE = '/druid/indexer/v1'
+COORD_BASE = '/druid/coordinator/v1'
+
+class FakeCluster:
+    """
+    A fake Druid cluster of local HTTP servers.
+
+    By default: one Router, `brokers` Brokers, and `masters` combined
+    Coordinator/Overlord nodes (the first is the leader), plus
+    `historicals` Historicals, which appear in `sys.servers` only. Nodes
+    are named `router`, `broker-1`..., `master-1`... and `historical-1`...
+
+    Point a client at `url()`, the Router.
+
+    Parameters
+    ----------
+    brokers, masters, historicals : int, default = 2, 2, 1
+        Number of nodes of each kind.
+
+    seed : int, default = 0
+        Seed for the per-node random generators.
+
+    task_duration : float, default = 0.5
+        Seconds for which a submitted task runs.
+
+    tables : list, default = ['wikipedia']
+        Data sources reported by load status and table queries.
+    """
+
+    def __init__(self, brokers=2, masters=2, historicals=1, seed=0, task_duration=0.5, tables=None):
+        self.seed = seed
+        self.task_duration = task_duration
+        self.fail_tasks = False
+        self.tables = ['wikipedia'] if tables is None else list(tables)
+        self.sql_handler = default_sql_handler
+        self.native_handler = default_native_handler
+        self._nodes = {}
+        self._leaders = {}
+        self._tasks = {}
+        self._supervisors = {}
+        self._queries = {}
+        self.cancelled = []
+        self._lock = threading.Lock()
+        self._routes = self._build_routes()
+        self.add_node('router', [consts.ROUTER])
+        for i in range(brokers):
+            self.add_node('broker-{}'.format(i + 1), [consts.BROKER])
+        for i in range(masters):
+            self.add_node('master-{}'.format(i + 1), [consts.COORDINATOR, consts.OVERLORD])
+        for i in range(historicals):
+            self.add_node('historical-{}'.format(i + 1), [consts.HISTORICAL])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    #-------- Topology --------
+
+    def add_node(self, name, roles) -> FakeNode:
+        """
+        Adds and starts a node. It appears in `sys.servers` from now on.
+        The first node with a leader role becomes the leader.
+        """
+        node = FakeNode(self, name, roles, "{}:{}".format(self.seed, name))
+        node.start()
+        with self._lock:
+            self._nodes[name] = node
+            for role in roles:
+                if role in LEADER_ROLES and self._leaders.get(role) is None:
+                    self._leaders[role] = node
+        return node
+
+    def remove_node(self, name):
+        """
+        Stops a node and removes it from `sys.servers`. Leadership of its
+        roles passes to another node with the role, if any.
+        """
+        with self._lock:
+            node = self._nodes.pop(name)
+            for role, leader in list(self._leaders.items()):
+                if leader is node:
+                    candidates = [n for n in self._nodes.values() if n.has_role(role)]
+                    self._leaders[role] = candidates[0] if candidates else None
+        node.stop()
+
+    def node(self, name) -> FakeNode:
+        return self._nodes[name]
+
+    def nodes(self, role=None) -> list:
+        return [n for n in self._nodes.values() if role is None or n.has_role(role)]
+
+    def url(self):
+        """
+        Returns the URL of the Router.
+        """
+        return self.nodes(consts.ROUTER)[0].url()
+
+    def leader(self, role) -> FakeNode:
+        return self._leaders.get(role)
+
+    def set_leader(self, role, name):
+        """
+        Moves the leadership of a role (`coordinator` or `overlord`) to
+        the named node.
+        """
+        node = self._nodes[name]
+        if not node.has_role(role):
+            raise ValueError("Node {} does not have role {}".format(name, role))
+        with self._lock:
+            self._leaders[role] = node
+
+    def rotate_leader(self, role) -> FakeNode:
+        """
+        Moves the leadership of a role to the next node with that role.
+        """
+        candidates = self.nodes(role)
+        current = self.leader(role)
+        index = candidates.index(current) if current in candidates else -1
+        node = candidates[(index + 1) % len(candidates)]
+        self.set_leader(role, node.name)
+        return node
+
+    def stop(self):
+        for node in list(self._nodes.values()):
+            node.stop()
+
+    def stats(self):
+        """
+        Returns the request and fault counts of each node.
+        """
+        return {n.name: {'requests': n.requests, 'faults': n.faults} for n in self._nodes.values()}
+
+    def reset_stats(self):
+        for node in self._nodes.values():
+            node.reset_stats()
+
+    #-------- Routing --------
+
+    def _build_routes(self):
+        # (method, path parts, required role or None, handler). Parts of
+        # '{}' match any one path segment, passed to the handler.
+        return [
+            ('GET', '/status', None, self._status),
+            ('GET', '/status/health', None, lambda node, **kw: (200, True, None)),
+            ('GET', '/status/properties', None, lambda node, **kw: (200, {}, None)),
+            ('GET', '/status/selfDiscovered/status', None, lambda node, **kw: (200, {'selfDiscovered': True}, None)),
+            ('POST', '/druid/v2/sql', SQL_ROLES, self._sql),
+            ('DELETE', '/druid/v2/sql/{}', SQL_ROLES, self._cancel),
+            ('POST', '/druid/v2', SQL_ROLES, self._native),
+            ('DELETE', '/druid/v2/{}', SQL_ROLES, self._cancel),
+            ('GET', '/druid/broker/v1/loadstatus', [consts.BROKER], lambda node, **kw: (200, {'inventoryInitialized': True}, None)),
+            ('GET', COORD_BASE + '/loadstatus', [consts.COORDINATOR], self._coord_load_status),
+            ('GET', COORD_BASE + '/leader', [consts.COORDINATOR], lambda node, **kw: self._leader_url(consts.COORDINATOR)),
+            ('GET', COORD_BASE + '/isLeader', [consts.COORDINATOR], lambda node, **kw: self._is_leader(node, consts.COORDINATOR)),
+            ('GET', COORD_BASE + '/metadata/datasources', [consts.COORDINATOR], self._datasources),
+            ('GET', COORD_BASE + '/datasources', [consts.COORDINATOR], self._datasources),
+            ('GET', OVERLORD_BASE + '/leader', [consts.OVERLORD], lambda node, **kw: self._leader_url(consts.OVERLORD)),
+            ('GET', OVERLORD_BASE + '/isLeader', [consts.OVERLORD], lambda node, **kw: self._is_leader(node, consts.OVERLORD)),
+            ('POST', OVERLORD_BASE + '/task', [consts.OVERLORD], self._submit_task),
+            ('GET', OVERLORD_BASE + '/tasks', [consts.OVERLORD], self._tasks_list),
+            ('GET', OVERLORD_BASE + '/task/{}', [consts.OVERLORD], self._task),
+            ('GET', OVERLORD_BASE + '/task/{}/status', [consts.OVERLORD], self._task_status),
+            ('GET', OVERLORD_BASE + '/task/{}/reports', [consts.OVERLORD], self._task_reports),
+            ('POST', OVERLORD_BASE + '/task/{}/shutdown', [consts.OVERLORD], self._shutdown_task),
+            ('GET', OVERLORD_BASE + '/supervisor', [consts.OVERLORD], self._supervisors_list),
+            ('POST', OVERLORD_BASE + '/supervisor', [consts.OVERLORD], self._submit_supervisor),
+            ('GET', OVERLORD_BASE + '/supervisor/{}', [consts.OVERLORD], self._supervisor),
+            ('GET', OVERLORD_BASE + '/supervisor/{}/status', [consts.OVERLORD], self._supervisor_status),
+            ('POST', OVERLORD_BASE + '/supervisor/{}/terminate', [consts.OVERLORD], self._terminate_supervisor),
+            ]
+
+    def route(self, node, method, path):
+        """
+        Returns the handler and the path arguments for a request to a node,
+        or `None` if the node does not serve the path. A non-leader
+        Coordinator or Overlord redirects leader-only requests to the leader.
+        """
+        segments = path.rstrip('/').split('/')
+        for route_method, pattern, roles, handler in self._routes:
+            if route_method != method:
+                continue
+            args = match_path(pattern, segments)
+            if args is None:
+                continue
+            if roles is not None and not any(node.has_role(r) for r in roles):
+                return None
+            role = leader_role(pattern)
+            if role is not None and not pattern.endswith('/leader') and not pattern.endswith('/isLeader'):
+                leader = self.leader(role)
+                if leader is not None and leader is not node:
+                    return (lambda n, **kw: Redirect(leader.url())), []
+            return handler, args
+        return None
+
+    #-------- Handlers --------
+
+    def _status(self, node, **kw):
+        return 200, {'version': 'fake', 'modules': [], 'memory': {}, 'node': node.name}, None
+
+    def _leader_url(self, role):
+        leader = self.leader(role)
+        if leader is None:
+            return 404, {'error': 'No leader'}, None
+        return 200, leader.url(), None
+
+    def _is_leader(self, node, role):
+        if self.leader(role) is node:
+            return 200, {'leader': True}, None
+        return 404, {'leader': False}, None
+
+    def _coord_load_status(self, node, params=None, **kw):
+        return 200, {table: 100.0 for table in self.tables}, None
+
+    def _datasources(self, node, **kw):
+        return 200, list(self.tables), None
+
+    def _sql(self, node, body=None, **kw):
+        query = body or {}
+        sql = query.get('query', '')
+        context = query.get('context', {})
+        query_id = context.get(consts.SQL_QUERY_ID_KEY, str(uuid.uuid4()))
+        headers = {consts.SQL_QUERY_ID_HEADER: query_id}
+        normalized = ' '.join(sql.split()).lower()
+        if 'sys.servers' in normalized:
+            rows = []
+            for n in self.nodes():
+                rows.extend(n.sys_servers_rows())
+        elif 'information_schema.tables' in normalized:
+            rows = [{'TABLE_NAME': t} for t in self.tables]
+        else:
+            rows = self.sql_handler(sql, context)
+        return 200, format_rows(rows, query), headers
+
+    def _native(self, node, body=None, **kw):
+        query = body or {}
+        query_id = query.get('context', {}).get(consts.QUERY_ID_KEY, str(uuid.uuid4()))
+        return 200, self.native_handler(query), {consts.QUERY_ID_HEADER: query_id}
+
+    def _cancel(self, node, query_id, **kw):
+        with self._lock:
+            self.cancelled.append(unquote(query_id))
+        return 202, None, None
+
+    def _submit_task(self, node, body=None, **kw):
+        spec = body or {}
+        datasource = None
+        try:
+            datasource = spec['spec']['dataSchema']['dataSource']
+        except (KeyError, TypeError):
+            pass
+        task_id = spec.get('id') or 'fake_task_{}'.format(uuid.uuid4().hex[:12])
+        with self._lock:
+            self._tasks[task_id] = FakeTask(task_id, spec, datasource, time.monotonic(), self.task_duration, self.fail_tasks)
+        return 200, {'task': task_id}, None
+
+    def _find_task(self, task_id):
+        return self._tasks.get(unquote(task_id))
+
+    def _tasks_list(self, node, params=None, **kw):
+        now = time.monotonic()
+        state = (params or {}).get('state')
+        tasks = [t.status(now) for t in self._tasks.values()]
+        if state == 'running':
+            tasks = [t for t in tasks if t['statusCode'] == consts.RUNNING_STATE]
+        elif state == 'complete':
+            tasks = [t for t in tasks if t['statusCode'] != consts.RUNNING_STATE]
+        return 200, tasks, None
+
+    def _task(self, node, task_id, **kw):
+        task = self._find_task(task_id)
+        if task is None:
+            return 404, {'error': 'Not found'}, None
+        return 200, {'task': task.id, 'payload': task.spec}, None
+
+    def _task_status(self, node, task_id, **kw):
+        task = self._find_task(task_id)
+        if task is None:
+            return 404, {'error': 'Not found'}, None
+        return 200, {'task': task.id, 'status': task.status(time.monotonic())}, None
+
+    def _task_reports(self, node, task_id, **kw):
+        task = self._find_task(task_id)
+        if task is None:
+            return 404, {'error': 'Not found'}, None
+        state = task.state(time.monotonic())
+        return 200, {'ingestionStatsAndErrors': {'taskId': task.id, 'payload': {'ingestionState': 'COMPLETED' if state != consts.RUNNING_STATE else 'BUILD_SEGMENTS'}}}, None
+
+    def _shutdown_task(self, node, task_id, **kw):
+        task = self._find_task(task_id)
+        if task is None:
+            return 404, {'error': 'Not found'}, None
+        task.shutdown = True
+        return 200, {'task': task.id}, None
+
+    def _supervisors_list(self, node, params=None, **kw):
+        with self._lock:
+            supervisors = list(self._supervisors.values())
+        if params and 'full' in params:
+            return 200, [{'id': s['id'], 'spec': s['spec']} for s in supervisors], None
+        return 200, [s['id'] for s in supervisors], None
+
+    def _submit_supervisor(self, node, body=None, **kw):
+        spec = body or {}
+        try:
+            sup_id = spec['spec']['dataSchema']['dataSource']
+        except (KeyError, TypeError):
+            sup_id = 'fake_supervisor_{}'.format(len(self._supervisors) + 1)
+        with self._lock:
+            self._supervisors[sup_id] = {'id': sup_id, 'spec': spec, 'state': 'RUNNING'}
+        return 200, {'id': sup_id}, None
+
+    def _supervisor(self, node, sup_id, **kw):
+        sup = self._supervisors.get(unquote(sup_id))
+        if sup is None:
+            return 404, {'error': 'Not found'}, None
+        return 200, sup['spec'], None
+
+    def _supervisor_status(self, node, sup_id, **kw):
+        sup = self._supervisors.get(unquote(sup_id))
+        if sup is None:
+            return 404, {'error': 'Not found'}, None
+        return 200, {'id': sup['id'], 'payload': {'dataSource': sup['id'], 'state': sup['state'], 'healthy': True}}, None
+
+    def _terminate_supervisor(self, node, sup_id, **kw):
+        with self._lock:
+            sup = self._supervisors.pop(unquote(sup_id), None)
+        if sup is None:
+            return 404, {'error': 'Not found'}, None
+        return 200, {'id': sup['id']}, None
+
+SQL_ROLES = [consts.ROUTER, consts.BROKER]
+
+def match_path(pattern, segments):
+    """
+    Matches request path segments against a route pattern. Returns the
+    segments which match `{}` placeholders, or `None` if no match.
+    """
+    parts = pattern.split('/')
+    if len(parts) != len(segments):
+        return None
+    args = []
+    for part, segment in zip(parts, segments):
+        if part == '{}':
+            args.append(segment)
+        elif part != segment:
+            return None
+    return args
+
+def leader_role(pattern):
+    if pattern.startswith(COORD_BASE):
+        return consts.COORDINATOR
+    if pattern.startswith(OVERLORD_BASE):
+        return consts.OVERLORD
+    return None
@@ -72,10 +72,11 @@ class ImplyClient:
             request = self.sql_task_request(request)
         if is_blank(request.sql):
             raise ClientError("No query provided.")
-        if self.client.cluster_config.trace:
-            print(request.sql)
-        response = self.client.post_only_json(
-                    REQ_ROUTER_SQL_TASK, 
-                    request.to_request(), 
-                    headers=request.headers)
-        return SqlTaskResult(request, response)
+        with self.client.cluster_config.tracer.span('imply.sql_task', sql=request.sql) as span:
+            response = self.client.post_only_json(
+                        REQ_ROUTER_SQL_TASK, 
+                        request.to_request(), 
+                        headers=request.headers)
+            result = SqlTaskResult(request, response)
+            span.set('task_id', result.id())
+            return result
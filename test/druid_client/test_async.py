@@ -0,0 +1,167 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+import time
+import unittest
+import druid_client
+from druid_client.client import consts
+from druid_client.client.error import ClientError, CircuitOpenError, NotFoundError
+from druid_client.client.sql import FailedQueryResult
+from druid_client.testing import FakeCluster, Fault
+
+class InFlight:
+    """
+    SQL handler which echoes the query, and tracks the most queries in
+    flight at once.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.current = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, sql, context):
+        with self.lock:
+            self.current += 1
+            self.max = max(self.max, self.current)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self.lock:
+                self.current -= 1
+        return [{'sql': sql}]
+
+class TestAsyncClient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCluster(brokers=1, masters=1, historicals=0, task_duration=0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def setUp(self):
+        self.fake.sql_handler = InFlight(delay=0)
+
+    def run_async(self, fn, **options):
+        async def run():
+            client = druid_client.connect_async(self.fake.url(), **options)
+            try:
+                return await fn(client)
+            finally:
+                await client.close()
+        return asyncio.run(run())
+
+    def test_sql(self):
+        async def fn(client):
+            self.assertEqual([{'sql': 'SELECT 1'}], await client.sql('SELECT 1'))
+            result = await client.sql_query(client.sql_request('SELECT 2').with_format(consts.SQL_ARRAY))
+            self.assertEqual([['SELECT 2']], result.rows())
+            with self.assertRaises(ClientError):
+                client.sql_pages('SELECT * FROM t WHERE {keyset}')
+            with self.assertRaises(ClientError):
+                client.show()
+        self.run_async(fn)
+
+    def test_sql_many(self):
+        handler = InFlight()
+        self.fake.sql_handler = handler
+        sqls = ['SELECT {}'.format(i) for i in range(6)]
+        async def fn(client):
+            return await client.sql_many(sqls[:3] + [''] + sqls[3:], max_concurrency=2)
+        results = self.run_async(fn)
+        # In order, and a failure does not abort the others.
+        self.assertEqual(sqls, [r.rows()[0]['sql'] for r in results if r.ok()])
+        self.assertIsInstance(results[3], FailedQueryResult)
+        self.assertIsInstance(results[3].exception, ClientError)
+        self.assertEqual(2, handler.max)
+
+    def test_as_completed(self):
+        async def fn(client):
+            return [(i, r.rows()) async for i, r in client.sql_as_completed(['SELECT 0', 'SELECT 1', 'SELECT 2'])]
+        pairs = self.run_async(fn)
+        self.assertEqual([(i, [{'sql': 'SELECT {}'.format(i)}]) for i in range(3)], sorted(pairs))
+
+    def test_sliced(self):
+        self.fake.sql_handler = lambda sql, context: [{'n': 1}]
+        async def fn(client):
+            return await client.sql_sliced('SELECT COUNT(*) AS n FROM t WHERE {time_range}',
+                '2022-01-01', '2022-01-04', merge={'n': 'sum'})
+        result = self.run_async(fn)
+        self.assertEqual(3, len(result.slices))
+        self.assertEqual([{'n': 3}], result.rows())
+
+    def test_native(self):
+        async def fn(client):
+            result = await client.native_query(client.scan('wiki').with_columns('__time', 'added'))
+            return result.rows()
+        rows = self.run_async(fn)
+        self.assertEqual(10, len(rows))
+        self.assertEqual(['__time', 'added'], list(rows[0].keys()))
+
+    def test_roles(self):
+        async def fn(client):
+            cluster = client.cluster()
+            coord = cluster.async_coordinator()
+            overlord = cluster.async_overlord()
+            try:
+                self.assertTrue(await coord.is_lead())
+                self.assertTrue(await overlord.is_lead())
+                task_id = (await overlord.submit_task({'type': 'index_parallel', 'spec': {}}))['task']
+                self.assertEqual(task_id, (await overlord.task_status(task_id))['task'])
+                with self.assertRaises(NotFoundError):
+                    await coord.lookups_for_tier('missing')
+                with self.assertRaises(NotFoundError):
+                    await coord.lookup('missing', 'lu')
+            finally:
+                await cluster.aclose()
+        self.run_async(fn)
+
+    def test_hooks_and_breaker(self):
+        router = self.fake.node('router')
+        async def fn(client):
+            self.assertEqual([{'sql': 'SELECT 1'}], await client.sql('SELECT 1'))
+            router.fault = Fault(status=503, path='/druid/v2/sql')
+            try:
+                for _ in range(5):
+                    self.assertFalse((await client.sql_query('SELECT 1')).ok())
+                with self.assertRaises(CircuitOpenError):
+                    await client.sql_query('SELECT 1')
+            finally:
+                router.fault = None
+            return client.metrics().endpoint('POST', '/druid/v2/sql')
+        metrics = self.run_async(fn)
+        self.assertEqual(6, metrics.requests)
+        self.assertEqual(5, metrics.errors)
+
+    def test_cancel_not_failure(self):
+        self.fake.sql_handler = InFlight(delay=0.5)
+        async def fn(client):
+            for _ in range(6):
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(client.sql('SELECT 1'), 0.05)
+            self.fake.sql_handler = InFlight(delay=0)
+            # Cancelled requests do not open the breaker.
+            self.assertEqual([{'sql': 'SELECT 2'}], await client.sql('SELECT 2'))
+            return client.cluster_config.breakers.states()
+        states = self.run_async(fn)
+        self.assertEqual(['closed'], [s['state'] for s in states.values()])
+        self.assertEqual([0], [s['failures'] for s in states.values()])
+
+if __name__ == '__main__':
+    unittest.main()
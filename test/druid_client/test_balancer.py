@@ -0,0 +1,247 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from druid_client.cluster.balancer import BrokerPool, LATENCY_WEIGHTED
+from druid_client.cluster.hedging import HedgePolicy, is_read_only_sql
+from druid_client.client.sql import SqlRequest
+from druid_client.client.config import ClusterConfig
+from druid_client.client.error import DruidError
+
+class MockResult:
+
+    def __init__(self, status_code=200):
+        self.http_response = MockHttp(status_code)
+
+    def ok(self):
+        return self.http_response.status_code == 200
+
+class MockHttp:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class MockBroker:
+
+    def __init__(self, url):
+        self.url = url
+        self.cluster_config = ClusterConfig({})
+        self.healthy = True
+        self.down = False
+        self.queries = 0
+        self.delay = 0
+        self.cancelled = []
+
+    def sql_request(self, sql):
+        return SqlRequest(self, sql)
+
+    def cancel_sql(self, query_id):
+        self.cancelled.append(query_id)
+        return True
+
+    def is_healthy(self):
+        time.sleep(self.delay)
+        return self.healthy
+
+    def sql_query(self, request, retry=True):
+        if self.down:
+            raise requests.exceptions.ConnectionError("down")
+        self.queries += 1
+        if type(request) != str:
+            request.to_request()
+        time.sleep(self.delay)
+        return MockResult()
+
+class MockService:
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def url(self):
+        return self.broker.url
+
+    def client(self, role):
+        return self.broker
+
+class MockCluster:
+
+    def __init__(self, brokers):
+        self.brokers = brokers
+
+    def for_role(self, role):
+        return [MockService(b) for b in self.brokers]
+
+    def client(self):
+        return self.brokers[0]
+
+class MockClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def settle(pool):
+    """
+    Waits for the pool's background health probes.
+    """
+    for future in list(pool._probes.values()):
+        future.result()
+
+class TestBrokerPool(unittest.TestCase):
+
+    def test_spread(self):
+        brokers = [MockBroker('b{}'.format(i)) for i in range(3)]
+        pool = BrokerPool(MockCluster(brokers))
+        for _ in range(30):
+            pool.sql_query('SELECT 1')
+        self.assertEqual([10, 10, 10], [b.queries for b in brokers])
+
+        # Outstanding queries steer new ones elsewhere.
+        node = pool.nodes()[0]
+        node.outstanding = 5
+        self.assertNotEqual(node, pool.choose())
+
+    def test_latency(self):
+        brokers = [MockBroker('b0'), MockBroker('b1')]
+        pool = BrokerPool(MockCluster(brokers), policy=LATENCY_WEIGHTED)
+        pool.refresh()
+        slow, fast = pool.nodes()
+        slow.latency = 2.0
+        fast.latency = 0.1
+        for _ in range(5):
+            self.assertEqual(fast, pool.choose())
+
+    def test_eject(self):
+        clock = MockClock()
+        brokers = [MockBroker('b0'), MockBroker('b1')]
+        pool = BrokerPool(MockCluster(brokers), eject_secs=10, clock=clock)
+        brokers[0].down = True
+        brokers[0].healthy = False
+        for _ in range(4):
+            try:
+                pool.sql_query('SELECT 1')
+            except requests.exceptions.ConnectionError:
+                pass
+        self.assertEqual(0, brokers[0].queries)
+        self.assertEqual(3, brokers[1].queries)
+        self.assertFalse(pool.nodes()[0].healthy)
+
+        # Still unhealthy at the probe: stays ejected.
+        clock.now = 11
+        pool.choose()
+        settle(pool)
+        self.assertFalse(pool.nodes()[0].healthy)
+
+        # Recovered: re-admitted. The probe runs in the background, and
+        # does not hold up the selection.
+        brokers[0].down = False
+        brokers[0].healthy = True
+        brokers[0].delay = 0.5
+        clock.now = 22
+        start = time.monotonic()
+        self.assertEqual(pool.nodes()[1], pool.choose())
+        self.assertLess(time.monotonic() - start, 0.25)
+        settle(pool)
+        self.assertTrue(pool.nodes()[0].healthy)
+        brokers[0].delay = 0
+
+        brokers[0].healthy = False
+        brokers[1].healthy = False
+        pool.check_health()
+        with self.assertRaises(DruidError):
+            pool.choose()
+        pool.close()
+
+class HoldingExecutor:
+    """
+    Executor which holds back the second task submitted, as when all the
+    workers are busy, and runs the others.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor()
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        if self.submitted == 2:
+            return Future()
+        return self.executor.submit(fn, *args)
+
+class TestHedging(unittest.TestCase):
+
+    def test_read_only(self):
+        self.assertTrue(is_read_only_sql('  select 1'))
+        self.assertTrue(is_read_only_sql('(SELECT 1) UNION ALL (SELECT 2)'))
+        self.assertTrue(is_read_only_sql('WITH t AS (SELECT 1) SELECT * FROM t'))
+        self.assertFalse(is_read_only_sql('INSERT INTO t SELECT 1'))
+
+    def test_policy(self):
+        policy = HedgePolicy(percentile=90, budget=0.5, burst=1, min_samples=10)
+        self.assertEqual(1.0, policy.delay())
+        for i in range(1, 11):
+            policy.record(i / 10)
+        self.assertEqual(0.9, policy.delay())
+        self.assertTrue(policy.try_hedge())
+        self.assertFalse(policy.try_hedge())
+        policy.note_query()
+        policy.note_query()
+        self.assertTrue(policy.try_hedge())
+
+    def test_hedge(self):
+        brokers = [MockBroker('b0'), MockBroker('b1')]
+        brokers[0].delay = 0.5
+        brokers[1].delay = 0.5
+        pool = BrokerPool(MockCluster(brokers))
+        pool.enable_hedging(HedgePolicy(initial_delay=0.05))
+        pool.refresh()
+        # Make the first Broker the slow one, and the one chosen first.
+        brokers[1].delay = 0
+        pool.nodes()[1].outstanding = 1
+        pool.hedged_sql_query('SELECT 1')
+        pool.nodes()[1].outstanding = 0
+        self.assertEqual(1, brokers[0].queries)
+        self.assertEqual(1, brokers[1].queries)
+        self.assertEqual(1, pool.hedge_policy.hedge_wins)
+        time.sleep(0.1)
+        self.assertEqual(1, len(brokers[0].cancelled))
+        self.assertEqual([], brokers[1].cancelled)
+
+        # Writes are not hedged.
+        pool.hedged_sql_query('INSERT INTO t SELECT 1')
+        self.assertEqual(3, brokers[0].queries + brokers[1].queries)
+        pool.close()
+
+    def test_cancel_unstarted(self):
+        brokers = [MockBroker('b0'), MockBroker('b1')]
+        brokers[0].delay = 0.2
+        pool = BrokerPool(MockCluster(brokers))
+        pool.enable_hedging(HedgePolicy(initial_delay=0.05))
+        pool.refresh()
+        executor = HoldingExecutor()
+        pool.executor = lambda: executor
+        pool.nodes()[1].outstanding = 1
+        self.assertTrue(pool.hedged_sql_query('SELECT 1').ok())
+        executor.executor.shutdown(wait=True)
+        # The hedge never ran, but Druid is still told to cancel it, by
+        # the ID it would have run with.
+        self.assertEqual(0, brokers[1].queries)
+        self.assertEqual(1, len(brokers[1].cancelled))
+        self.assertIsNotNone(brokers[1].cancelled[0])
+        self.assertEqual([], brokers[0].cancelled)
@@ -0,0 +1,117 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+from druid_client.client.cache import ResultCache, cache_key, is_system_query
+from druid_client.client.sql import SqlRequest, SqlQueryResult
+from test_stream import MockResponse
+
+class MockClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def make_result(sql, rows=None, status=200, context=None):
+    req = SqlRequest(None, sql)
+    if context is not None:
+        req.with_context(context)
+    payload = json.dumps([{'a': 1}] if rows is None else rows)
+    return req, SqlQueryResult(req, MockResponse(payload, status))
+
+class TestResultCache(unittest.TestCase):
+
+    def test_key(self):
+        a = SqlRequest(None, 'SELECT  *\n FROM t ;')
+        b = SqlRequest(None, 'SELECT * FROM t')
+        self.assertEqual(cache_key(a), cache_key(b))
+        c = SqlRequest(None, "SELECT * FROM t WHERE x = 'a  b'")
+        d = SqlRequest(None, "SELECT * FROM t WHERE x = 'a b'")
+        self.assertNotEqual(cache_key(c), cache_key(d))
+        a.with_context({'sqlQueryId': 'x', 'priority': 1})
+        b.with_context({'priority': 1})
+        self.assertEqual(cache_key(a), cache_key(b))
+        b.with_context({'priority': 2})
+        self.assertNotEqual(cache_key(a), cache_key(b))
+
+    def test_hit_miss(self):
+        clock = MockClock()
+        cache = ResultCache(ttl=10, clock=clock)
+        req, result = make_result('SELECT 1')
+        self.assertIsNone(cache.get(req))
+        cache.put(req, result)
+        self.assertIs(result, cache.get(SqlRequest(None, ' SELECT 1 ')))
+        clock.now = 10.0
+        self.assertIsNone(cache.get(req))
+        self.assertEqual(1, cache.stats.hits)
+        self.assertEqual(2, cache.stats.misses)
+        self.assertEqual(1, cache.stats.expirations)
+        self.assertEqual(0, cache.bytes())
+
+    def test_errors_not_cached(self):
+        cache = ResultCache()
+        req, result = make_result('SELECT 1', rows={'error': 'x'}, status=400)
+        cache.put(req, result)
+        self.assertEqual(0, len(cache))
+
+    def test_system_tables_not_cached(self):
+        self.assertTrue(is_system_query('SELECT * FROM sys.servers'))
+        self.assertTrue(is_system_query('SELECT * FROM "sys"."segments"'))
+        self.assertTrue(is_system_query('SELECT * FROM information_schema.tables'))
+        self.assertFalse(is_system_query('SELECT * FROM wiki_sys'))
+        cache = ResultCache()
+        req, result = make_result('SELECT * FROM INFORMATION_SCHEMA.TABLES')
+        cache.put(req, result)
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.get(req))
+        self.assertEqual(0, cache.stats.misses)
+
+    def test_writes_not_cached(self):
+        cache = ResultCache()
+        for sql in ['INSERT INTO t SELECT * FROM s', 'REPLACE INTO t OVERWRITE ALL SELECT * FROM s']:
+            req, result = make_result(sql)
+            cache.put(req, result)
+            self.assertIsNone(cache.get(req))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.stats.misses)
+
+    def test_lru(self):
+        cache = ResultCache(max_bytes=30)
+        reqs = []
+        for i in range(3):
+            req, result = make_result('SELECT {}'.format(i), rows=[{'a': 'x' * 3}])
+            reqs.append(req)
+            cache.put(req, result)
+            cache.get(reqs[0])
+        # Each payload is 14 bytes: the least-recently used, SELECT 1, is evicted.
+        self.assertEqual(2, len(cache))
+        self.assertIsNotNone(cache.get(reqs[0]))
+        self.assertIsNone(cache.get(reqs[1]))
+        self.assertEqual(1, cache.stats.evictions)
+        self.assertEqual(28, cache.bytes())
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        req1, result1 = make_result('SELECT * FROM foo')
+        req2, result2 = make_result('SELECT * FROM bar')
+        cache.put(req1, result1)
+        cache.put(req2, result2)
+        cache.invalidate_matching(lambda sql: 'foo' in sql)
+        self.assertIsNone(cache.get(req1))
+        self.assertIs(result2, cache.get(req2))
+        cache.invalidate(req2)
+        self.assertEqual(0, len(cache))
@@ -0,0 +1,106 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+import requests
+from druid_client.client.config import ClusterConfig
+from druid_client.client.client import Client
+from druid_client.client.sql import FailedQueryResult
+from test_stream import MockResponse
+
+class ConcurrentSession:
+    """
+    Mock session which echoes each query, after a delay which shortens
+    for later queries, and tracks the most requests in flight at once.
+    Queries which contain FAIL raise a connection error.
+    """
+
+    def __init__(self):
+        self.current = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        sql = json.loads(kwargs['data'])['query']
+        with self.lock:
+            self.current += 1
+            self.max = max(self.max, self.current)
+        try:
+            time.sleep(0.05 - 0.005 * int(sql.split()[-1]))
+            if 'FAIL' in sql:
+                raise requests.exceptions.ConnectionError('refused')
+            return MockResponse(json.dumps([{'sql': sql}]))
+        finally:
+            with self.lock:
+                self.current -= 1
+
+class TestSqlMany(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(ClusterConfig({'retry': None}), 'http://broker:8082')
+        self.session = ConcurrentSession()
+        self.client.session = self.session
+        self.sqls = ['SELECT {}'.format(i) for i in range(8)]
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_order(self):
+        results = self.client.sql_many(self.sqls, max_concurrency=4)
+        # Later queries finish first, but results are in request order.
+        self.assertEqual(self.sqls, [r.rows()[0]['sql'] for r in results])
+
+    def test_failure(self):
+        sqls = self.sqls[:3] + ['SELECT FAIL 3'] + self.sqls[4:]
+        results = self.client.sql_many(sqls, max_concurrency=4)
+        self.assertIsInstance(results[3], FailedQueryResult)
+        self.assertIsInstance(results[3].exception, requests.exceptions.ConnectionError)
+        self.assertFalse(results[3].ok())
+        self.assertEqual([s for i, s in enumerate(sqls) if i != 3],
+            [r.rows()[0]['sql'] for r in results if r.ok()])
+
+    def test_concurrency(self):
+        self.client.sql_many(self.sqls, max_concurrency=3)
+        self.assertEqual(3, self.session.max)
+        self.session.max = 0
+        self.client.sql_many(self.sqls, max_concurrency=1)
+        self.assertEqual(1, self.session.max)
+
+    def test_as_completed(self):
+        pairs = list(self.client.sql_as_completed(self.sqls, max_concurrency=2))
+        self.assertEqual(list(range(8)), sorted(i for i, _ in pairs))
+        for i, result in pairs:
+            self.assertEqual(self.sqls[i], result.rows()[0]['sql'])
+        self.assertEqual(2, self.session.max)
+
+class TestTrace(unittest.TestCase):
+
+    def test_printed_once(self):
+        client = Client(ClusterConfig({}), 'http://broker:8082')
+        client.session = ConcurrentSession()
+        client.cluster_config.trace = True
+        out = io.StringIO()
+        with redirect_stdout(out):
+            client.sql('SELECT 1')
+        # By the print hook only, in the request body.
+        self.assertEqual(1, out.getvalue().count('SELECT 1'))
+        client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from druid_client.client import codec
+from druid_client.client.error import ConfigError
+
+PAYLOAD = [
+    {'__time': '2016-06-27T00:00:11.080Z', 'channel': '#sv.wikipedia', 'added': 31, 'delta': -1.5, 'isRobot': True, 'comment': None},
+    {'__time': '2016-06-27T00:00:17.457Z', 'channel': '#ja.wikipedia', 'added': 125, 'delta': 2.25, 'isRobot': False, 'comment': 'Ünïcödé'},
+    ]
+
+class TestCodec(unittest.TestCase):
+
+    def installed(self):
+        found = []
+        for name, cls in codec.codecs.items():
+            try:
+                found.append(cls())
+            except ImportError:
+                pass
+        return found
+
+    def test_round_trip(self):
+        for c in self.installed():
+            data = c.dumps(PAYLOAD)
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(PAYLOAD, c.loads(data))
+            self.assertEqual(PAYLOAD, codec.STDLIB.loads(data))
+            self.assertEqual(PAYLOAD, c.loads(data.decode('utf-8')))
+
+    def test_resolve(self):
+        self.assertIn(codec.resolve_codec(None).name, codec.codecs)
+        self.assertEqual(codec.STDLIB_CODEC, codec.resolve_codec('json').name)
+        custom = codec.JsonCodec()
+        self.assertIs(custom, codec.resolve_codec(custom))
+        with self.assertRaises(ConfigError):
+            codec.resolve_codec('bogus')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+from druid_client.client.columnar import FrameBuilder, parse_timestamp, kind_for_type, LONG_KIND, DOUBLE_KIND, STRING_KIND, TIMESTAMP_KIND, OBJECT_KIND
+from druid_client.client.sql import SqlRequest, SqlQueryResult, ColumnSchema
+from druid_client.client import consts
+from druid_client.client.codec import JsonCodec
+from test_stream import MockResponse
+
+class ConfigHolder:
+
+    def __init__(self, codec):
+        self.cluster_config = self
+        self.codec = codec
+
+class TestColumnar(unittest.TestCase):
+
+    def test_inferred(self):
+        builder = FrameBuilder()
+        builder.add({'__time': '2022-01-01T00:00:01.500Z', 'n': None, 's': 'a', 'x': 1, 'o': [1]})
+        builder.add({'__time': '2022-01-01T00:00:02.000Z', 'n': 2, 's': None, 'x': 2.5, 'o': None})
+        builder.add({'__time': None, 'n': 3, 's': 'a', 'x': 3, 'o': {'a': 1}})
+        frame = builder.build()
+        self.assertEqual(3, len(frame))
+        self.assertEqual(['__time', 'n', 's', 'x', 'o'], frame.names())
+        self.assertEqual([TIMESTAMP_KIND, LONG_KIND, STRING_KIND, DOUBLE_KIND, OBJECT_KIND],
+            [c.kind for c in frame.columns])
+        self.assertEqual([1640995201500, 1640995202000, None], frame['__time'].values())
+        self.assertEqual([None, 2, 3], frame['n'].values())
+        self.assertEqual(['a'], frame['s'].dictionary)
+        self.assertEqual(['a', None, 'a'], frame['s'].values())
+        self.assertEqual([1.0, 2.5, 3.0], frame['x'].values())
+        self.assertEqual([[1], None, {'a': 1}], frame['o'].values())
+
+    def test_typed(self):
+        schema = [ColumnSchema('a', 'BIGINT', None), ColumnSchema('b', 'DOUBLE', None), ColumnSchema('c', 'VARCHAR', None)]
+        builder = FrameBuilder(schema)
+        builder.add([1, 1, 'x'])
+        builder.add([None, None, 'y'])
+        frame = builder.build()
+        self.assertEqual([LONG_KIND, DOUBLE_KIND, STRING_KIND], [c.kind for c in frame.columns])
+        self.assertEqual([[1, 1.0, 'x'], [None, None, 'y']], frame.rows())
+
+    def test_kind_for_type(self):
+        self.assertEqual(LONG_KIND, kind_for_type('BIGINT', 'LONG'))
+        # An unknown SQL type falls back to the Druid type.
+        self.assertEqual(LONG_KIND, kind_for_type('OTHER', 'LONG'))
+        self.assertEqual(DOUBLE_KIND, kind_for_type(None, 'DOUBLE'))
+        self.assertEqual(OBJECT_KIND, kind_for_type('OTHER', 'COMPLEX<json>'))
+        self.assertEqual(OBJECT_KIND, kind_for_type('OTHER'))
+        self.assertIsNone(kind_for_type(None))
+
+    def test_timestamp(self):
+        self.assertEqual(0, parse_timestamp('1970-01-01T00:00:00.000Z'))
+        self.assertEqual(86400001, parse_timestamp('1970-01-02 00:00:00.001'))
+        self.assertEqual(5, parse_timestamp(5))
+
+    def test_result(self):
+        payload = [['t', 'n', 's'], ['TIMESTAMP', 'BIGINT', 'VARCHAR'], ['2022-01-01T00:00:00.000Z', 1, 'a'], ['2022-01-02T00:00:00.000Z', None, 'b']]
+        req = SqlRequest(None, 'SELECT 1').with_format(consts.SQL_ARRAY).with_headers(sqlTypes=True)
+        result = SqlQueryResult(req, MockResponse(json.dumps(payload)))
+        frame = result.columnar()
+        self.assertEqual(['t', 'n', 's'], frame.names())
+        self.assertEqual([TIMESTAMP_KIND, LONG_KIND, STRING_KIND], [c.kind for c in frame.columns])
+        self.assertEqual(2, len(frame))
+
+    def test_result_codec(self):
+        # The payload is decoded once, with the client's codec, for both
+        # the frame and the rows.
+        class CountingCodec(JsonCodec):
+            calls = 0
+            def loads(self, data):
+                CountingCodec.calls += 1
+                return JsonCodec.loads(self, data)
+        client = ConfigHolder(CountingCodec())
+        result = SqlQueryResult(SqlRequest(client, 'SELECT 1'), MockResponse('[{"a": 1}, {"a": 2}]'))
+        self.assertEqual([1, 2], result.columnar()['a'].values())
+        self.assertEqual(1, CountingCodec.calls)
+        self.assertEqual([{'a': 1}, {'a': 2}], result.rows())
+        self.assertEqual(1, CountingCodec.calls)
+
+    def test_numpy(self):
+        try:
+            import numpy as np
+            import pandas as pd
+        except ImportError:
+            self.skipTest('NumPy and Pandas are not installed')
+        builder = FrameBuilder()
+        for i in range(5):
+            builder.add({'__time': i * 1000, 'n': None if i == 2 else i, 's': 'v' + str(i % 2), 'd': i / 2})
+        frame = builder.build()
+        arrays = frame.to_numpy()
+        self.assertEqual(np.int64, arrays['n'].dtype)
+        self.assertEqual(np.int32, arrays['s'].dtype)
+        self.assertEqual([0, 1, 0, 1, 0], arrays['s'].tolist())
+        df = frame.to_pandas()
+        self.assertEqual(5, len(df))
+        self.assertTrue(pd.isna(df['n'][2]))
+        self.assertEqual('v1', df['s'][3])
+        self.assertEqual(np.dtype('datetime64[ms]'), df['__time'].dtype)
+        self.assertEqual(2.0, df['d'][4])
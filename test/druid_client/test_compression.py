@@ -0,0 +1,118 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from druid_client.client.config import ClusterConfig
+from druid_client.client.client import Client
+from druid_client.client.compression import compress_body
+
+ROWS = [{'channel': '#en.wikipedia', 'page': 'Page {}'.format(i), 'added': i} for i in range(2000)]
+
+class GzipHandler(BaseHTTPRequestHandler):
+    """
+    Mimics Druid's Jetty GzipHandler: gzips responses if the client
+    accepts gzip, and inflates gzipped request bodies.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(ROWS)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        self.server.bodies.append(json.loads(data))
+        self.reply(ROWS)
+
+class TestCompression(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+        cls.server.bodies = []
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_compress_body(self):
+        data = b'x' * 100
+        self.assertEqual((data, None), compress_body(data, None, None))
+        self.assertEqual((data, None), compress_body(data, None, 1000))
+        sent, headers = compress_body(data, {'Content-Type': 'application/json'}, 10)
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual(data, gzip.decompress(sent))
+
+    def test_compressed_response(self):
+        client = Client(ClusterConfig({}), self.url)
+        self.assertEqual(ROWS, client.get_json('/rows'))
+        stats = client.transfer_stats()
+        self.assertEqual(1, stats['compressed_responses'])
+        self.assertEqual(len(json.dumps(ROWS)), stats['response_body_bytes'])
+        self.assertLess(stats['response_wire_bytes'], stats['response_body_bytes'] / 4)
+        client.close()
+
+    def test_uncompressed(self):
+        client = Client(ClusterConfig({'compression': False}), self.url)
+        self.assertEqual(ROWS, client.get_json('/rows'))
+        stats = client.transfer_stats()
+        self.assertEqual(0, stats['compressed_responses'])
+        self.assertEqual(stats['response_wire_bytes'], stats['response_body_bytes'])
+        client.close()
+
+    def test_compressed_request(self):
+        client = Client(ClusterConfig({'compress_min_size': 1024}), self.url)
+        client.post_json('/task', {'spec': ROWS})
+        client.post_json('/task', {'spec': 'small'})
+        self.assertEqual({'spec': ROWS}, self.server.bodies[-2])
+        self.assertEqual({'spec': 'small'}, self.server.bodies[-1])
+        stats = client.transfer_stats()
+        self.assertEqual(2, stats['requests'])
+        self.assertEqual(1, stats['compressed_requests'])
+        self.assertLess(stats['request_wire_bytes'], stats['request_body_bytes'])
+        client.close()
+
+    def test_compressed_stream(self):
+        client = Client(ClusterConfig({}), self.url)
+        with client.sql_stream('SELECT * FROM wikipedia', chunk_size=512) as result:
+            self.assertEqual(ROWS, list(result))
+        stats = client.transfer_stats()
+        self.assertEqual(1, stats['compressed_responses'])
+        self.assertEqual(len(json.dumps(ROWS)), stats['response_body_bytes'])
+        self.assertLess(stats['response_wire_bytes'], stats['response_body_bytes'] / 4)
+        client.close()
+
+if __name__ == '__main__':
+    unittest.main()
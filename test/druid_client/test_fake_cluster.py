@@ -0,0 +1,160 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import threading
+import time
+import unittest
+import druid_client
+from druid_client.client import consts
+from druid_client.client.cache import ResultCache
+from druid_client.client.error import QueryCapacityError
+from druid_client.client.retry import Backoff, QueryRetryPolicy
+from druid_client.client.tracing import InMemoryExporter
+from druid_client.testing import FakeCluster, Fault, fixed, lognormal
+
+SPEC = {'type': 'index_parallel', 'spec': {'dataSchema': {'dataSource': 'wiki'}}}
+
+class TestFakeCluster(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeCluster(brokers=2, masters=2, task_duration=0.1)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_discovery(self):
+        client = druid_client.connect(self.fake.url())
+        cluster = client.cluster()
+        brokers = sorted(s.url() for s in cluster.for_role(consts.BROKER))
+        self.assertEqual(sorted(n.url() for n in self.fake.nodes(consts.BROKER)), brokers)
+        self.assertTrue(cluster.coordinator().is_lead())
+        self.assertEqual({'wikipedia': 100.0}, cluster.coordinator().load_status_percent())
+        self.assertEqual(self.fake.node('master-1').url(), cluster.overlord().lead())
+        client.close()
+
+    def test_sql(self):
+        self.fake.sql_handler = lambda sql, context: [{'x': 1, 'y': 'a'}, {'x': 2, 'y': 'b'}]
+        client = druid_client.connect(self.fake.url())
+        self.assertEqual([{'x': 1, 'y': 'a'}, {'x': 2, 'y': 'b'}], client.sql('SELECT x, y FROM t'))
+        result = client.sql_query(client.sql_request('SELECT x, y FROM t').with_format(consts.SQL_ARRAY).with_headers(sqlTypes=True))
+        self.assertEqual([[1, 'a'], [2, 'b']], result.rows())
+        self.assertEqual(['BIGINT', 'VARCHAR'], [c.sql_type for c in result.schema()])
+        client.close()
+
+    def test_ingest(self):
+        exporter = InMemoryExporter()
+        client = druid_client.connect(self.fake.url(), tracing=exporter)
+        cluster = client.cluster()
+        task = cluster.ingest(SPEC)
+        self.assertEqual(consts.RUNNING_STATE, task.state())
+        self.assertTrue(task.join(poll_secs=0.02))
+        self.assertEqual(consts.SUCCESS_STATE, task.state())
+        self.assertEqual(1, len(exporter.find('task.join')))
+        self.fake.fail_tasks = True
+        self.assertFalse(cluster.ingest(SPEC).join(poll_secs=0.02))
+        client.close()
+
+    def test_faults(self):
+        client = druid_client.connect(self.fake.url(), query_retry=QueryRetryPolicy(max_attempts=10, backoff=Backoff(base=0.001)))
+        router = self.fake.node('router')
+        router.fault = Fault(rate=0.5, status=429)
+        for _ in range(10):
+            client.sql('SELECT 1')
+        self.assertGreater(router.faults, 0)
+        self.assertEqual(router.faults, client.retry_stats()['query_retries'])
+        router.fault = Fault(rate=1.0, status=429)
+        client = druid_client.connect(self.fake.url(), query_retry=None)
+        with self.assertRaises(QueryCapacityError):
+            client.sql('SELECT 1')
+        client.close()
+
+    def test_latency(self):
+        router = self.fake.node('router')
+        router.latency = fixed(0.05)
+        client = druid_client.connect(self.fake.url())
+        start = time.perf_counter()
+        client.sql('SELECT 1')
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        client.close()
+        # Draws are repeatable for a given seed.
+        dist = lognormal(0.01, 0.5)
+        rnd1, rnd2 = random.Random(1), random.Random(1)
+        self.assertEqual([dist(rnd1) for _ in range(5)], [dist(rnd2) for _ in range(5)])
+
+    def test_leader_change(self):
+        client = druid_client.connect(self.fake.url())
+        cluster = client.cluster()
+        overlord = cluster.overlord()
+        task = cluster.ingest(SPEC)
+        self.fake.rotate_leader(consts.OVERLORD)
+        self.assertFalse(overlord.is_lead())
+        # The old leader redirects to the new one.
+        self.assertEqual(task.id(), overlord.task_status(task.id())['task'])
+        self.assertGreater(self.fake.node('master-2').paths.get('/druid/indexer/v1/task/{}/status'.format(task.id()), 0), 0)
+        cluster.refresh()
+        self.assertEqual(self.fake.node('master-2').url(), cluster.overlord().endpoint)
+        client.close()
+
+    def test_node_removed(self):
+        client = druid_client.connect(self.fake.url())
+        cluster = client.cluster()
+        self.fake.remove_node('broker-2')
+        cluster.refresh()
+        self.assertEqual([self.fake.node('broker-1').url()], [s.url() for s in cluster.for_role(consts.BROKER)])
+        client.close()
+
+    def test_broker_tracked(self):
+        started = threading.Event()
+        release = threading.Event()
+        def handler(sql, context):
+            if 'slow' in sql:
+                started.set()
+                release.wait(5)
+            return [{'x': 1}]
+        self.fake.sql_handler = handler
+        client = druid_client.connect(self.fake.url())
+        cluster = client.cluster()
+        pool = cluster.broker_pool()
+        broker = cluster.broker()
+        self.assertEqual([{'x': 1}], broker.sql('SELECT 1'))
+        node = [n for n in pool.nodes() if n.url == broker.endpoint][0]
+        self.assertEqual(1, node.queries)
+        self.assertIsNotNone(node.latency)
+        # A query in flight on the Broker steers the next one elsewhere.
+        thread = threading.Thread(target=broker.sql, args=['SELECT slow'])
+        thread.start()
+        started.wait(5)
+        self.assertEqual(1, node.outstanding)
+        self.assertNotEqual(broker.endpoint, cluster.broker().endpoint)
+        release.set()
+        thread.join()
+        self.assertEqual(0, node.outstanding)
+        pool.close()
+        client.close()
+
+    def test_refresh_with_cache(self):
+        client = druid_client.connect(self.fake.url(), result_cache=ResultCache())
+        cluster = client.cluster()
+        self.assertEqual(2, len(cluster.for_role(consts.BROKER)))
+        self.fake.add_node('broker-3', [consts.BROKER])
+        # The topology must not be served from the result cache.
+        cluster.refresh()
+        self.assertEqual(3, len(cluster.for_role(consts.BROKER)))
+        self.assertEqual(0, client.cache().stats.hits)
+        self.assertEqual(0, len(client.cache()))
+        client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from druid_client.client.config import ClusterConfig
+from druid_client.client.client import Client
+from druid_client.client.metrics import Histogram, MetricsRegistry, RequestEvent, RequestHook, PrintHook
+
+class TaskHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/druid/indexer/v1/task/'):
+            self.reply(200, {'task': self.path.split('/')[-2], 'status': 'SUCCESS'})
+        else:
+            self.reply(404, {'error': 'Not found'})
+
+class EventHook(RequestHook):
+
+    def __init__(self):
+        self.before = []
+        self.after = []
+
+    def before_request(self, event):
+        self.before.append(event)
+
+    def after_request(self, event):
+        self.after.append(event)
+
+class BadHook(RequestHook):
+
+    def after_request(self, event):
+        raise Exception('oops')
+
+class TestHistogram(unittest.TestCase):
+
+    def test_quantiles(self):
+        h = Histogram(bounds=[1, 2, 4, 8])
+        for v in [0.5, 1.5, 1.5, 3, 100]:
+            h.observe(v)
+        self.assertEqual(5, h.count)
+        self.assertEqual([(1, 1), (2, 3), (4, 4), (8, 4), (float('inf'), 5)], h.buckets())
+        self.assertAlmostEqual(1.75, h.quantile(0.5))
+        self.assertEqual(8, h.quantile(0.99))
+        self.assertIsNone(Histogram().quantile(0.5))
+
+    def test_prometheus(self):
+        registry = MetricsRegistry()
+        event = RequestEvent('GET', 'http://broker:8082', '/druid/v2/datasources/{}', 'http://broker:8082/druid/v2/datasources/wiki')
+        event.status = 200
+        event.bytes_sent = 0
+        event.bytes_received = 100
+        event.body_bytes = 400
+        event.latency = 0.02
+        event.connect = 0.0
+        event.ttfb = 0.015
+        event.download = 0.005
+        registry.after_request(event)
+        text = registry.to_prometheus()
+        self.assertIn('druid_client_requests_total{method="GET",endpoint="/druid/v2/datasources/{}",status="200"} 1', text)
+        self.assertIn('druid_client_bytes_total{method="GET",endpoint="/druid/v2/datasources/{}",direction="received"} 100', text)
+        self.assertIn('druid_client_request_seconds_bucket{method="GET",endpoint="/druid/v2/datasources/{}",phase="ttfb",le="0.025"} 1', text)
+        self.assertIn('druid_client_request_seconds_count{method="GET",endpoint="/druid/v2/datasources/{}",phase="latency"} 1', text)
+        stats = registry.to_dict()['GET /druid/v2/datasources/{}']
+        self.assertEqual(1, stats['requests'])
+        self.assertEqual(0, stats['errors'])
+
+class TestRequestMetrics(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), TaskHandler)
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_events(self):
+        hook = EventHook()
+        client = Client(ClusterConfig({'hooks': [hook, BadHook()]}), self.url)
+        client.get_json('/druid/indexer/v1/task/{}/status', args=['t1'])
+        client.get_json('/druid/indexer/v1/task/{}/status', args=['t2'])
+        with self.assertRaises(Exception):
+            client.get_json('/missing')
+        self.assertEqual(3, len(hook.before))
+        self.assertEqual(3, len(hook.after))
+        first, second, missing = hook.after
+        self.assertEqual('/druid/indexer/v1/task/{}/status', first.template)
+        self.assertEqual(self.url + '/druid/indexer/v1/task/t1/status', first.url)
+        self.assertEqual(200, first.status)
+        self.assertGreater(first.connect, 0)
+        # The second request reuses the pooled connection.
+        self.assertEqual(0, second.connect)
+        self.assertEqual(404, missing.status)
+        for e in hook.after:
+            self.assertAlmostEqual(e.latency, e.connect + e.ttfb + e.download)
+            self.assertEqual(e.body_bytes, e.bytes_received)
+
+        metrics = client.metrics().endpoint('GET', '/druid/indexer/v1/task/{}/status')
+        self.assertEqual(2, metrics.requests)
+        self.assertEqual({'200': 2}, metrics.statuses)
+        self.assertEqual(2, metrics.histograms['latency'].count)
+        self.assertEqual(1, client.metrics().endpoint('GET', '/missing').errors)
+        client.close()
+
+    def test_disabled(self):
+        client = Client(ClusterConfig({'metrics': False}), self.url)
+        self.assertIsNone(client.metrics())
+        client.get_json('/druid/indexer/v1/task/{}/status', args=['t1'])
+        client.close()
+
+    def test_trace(self):
+        config = ClusterConfig({})
+        hooks = list(config.hooks)
+        self.assertFalse(config.trace)
+        config.trace = True
+        self.assertTrue(config.trace)
+        self.assertIsInstance(config.hooks[-1], PrintHook)
+        config.trace = False
+        self.assertFalse(config.trace)
+        self.assertEqual(hooks, config.hooks)
+        self.assertFalse(any(isinstance(hook, PrintHook) for hook in config.hooks))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import druid_client
+from druid_client.client.error import ClientError, QueryCapacityError
+from druid_client.client.columnar import TIMESTAMP_KIND
+from druid_client.client.native import ScanBatchParser, count, long_sum, selector
+from druid_client.testing import FakeCluster, Fault
+
+class TestScanBatchParser(unittest.TestCase):
+
+    def test_batches(self):
+        payload = ('[{"segmentId": "s1", "columns": ["__time", "a"], "events": [[1, "x"], [2, "y"]]},'
+            '{"segmentId": "s2", "columns": ["b", "__time"], "events": [[true, 3]]}]')
+        parser = ScanBatchParser(True)
+        rows = []
+        for i in range(0, len(payload), 7):
+            rows.extend(parser.feed(payload[i:i + 7]))
+        rows.extend(parser.close())
+        # The second batch is mapped onto the columns of the first.
+        self.assertEqual([[1, 'x'], [2, 'y'], [3, None]], rows)
+        self.assertEqual(['__time', 'a'], parser.columns)
+
+class TestNativeQuery(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCluster(brokers=1, masters=1, historicals=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def setUp(self):
+        self.queries = []
+        self.client = druid_client.connect(self.fake.url())
+
+    def tearDown(self):
+        self.client.close()
+
+    def handler(self, response):
+        def handle(query):
+            self.queries.append(query)
+            return response
+        return handle
+
+    def test_request(self):
+        query = (self.client.timeseries('wiki')
+            .with_interval('2022-01-01T00:00:00Z', '2022-01-02T00:00:00Z')
+            .with_granularity('hour')
+            .with_filter(selector('channel', '#en'))
+            .with_aggregations(count('rows'), long_sum('added'))
+            .with_query_id('q1'))
+        self.assertEqual({
+            'queryType': 'timeseries',
+            'dataSource': 'wiki',
+            'granularity': 'hour',
+            'intervals': ['2022-01-01T00:00:00Z/2022-01-02T00:00:00Z'],
+            'filter': {'type': 'selector', 'dimension': 'channel', 'value': '#en'},
+            'aggregations': [{'type': 'count', 'name': 'rows'}, {'type': 'longSum', 'name': 'added', 'fieldName': 'added'}],
+            'context': {'queryId': 'q1'},
+            }, query.to_request())
+        self.assertEqual('q1', query.query_id)
+
+    def test_timeseries(self):
+        self.fake.native_handler = self.handler([
+            {'timestamp': '2022-01-01T00:00:00.000Z', 'result': {'rows': 3, 'added': 10}},
+            {'timestamp': '2022-01-01T01:00:00.000Z', 'result': {'rows': 1, 'added': 5}}])
+        result = self.client.timeseries('wiki').with_granularity('hour').run()
+        self.assertTrue(result.ok())
+        self.assertEqual({'timestamp': '2022-01-01T00:00:00.000Z', 'rows': 3, 'added': 10}, result.rows()[0])
+        self.assertEqual(['timestamp', 'rows', 'added'], [c.name for c in result.schema()])
+        self.assertEqual(self.queries[0]['context']['queryId'], result.id())
+        self.assertEqual(2, result.columnar().row_count())
+
+    def test_top_n_group_by(self):
+        self.fake.native_handler = self.handler([
+            {'timestamp': 't', 'result': [{'page': 'a', 'edits': 5}, {'page': 'b', 'edits': 2}]}])
+        rows = self.client.top_n('wiki').with_dimension('page').with_metric('edits').with_threshold(2).run().rows()
+        self.assertEqual([{'timestamp': 't', 'page': 'a', 'edits': 5}, {'timestamp': 't', 'page': 'b', 'edits': 2}], rows)
+        self.fake.native_handler = self.handler([{'version': 'v1', 'timestamp': 't', 'event': {'page': 'a', 'edits': 5}}])
+        rows = self.client.group_by('wiki').with_dimensions('page').run().rows()
+        self.assertEqual([{'timestamp': 't', 'page': 'a', 'edits': 5}], rows)
+        rows = self.client.native_query({'queryType': 'segmentMetadata', 'dataSource': 'wiki'}).rows()
+        self.assertEqual('groupBy', self.queries[-2]['queryType'])
+        self.assertNotIn('intervals', self.queries[-1])
+
+    def test_scan_stream(self):
+        batches = [
+            {'segmentId': 's1', 'columns': ['__time', 'page', 'added'], 'events': [[1640995200000 + i, 'p' + str(i), i] for i in range(50)]},
+            {'segmentId': 's2', 'columns': ['__time', 'page', 'added'], 'events': [[1641081600000 + i, 'q' + str(i), i] for i in range(50)]}]
+        self.fake.native_handler = self.handler(batches)
+        query = self.client.scan('wiki').with_columns('__time', 'page', 'added')
+        with query.stream(chunk_size=64) as result:
+            self.assertEqual(['__time', 'page', 'added'], [c.name for c in result.schema()])
+            rows = list(result)
+        self.assertEqual('compactedList', self.queries[0]['resultFormat'])
+        self.assertEqual(100, len(rows))
+        self.assertEqual([1640995200000, 'p0', 0], rows[0])
+        frame = self.client.scan('wiki').run().columnar()
+        self.assertEqual(100, frame.row_count())
+        self.assertEqual(TIMESTAMP_KIND, frame.column('__time').kind)
+        self.assertEqual(1640995200000, frame.column('__time').values()[0])
+
+    def test_scan_cancel(self):
+        self.fake.native_handler = self.handler([{'columns': ['a'], 'events': [[i] for i in range(5000)]}])
+        result = self.client.scan('wiki').stream(chunk_size=64)
+        next(iter(result))
+        result.close()
+        self.assertIn(self.queries[0]['context']['queryId'], self.fake.cancelled)
+        with self.assertRaises(ClientError):
+            self.client.native_stream(self.client.timeseries('wiki'))
+
+    def test_errors(self):
+        router = self.fake.node('router')
+        router.fault = Fault(status=429, path='/druid/v2')
+        try:
+            result = self.client.native_query(self.client.timeseries('wiki'), retry=False)
+        finally:
+            router.fault = None
+        self.assertFalse(result.ok())
+        self.assertIsInstance(result.druid_error(), QueryCapacityError)
+
+if __name__ == '__main__':
+    unittest.main()
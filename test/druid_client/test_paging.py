@@ -0,0 +1,112 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import re
+import unittest
+import druid_client
+from druid_client.client import consts
+from druid_client.client.error import ClientError
+from druid_client.client.paging import page_sql
+from druid_client.testing import FakeCluster
+
+# Rows with a non-unique key: several rows share each of ids 2, 5 and 9.
+ROWS = [{'id': i, 'seq': n} for n, i in enumerate([1, 2, 2, 2, 3, 4, 5, 5, 5, 5, 6, 7, 8, 9, 9, 10, 11])]
+
+def keyset_handler(rnd, queries):
+    """
+    Serves ROWS in key order, honoring the pager's `"id" >= n` predicate
+    and LIMIT. Rows which share a key come back in random order.
+    """
+    def handler(sql, context):
+        queries.append(sql)
+        match = re.search(r'"id" >= (\d+)', sql)
+        low = int(match.group(1)) if match else 0
+        limit = int(re.search(r'LIMIT (\d+)', sql).group(1))
+        rows = [r for r in ROWS if r['id'] >= low]
+        rnd.shuffle(rows)
+        rows.sort(key=lambda r: r['id'])
+        return rows[:limit]
+    return handler
+
+class TestPaging(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCluster(brokers=1, masters=1, historicals=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def setUp(self):
+        self.queries = []
+        self.fake.sql_handler = keyset_handler(random.Random(3), self.queries)
+        self.client = druid_client.connect(self.fake.url())
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_sql(self):
+        self.assertEqual(
+            'SELECT * FROM t WHERE (TRUE) ORDER BY "__time" LIMIT 10',
+            page_sql('SELECT * FROM t WHERE {keyset};', ['__time'], None, 10))
+        self.assertEqual(
+            "SELECT * FROM t WHERE ((\"__time\" > TIMESTAMP '2022-01-01 00:00:01.500000') OR "
+            "(\"__time\" = TIMESTAMP '2022-01-01 00:00:01.500000' AND \"id\" >= 'a''b')) ORDER BY \"__time\", \"id\" LIMIT 5",
+            page_sql('SELECT * FROM t WHERE {keyset}', ['__time', 'id'], ('2022-01-01T00:00:01.500Z', "a'b"), 5))
+
+    def test_pages(self):
+        for prefetch in [True, False]:
+            pages = list(self.client.sql_pages('SELECT * FROM t WHERE {keyset}', page_size=5, order_key='id', prefetch=prefetch))
+            rows = [row for page in pages for row in page.rows()]
+            self.assertEqual(sorted(ROWS, key=lambda r: r['seq']), sorted(rows, key=lambda r: r['seq']))
+            self.assertEqual(len(ROWS), len(rows))
+            self.assertTrue(all(len(page.rows()) <= 5 for page in pages))
+
+    def test_cached(self):
+        # Paging runs each page query afresh, and leaves any cached result
+        # of the same query intact.
+        self.client.enable_cache()
+        for _ in range(2):
+            rows = [row for page in self.client.sql_pages('SELECT * FROM t WHERE {keyset}', page_size=5, order_key='id') for row in page.rows()]
+            self.assertEqual(len(ROWS), len(rows))
+        self.assertEqual(0, len(self.client.cache()))
+        # The page frame holds only the rows of the page.
+        pages = list(self.client.sql_pages('SELECT * FROM t WHERE {keyset}', page_size=5, order_key='id'))
+        self.assertEqual([len(p.rows()) for p in pages], [len(p.columnar()) for p in pages])
+
+    def test_array(self):
+        request = self.client.sql_request('SELECT * FROM t WHERE {keyset}').with_format(consts.SQL_ARRAY).with_headers()
+        rows = [row for page in self.client.sql_pages(request, page_size=6, order_key='id') for row in page.rows()]
+        self.assertEqual(len(ROWS), len(rows))
+        with self.assertRaises(ClientError):
+            self.client.sql_pages(self.client.sql_request('SELECT * FROM t WHERE {keyset}').with_format(consts.SQL_ARRAY))
+
+    def test_errors(self):
+        with self.assertRaises(ClientError):
+            self.client.sql_pages('SELECT * FROM t')
+        # More rows share id 5 than fit in a page.
+        with self.assertRaises(ClientError):
+            list(self.client.sql_pages('SELECT * FROM t WHERE {keyset}', page_size=3, order_key='id'))
+
+    def test_abandon(self):
+        pages = self.client.sql_pages('SELECT * FROM t WHERE {keyset}', page_size=5, order_key='id')
+        next(pages)
+        pages.close()
+        # The first page and, at most, the prefetched second.
+        self.assertLessEqual(len(self.queries), 2)
+
+if __name__ == '__main__':
+    unittest.main()
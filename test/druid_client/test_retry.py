@@ -0,0 +1,220 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+from datetime import datetime, timezone
+import requests
+from druid_client.client.config import ClusterConfig
+from druid_client.client.service import Service
+from druid_client.client.retry import RetryPolicy, QueryRetryPolicy, Backoff, CircuitBreaker, retry_after, OPEN, HALF_OPEN, CLOSED
+from druid_client.client.error import CircuitOpenError, QueryError, QueryCapacityError, QueryValidationError, QueryTimeoutError
+from druid_client.client.client import Client
+from druid_client.client.sql import SqlRequest, SqlQueryResult
+from test_stream import MockResponse
+
+class MockSession:
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.bodies = []
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        data = kwargs.get('data')
+        self.bodies.append(None if data is None else json.loads(data))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if type(outcome) is tuple:
+            return MockResponse(outcome[1], outcome[0])
+        response = MockResponse('{}', outcome)
+        response.headers = {'Retry-After': '2'} if outcome == 503 else {}
+        return response
+
+class MockClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestRetry(unittest.TestCase):
+
+    def make_service(self, outcomes, **options):
+        self.sleeps = []
+        options.setdefault('retry', RetryPolicy(backoff=Backoff(jitter=False), sleep=self.sleeps.append))
+        service = Service(ClusterConfig(options), 'http://broker:8082')
+        service.session = MockSession(outcomes)
+        return service
+
+    def test_backoff(self):
+        backoff = Backoff(base=1, multiplier=2, max_delay=5, jitter=False)
+        self.assertEqual([1, 2, 4, 5], [backoff.delay(i) for i in range(4)])
+        backoff.jitter = True
+        for i in range(10):
+            self.assertTrue(0 <= backoff.delay(i) <= 5)
+
+    def test_retry_after(self):
+        self.assertEqual(7.0, retry_after(MockHeaders('7')))
+        now = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(30.0, retry_after(MockHeaders('Sat, 01 Jan 2022 00:00:30 GMT'), now))
+        self.assertIsNone(retry_after(MockHeaders(None)))
+
+    def test_get_retried(self):
+        service = self.make_service([requests.exceptions.ConnectionError(), 503, 200])
+        r = service.get('/status')
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(3, service.session.calls)
+        # Backoff of 0.1, then the longer Retry-After of 2 seconds.
+        self.assertEqual([0.1, 2.0], self.sleeps)
+        stats = service.retry_stats()
+        self.assertEqual(2, stats['retries'])
+        self.assertEqual(1, stats['recovered'])
+
+    def test_post_not_retried(self):
+        service = self.make_service([503, 200])
+        r = service.post_only_json('/druid/v2/sql', {'query': 'INSERT INTO t SELECT 1'})
+        self.assertEqual(503, r.status_code)
+        service = self.make_service([503, 200])
+        r = service.post_only_json('/druid/v2/sql', {'query': 'SELECT 1'}, idempotent=True)
+        self.assertEqual(200, r.status_code)
+
+    def test_exhausted(self):
+        service = self.make_service([503, 503, 503, 200])
+        self.assertEqual(503, service.get('/status', require_ok=False).status_code)
+        self.assertEqual(1, service.retry_stats()['exhausted'])
+
+        service = self.make_service([200], retry=None)
+        service.session = MockSession([requests.exceptions.ConnectionError()])
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            service.get('/status')
+
+    def test_breaker(self):
+        clock = MockClock()
+        breaker = CircuitBreaker('http://x', failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(OPEN, breaker.state)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        clock.now = 10
+        breaker.before_request()
+        self.assertEqual(HALF_OPEN, breaker.state)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(OPEN, breaker.state)
+        clock.now = 20
+        breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(CLOSED, breaker.state)
+
+    def test_breaker_fails_fast(self):
+        down = [requests.exceptions.ConnectionError()] * 5
+        service = self.make_service(down, retry=None)
+        for _ in range(5):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                service.get('/status')
+        with self.assertRaises(CircuitOpenError):
+            service.get('/status')
+        self.assertEqual(5, service.session.calls)
+        stats = service.retry_stats()
+        self.assertEqual(1, stats['breaker_opens'])
+        self.assertEqual('open', stats['breakers']['http://broker:8082']['state'])
+
+    def test_breaker_trial_timeout(self):
+        down = [requests.exceptions.ConnectionError()] * 5
+        service = self.make_service(down + [requests.exceptions.ReadTimeout(), 200], retry=None)
+        clock = MockClock()
+        service.cluster_config.breakers.clock = clock
+        for _ in range(5):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                service.get('/status')
+        # The half-open trial times out: not a failure of the endpoint, but
+        # the breaker lets another trial through rather than waiting forever.
+        clock.now = 30
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            service.get('/status')
+        breaker = service.cluster_config.breakers.breaker('http://broker:8082')
+        self.assertEqual(HALF_OPEN, breaker.state)
+        self.assertEqual(200, service.get('/status').status_code)
+        self.assertEqual(CLOSED, breaker.state)
+
+    def test_breaker_ignores_timeouts(self):
+        timeouts = [requests.exceptions.ReadTimeout()] * 5
+        service = self.make_service(timeouts + [KeyboardInterrupt(), 200], retry=None)
+        for _ in range(5):
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                service.get('/status')
+        with self.assertRaises(KeyboardInterrupt):
+            service.get('/status')
+        breaker = service.cluster_config.breakers.breaker('http://broker:8082')
+        self.assertEqual(CLOSED, breaker.state)
+        self.assertEqual(0, breaker.failures)
+        self.assertEqual(200, service.get('/status').status_code)
+
+class MockHeaders:
+
+    def __init__(self, value):
+        self.headers = {} if value is None else {'Retry-After': value}
+
+CAPACITY_ERROR = '{"error": "Query capacity exceeded", "errorMessage": "Too many concurrent queries"}'
+
+class TestQueryRetry(unittest.TestCase):
+
+    def test_classify(self):
+        def classify(status, payload):
+            return SqlQueryResult(SqlRequest(None, 'SELECT 1'), MockResponse(payload, status)).druid_error()
+        err = classify(429, CAPACITY_ERROR)
+        self.assertIsInstance(err, QueryCapacityError)
+        self.assertTrue(err.retryable)
+        self.assertEqual('Query capacity exceeded', err.code())
+        self.assertIsInstance(classify(504, '{"error": "Query timeout"}'), QueryTimeoutError)
+        err = classify(400, '{"error": "druidException", "category": "INVALID_INPUT", "errorMessage": "bad"}')
+        self.assertIsInstance(err, QueryValidationError)
+        self.assertFalse(err.retryable)
+        self.assertEqual(QueryError, type(classify(500, '{"error": "Unknown exception"}')))
+        self.assertIsNone(classify(200, '[]'))
+
+    def make_client(self, outcomes, **options):
+        self.sleeps = []
+        options.setdefault('query_retry', QueryRetryPolicy(priority_step=10, lane='low', sleep=self.sleeps.append))
+        client = Client(ClusterConfig(options), 'http://broker:8082')
+        client.session = MockSession(outcomes)
+        return client
+
+    def test_retried(self):
+        client = self.make_client([(429, CAPACITY_ERROR), (429, CAPACITY_ERROR), (200, '[{"a": 1}]')])
+        self.assertEqual([{'a': 1}], client.sql('SELECT 1'))
+        self.assertEqual(2, len(self.sleeps))
+        contexts = [body['context'] for body in client.session.bodies]
+        self.assertEqual([None, -10, -20], [c.get('priority') for c in contexts])
+        self.assertEqual([None, 'low', 'low'], [c.get('lane') for c in contexts])
+        self.assertEqual(3, len(set(c['sqlQueryId'] for c in contexts)))
+        self.assertEqual(1, client.retry_stats()['query_recovered'])
+
+    def test_not_retried(self):
+        client = self.make_client([(400, '{"error": "SQL parse failed"}')])
+        with self.assertRaises(QueryValidationError):
+            client.sql('SELEC 1')
+        client = self.make_client([(429, CAPACITY_ERROR)] * 3)
+        with self.assertRaises(QueryCapacityError):
+            client.sql('SELECT 1')
+        self.assertEqual(1, client.retry_stats()['query_exhausted'])
+        client = self.make_client([(429, CAPACITY_ERROR)], query_retry=None)
+        self.assertFalse(client.sql_query('SELECT 1').ok())
@@ -0,0 +1,48 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from druid_client.client.config import ClusterConfig
+from druid_client.cluster.coord import Coordinator
+from druid_client.cluster.overlord import Overlord
+
+class TestSessionRegistry(unittest.TestCase):
+
+    def test_shared(self):
+        config = ClusterConfig({'pool_size': 4, 'keep_alive': False})
+        url = 'http://master:8081'
+        coord = Coordinator(config, url)
+        overlord = Overlord(config, url)
+        other = Coordinator(config, 'http://other:8081')
+        self.assertIs(coord.session, overlord.session)
+        self.assertIsNot(coord.session, other.session)
+        self.assertEqual(2, len(config.sessions))
+        self.assertEqual('close', coord.session.headers['Connection'])
+
+        old = coord.session.get_adapter('http://')
+        old.poolmanager.connection_from_url(url)
+        coord.ensure_pool_size(16)
+        self.assertEqual(16, config.sessions.pool_size_for(url))
+        # The replaced adapter is closed.
+        self.assertEqual(0, len(old.poolmanager.pools))
+        self.assertIsNot(old, coord.session.get_adapter('https://'))
+        coord.ensure_pool_size(8)
+        self.assertEqual(16, config.sessions.pool_size_for(url))
+
+        # The session stays open while any client uses it.
+        coord.close()
+        coord.close()
+        self.assertEqual(2, len(config.sessions))
+        overlord.close()
+        self.assertEqual(['http://other:8081'], config.sessions.endpoints())
@@ -0,0 +1,72 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from datetime import datetime
+from druid_client.client.slicing import time_slices, merge_rows, slice_sql, slice_requests
+from druid_client.client.sql import SqlRequest
+from druid_client.client.util import floor_time, next_time
+from druid_client.client import consts
+
+class TestSlicing(unittest.TestCase):
+
+    def test_floor(self):
+        dt = datetime(2022, 5, 18, 13, 47, 3)
+        self.assertEqual(datetime(2022, 5, 18, 13, 45), floor_time(dt, consts.MINUTE_15_GRAIN))
+        self.assertEqual(datetime(2022, 5, 16), floor_time(dt, consts.WEEK_GRAIN))
+        self.assertEqual(datetime(2022, 4, 1), floor_time(dt, consts.QUARTER_GRAIN))
+        self.assertEqual(datetime(2023, 1, 1), next_time(datetime(2022, 11, 1), consts.MONTH_GRAIN, 2))
+
+    def test_slices(self):
+        slices = time_slices('2022-01-30T12:00:00Z', datetime(2022, 4, 1), consts.MONTH_GRAIN)
+        self.assertEqual([
+            (datetime(2022, 1, 30, 12), datetime(2022, 2, 1)),
+            (datetime(2022, 2, 1), datetime(2022, 3, 1)),
+            (datetime(2022, 3, 1), datetime(2022, 4, 1))],
+            slices)
+        slices = time_slices(datetime(2022, 1, 1), datetime(2022, 1, 11), consts.DAY_GRAIN, max_slices=3)
+        self.assertEqual(3, len(slices))
+        self.assertEqual(datetime(2022, 1, 1), slices[0][0])
+        self.assertEqual(datetime(2022, 1, 11), slices[-1][1])
+        for i in range(2):
+            self.assertEqual(slices[i][1], slices[i + 1][0])
+
+    def test_sql(self):
+        sql = slice_sql('SELECT * FROM t WHERE {time_range}', datetime(2022, 1, 1), datetime(2022, 1, 2))
+        self.assertEqual(
+            "SELECT * FROM t WHERE \"__time\" >= TIMESTAMP '2022-01-01 00:00:00' AND \"__time\" < TIMESTAMP '2022-01-02 00:00:00'",
+            sql)
+
+    def test_query_ids(self):
+        request = SqlRequest(None, 'SELECT * FROM t WHERE {time_range}')
+        _, requests = slice_requests(None, request, '2022-01-01', '2022-01-04', consts.DAY_GRAIN, None, None, consts.TIME_COL)
+        self.assertEqual([None] * 3, [r.context for r in requests])
+        # Each slice gets its own ID, derived from the caller's.
+        request.with_query_id('q')
+        _, requests = slice_requests(None, request, '2022-01-01', '2022-01-04', consts.DAY_GRAIN, None, None, consts.TIME_COL)
+        self.assertEqual(['q-0', 'q-1', 'q-2'], [r.context[consts.SQL_QUERY_ID_KEY] for r in requests])
+        self.assertEqual('q', request.context[consts.SQL_QUERY_ID_KEY])
+
+    def test_merge(self):
+        rows = [
+            {'k': 'a', 'n': 1, 'lo': 5, 'hi': 5},
+            {'k': 'b', 'n': 2, 'lo': None, 'hi': 1},
+            {'k': 'a', 'n': 3, 'lo': 2, 'hi': 9},
+            {'k': 'b', 'n': 4, 'lo': 7, 'hi': 0},
+            ]
+        merged = merge_rows(rows, {'n': 'count', 'lo': 'min', 'hi': 'MAX'})
+        self.assertEqual([
+            {'k': 'a', 'n': 4, 'lo': 2, 'hi': 9},
+            {'k': 'b', 'n': 6, 'lo': 7, 'hi': 1}],
+            merged)
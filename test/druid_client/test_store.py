@@ -0,0 +1,115 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+from druid_client.client.cache import ResultCache
+from druid_client.client.sql import SqlRequest, SqlQueryResult
+from druid_client.client import consts
+from test_stream import MockResponse
+
+try:
+    import numpy
+    from druid_client.client.store import DiskResultStore
+except ImportError:
+    numpy = None
+
+ROWS = [
+    {'__time': '2022-01-01T00:00:00.000Z', 'name': 'a', 'n': 1, 'x': 1.5, 'o': [1, 2]},
+    {'__time': '2022-01-01T01:00:00.000Z', 'name': 'é', 'n': None, 'x': None, 'o': None},
+    {'__time': '2022-01-01T02:00:00.000Z', 'name': 'a', 'n': 3, 'x': 2.0, 'o': {'k': 'v'}},
+    ]
+
+def make_result(sql, rows=ROWS):
+    req = SqlRequest(None, sql)
+    return req, SqlQueryResult(req, MockResponse(json.dumps(rows)))
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestDiskStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        store = DiskResultStore(self.dir.name, min_seconds=0)
+        req, result = make_result('SELECT * FROM t')
+        self.assertIsNone(store.get(req))
+        self.assertTrue(store.put(req, result))
+        stored = DiskResultStore(self.dir.name).get(SqlRequest(None, 'SELECT *  FROM t'))
+        self.assertIsNotNone(stored)
+        self.assertTrue(stored.ok())
+        self.assertEqual(ROWS, stored.rows())
+        # Python values, as in a live result, not NumPy scalars.
+        self.assertEqual(json.dumps(ROWS), json.dumps(stored.rows()))
+        self.assertEqual([int, float], [type(stored.rows()[2][c]) for c in ['n', 'x']])
+        self.assertIsInstance(stored.columnar()['n'].data, numpy.memmap)
+        self.assertEqual(['__time', 'name', 'n', 'x', 'o'], [c.name for c in stored.schema()])
+
+    def test_empty(self):
+        store = DiskResultStore(self.dir.name, min_seconds=0)
+        req, result = make_result('SELECT 1', rows=[])
+        store.put(req, result)
+        self.assertEqual([], store.get(req).rows())
+
+    def test_eviction(self):
+        store = DiskResultStore(self.dir.name, min_seconds=0)
+        req1, result1 = make_result('SELECT 1')
+        store.put(req1, result1)
+        store.max_bytes = store.size() + 10
+        os.utime(os.path.join(store._path(store_key(req1)), 'meta.json'), (0, 0))
+        req2, result2 = make_result('SELECT 2')
+        store.put(req2, result2)
+        self.assertIsNone(store.get(req1))
+        self.assertIsNotNone(store.get(req2))
+
+    def test_expiry(self):
+        store = DiskResultStore(self.dir.name, min_seconds=0, ttl=-1)
+        req, result = make_result('SELECT 1')
+        store.put(req, result)
+        self.assertIsNone(store.get(req))
+        self.assertEqual(0, store.size())
+
+    def test_two_tier(self):
+        store = DiskResultStore(self.dir.name, min_seconds=0)
+        req, result = make_result('SELECT * FROM t')
+        ResultCache(store=store).put(req, result)
+        cache = ResultCache(store=store)
+        stored = cache.get(req)
+        self.assertEqual(ROWS, stored.rows())
+        self.assertIs(stored, cache.get(req))
+        self.assertEqual(1, cache.stats.disk_hits)
+        self.assertEqual(1, cache.stats.hits)
+
+    def test_invalidate_matching(self):
+        store = DiskResultStore(self.dir.name, min_seconds=0)
+        cache = ResultCache(store=store)
+        req1, result1 = make_result('SELECT * FROM foo')
+        req2, result2 = make_result('SELECT * FROM bar')
+        cache.put(req1, result1)
+        cache.put(req2, result2)
+        cache.invalidate_matching(lambda sql: 'foo' in sql)
+        # Not reloaded from the store.
+        self.assertIsNone(cache.get(req1))
+        self.assertIsNone(store.get(req1))
+        self.assertEqual(0, cache.stats.disk_hits)
+        self.assertIsNotNone(store.get(req2))
+
+def store_key(request):
+    from druid_client.client.cache import cache_key
+    return cache_key(request)
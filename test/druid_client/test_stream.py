@@ -0,0 +1,179 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+import unittest
+from druid_client.client.json_stream import RowStreamParser
+from druid_client.client.sql import SqlRequest, SqlStreamResult
+from druid_client.client.error import QueryTimeoutError
+from druid_client.client import consts
+
+def chunked(text, size):
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def parse_all(parser, chunks):
+    rows = []
+    for chunk in chunks:
+        rows.extend(parser.feed(chunk))
+    rows.extend(parser.close())
+    return rows
+
+class MockResponse:
+
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.headers = {'X-Druid-SQL-Query-Id': 'abc'}
+        self.text = payload
+        self.content = payload.encode('utf-8')
+        self.closed = False
+        self._payload = payload
+
+    def json(self):
+        return json.loads(self._payload)
+
+    def iter_content(self, chunk_size=1):
+        return iter(chunked(self._payload, chunk_size))
+
+    def close(self):
+        self.closed = True
+
+class MockClient:
+
+    def __init__(self):
+        self.cancelled = []
+
+    def cancel_sql(self, query_id):
+        self.cancelled.append(query_id)
+        return True
+
+class TestRowStreamParser(unittest.TestCase):
+
+    def test_array(self):
+        rows = [{'a': i, 'b': 'xé' * i, 'c': [1.5, None, True]} for i in range(20)]
+        text = json.dumps(rows, indent=2)
+        for size in [1, 2, 7, 1000]:
+            self.assertEqual(rows, parse_all(RowStreamParser(), chunked(text, size)))
+
+    def test_empty(self):
+        self.assertEqual([], parse_all(RowStreamParser(), ['[', ' ]']))
+        parser = RowStreamParser(rows_key='results')
+        self.assertEqual([], parse_all(parser, ['{"results": []}']))
+        self.assertEqual({}, parser.trailer)
+
+    def test_trailer(self):
+        payload = {'context': {'n': 12, 's': 'x'}, 'results': [[1, 'a'], [2, 'b']], 'count': 12345}
+        text = json.dumps(payload)
+        for size in [1, 3, 1000]:
+            parser = RowStreamParser(rows_key='results')
+            self.assertEqual(payload['results'], parse_all(parser, chunked(text, size)))
+            self.assertEqual({'context': payload['context'], 'count': 12345}, parser.trailer)
+
+    def test_incremental(self):
+        parser = RowStreamParser()
+        self.assertEqual([], parser.feed('[{"a": 1'))
+        self.assertEqual([{'a': 1}], parser.feed('}, {"a"'))
+        self.assertEqual([{'a': 2}], parser.feed(': 2}]'))
+        self.assertTrue(parser.done())
+
+    def test_malformed(self):
+        parser = RowStreamParser()
+        parser.feed('[{"a": 1}, {"a": ')
+        with self.assertRaises(ValueError):
+            parser.close()
+        with self.assertRaises(ValueError):
+            RowStreamParser().feed('{"a": 1}')
+
+class TestSqlStreamResult(unittest.TestCase):
+
+    def test_object(self):
+        rows = [{'a': i, 'b': str(i)} for i in range(100)]
+        req = SqlRequest(None, 'SELECT 1')
+        result = SqlStreamResult(req, MockResponse(json.dumps(rows)), chunk_size=16)
+        self.assertEqual(['a', 'b'], [c.name for c in result.schema()])
+        self.assertEqual('abc', result.id())
+        batches = list(result.batches(30))
+        self.assertEqual([30, 30, 30, 10], [len(b) for b in batches])
+        self.assertEqual(rows, [row for b in batches for row in b])
+        self.assertEqual(100, result.row_count())
+
+    def test_array_headers(self):
+        payload = [['a', 'b'], ['LONG', 'STRING'], ['BIGINT', 'VARCHAR'], [1, 'x'], [2, 'y']]
+        req = SqlRequest(None, 'SELECT 1').with_format(consts.SQL_ARRAY).with_headers(sqlTypes=True, druidTypes=True)
+        result = SqlStreamResult(req, MockResponse(json.dumps(payload)), chunk_size=5)
+        schema = result.schema()
+        self.assertEqual(['a', 'b'], [c.name for c in schema])
+        self.assertEqual(['LONG', 'STRING'], [c.druid_type for c in schema])
+        self.assertEqual(['BIGINT', 'VARCHAR'], [c.sql_type for c in schema])
+        self.assertEqual([[1, 'x'], [2, 'y']], result.rows())
+        with self.assertRaises(Exception):
+            result.rows()
+
+    def test_trailer(self):
+        payload = {'results': [['a'], [1], [2]], 'context': {'x': 1}}
+        req = SqlRequest(None, 'SELECT 1').with_format(consts.SQL_ARRAY_WITH_TRAILER).with_headers()
+        result = SqlStreamResult(req, MockResponse(json.dumps(payload)), chunk_size=4)
+        self.assertEqual(['a'], [c.name for c in result.schema()])
+        self.assertEqual([[1], [2]], result.rows())
+        self.assertEqual({'context': {'x': 1}}, result.trailer())
+
+    def test_error(self):
+        req = SqlRequest(None, 'SELECT 1')
+        result = SqlStreamResult(req, MockResponse('{"error": "oops"}', 400))
+        self.assertFalse(result.ok())
+        self.assertEqual('oops', result.error_msg())
+        self.assertEqual([], result.rows())
+
+class TestCancellation(unittest.TestCase):
+
+    def test_query_id(self):
+        req = SqlRequest(None, 'SELECT 1').with_context({'a': 1}).with_timeout(2.5)
+        obj = req.to_request()
+        self.assertEqual(req.query_id, obj['context'][consts.SQL_QUERY_ID_KEY])
+        self.assertEqual(2500, obj['context'][consts.TIMEOUT_KEY])
+        self.assertEqual({'a': 1}, req.context)
+        first = req.query_id
+        req.to_request()
+        self.assertNotEqual(first, req.query_id)
+        req.with_query_id('mine')
+        self.assertEqual('mine', req.to_request()['context'][consts.SQL_QUERY_ID_KEY])
+        self.assertEqual('mine', req.query_id)
+
+    def test_early_close(self):
+        rows = [{'a': i} for i in range(100)]
+        client = MockClient()
+        req = SqlRequest(client, 'SELECT 1')
+        response = MockResponse(json.dumps(rows))
+        result = SqlStreamResult(req, response, chunk_size=8)
+        for row in result:
+            if row['a'] == 3:
+                break
+        self.assertEqual(['abc'], client.cancelled)
+        self.assertTrue(response.closed)
+
+        # Reading the entire result does not cancel.
+        result = SqlStreamResult(req, MockResponse(json.dumps(rows)), chunk_size=8)
+        with result:
+            self.assertEqual(rows, result.rows())
+        self.assertEqual(['abc'], client.cancelled)
+
+    def test_deadline(self):
+        client = MockClient()
+        req = SqlRequest(client, 'SELECT 1')
+        result = SqlStreamResult(req, MockResponse(json.dumps([{'a': 1}] * 10)), chunk_size=4, deadline=time.monotonic() - 1)
+        with self.assertRaises(QueryTimeoutError) as e:
+            result.rows()
+        self.assertEqual('abc', e.exception.query_id)
+        self.assertEqual(['abc'], client.cancelled)
@@ -0,0 +1,135 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import unittest
+from datetime import datetime
+import druid_client
+from druid_client.client.error import ClientError
+from druid_client.client.tail import TablePoller, tail_sql
+from druid_client.testing import FakeCluster
+
+def ts(second):
+    return '2022-01-01T00:00:{:02d}.000Z'.format(second)
+
+def table_handler(table, queries):
+    """
+    Serves the rows of `table` at or after the queried time, in time
+    order, up to the LIMIT.
+    """
+    def handler(sql, context):
+        queries.append(sql)
+        low = datetime.fromisoformat(re.search(r"TIMESTAMP '([^']+)'", sql).group(1))
+        limit = int(re.search(r'LIMIT (\d+)', sql).group(1))
+        rows = sorted((r for r in table if datetime.fromisoformat(r['__time'][:-1]) >= low), key=lambda r: r['__time'])
+        return rows[:limit]
+    return handler
+
+class TestTail(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCluster(brokers=1, masters=1, historicals=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def setUp(self):
+        self.rows = []
+        self.queries = []
+        self.delays = []
+        self.fake.sql_handler = table_handler(self.rows, self.queries)
+        self.client = druid_client.connect(self.fake.url())
+
+    def tearDown(self):
+        self.client.close()
+
+    def poller(self, **kwargs):
+        return TablePoller(self.client, 'wiki', start='2022-01-01T00:00:00Z', sleep=self.delays.append, **kwargs)
+
+    def add(self, *seconds):
+        self.rows.extend({'__time': ts(s), 'n': s} for s in seconds)
+
+    def test_sql(self):
+        self.assertEqual(
+            "SELECT \"__time\", \"n\" FROM \"wiki\" WHERE \"__time\" >= TIMESTAMP '2022-01-01 00:00:05' "
+            "AND (n > 1) ORDER BY \"__time\" LIMIT 10",
+            tail_sql('wiki', ['__time', 'n'], 'n > 1', datetime(2022, 1, 1, 0, 0, 5), 10))
+
+    def test_watermark(self):
+        poller = self.poller()
+        self.add(1, 2, 3)
+        self.assertEqual([1, 2, 3], [r['n'] for r in poller.poll()[0]])
+        self.assertEqual(datetime(2022, 1, 1, 0, 0, 3), poller.watermark)
+        # A second row at the watermark time is new; the first is not.
+        self.rows.append({'__time': ts(3), 'n': 33})
+        self.add(4)
+        self.assertEqual([33, 4], [r['n'] for r in poller.poll()[0]])
+        self.assertEqual(([], False), poller.poll())
+        self.assertIn("TIMESTAMP '2022-01-01 00:00:04'", self.queries[-1])
+
+    def test_lookback(self):
+        poller = self.poller(lookback=5)
+        self.add(1, 10)
+        poller.poll()
+        # Late rows: 7 is within the lookback, 2 is not.
+        self.add(2, 7, 11)
+        self.assertEqual([7, 11], [r['n'] for r in poller.poll()[0]])
+        self.assertIn("TIMESTAMP '2022-01-01 00:00:05'", self.queries[-1])
+        self.assertEqual(4, poller.returned)
+
+    def test_backoff(self):
+        def sleep(delay):
+            self.delays.append(delay)
+            # A row arrives during the fourth wait.
+            if len(self.delays) == 4:
+                self.add(8)
+        self.add(*range(1, 8))
+        poller = TablePoller(self.client, 'wiki', interval=1.0, start='2022-01-01T00:00:00Z',
+            max_rows=3, max_interval=4.0, sleep=sleep)
+        rows = poller.tail()
+        self.assertEqual(list(range(1, 8)), [next(rows)['n'] for _ in range(7)])
+        # Full polls run back to back.
+        self.assertEqual(3, len(self.queries))
+        self.assertEqual([], self.delays)
+        # Empty polls wait longer each time, up to the maximum.
+        self.assertEqual(8, next(rows)['n'])
+        self.assertEqual([2.0, 4.0, 4.0, 4.0], self.delays)
+        self.assertEqual(8, len(self.queries))
+        # After new rows, the wait is the base interval.
+        self.add(9)
+        self.assertEqual(9, next(rows)['n'])
+        self.assertEqual(1.0, self.delays[-1])
+
+    def test_table(self):
+        self.add(1)
+        rows = self.client.table('wiki').tail(['n'], start='2022-01-01T00:00:00Z')
+        self.assertEqual({'__time': ts(1), 'n': 1}, next(rows))
+        self.assertIn('SELECT "__time", "n" FROM "wiki"', self.queries[0])
+        rows.close()
+
+    def test_errors(self):
+        with self.assertRaises(ClientError):
+            self.client.table('wiki').tail(interval=0)
+        with self.assertRaises(ClientError):
+            self.poller(lookback=-1)
+        # Every row of a full poll is within the lookback window.
+        self.add(1, 2, 3)
+        poller = self.poller(lookback=60, max_rows=3)
+        with self.assertRaises(ClientError):
+            poller.poll()
+
+if __name__ == '__main__':
+    unittest.main()
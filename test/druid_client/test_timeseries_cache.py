@@ -0,0 +1,133 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import unittest
+from datetime import datetime, timedelta
+import druid_client
+from druid_client.client import consts
+from druid_client.client.error import ClientError
+from druid_client.client.timeseries_cache import TimeseriesCache, missing_runs
+from druid_client.testing import FakeCluster
+
+SQL = '''
+SELECT TIME_FLOOR("__time", 'PT1H') AS "__time", COUNT(*) AS "cnt"
+FROM wikipedia
+WHERE {time_range}
+GROUP BY 1
+'''
+
+def hourly_handler(queries):
+    """
+    Returns one row per hour from the start of the queried range, counting
+    the queries so far so that refetched buckets can be told apart.
+    """
+    def handler(sql, context):
+        queries.append(sql)
+        start, end = [datetime.fromisoformat(t) for t in re.findall(r"TIMESTAMP '([^']+)'", sql)]
+        rows = []
+        t = start.replace(minute=0)
+        while t < end:
+            # No data at 03:00.
+            if t.hour != 3:
+                rows.append({'__time': t.strftime('%Y-%m-%dT%H:%M:%S.000Z'), 'cnt': len(queries)})
+            t += timedelta(hours=1)
+        return rows
+    return handler
+
+class FakeTime:
+
+    def __init__(self):
+        self.clock = 0.0
+        self.now = datetime(2022, 1, 1, 6, 30)
+
+class TestTimeseriesCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCluster(brokers=1, masters=1, historicals=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def setUp(self):
+        self.queries = []
+        self.fake.sql_handler = hourly_handler(self.queries)
+        self.client = druid_client.connect(self.fake.url())
+        self.time = FakeTime()
+        self.cache = TimeseriesCache(self.client, open_ttl=10, sealed_ttl=3600,
+            clock=lambda: self.time.clock, now=lambda: self.time.now)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_runs(self):
+        starts = [datetime(2022, 1, 1, h) for h in range(5)]
+        self.assertEqual(
+            [(starts[0], starts[2]), (starts[3], datetime(2022, 1, 1, 5))],
+            missing_runs(starts, {starts[2]: []}, consts.HOUR_GRAIN))
+
+    def test_splice(self):
+        result = self.cache.query(SQL, '2022-01-01T02:00:00Z', '2022-01-01T05:00:00Z')
+        self.assertEqual((3, 0, 1), (result.buckets, result.cached, result.queries))
+        self.assertEqual(1, len(self.queries))
+        # Widening the range fetches only the buckets on either side.
+        result = self.cache.query(SQL, '2022-01-01T00:00:00Z', '2022-01-01T06:00:00Z')
+        self.assertEqual((6, 3, 2), (result.buckets, result.cached, result.queries))
+        self.assertEqual(3, len(self.queries))
+        self.assertNotIn("'2022-01-01 03:00:00'", self.queries[1] + self.queries[2])
+        times = [row['__time'] for row in result.rows()]
+        self.assertEqual(['2022-01-01T0{}:00:00.000Z'.format(h) for h in [0, 1, 2, 4, 5]], times)
+        # The middle buckets are from the first query.
+        counts = [row['cnt'] for row in result.rows()]
+        self.assertEqual([1, 1], counts[2:4])
+        self.assertNotIn(1, counts[:2] + counts[4:])
+        self.assertEqual(5, result.columnar().row_count())
+        # All cached, including the empty 03:00 bucket.
+        self.assertEqual(6, self.cache.query(SQL, '2022-01-01T00:00:00Z', '2022-01-01T06:00:00Z').cached)
+        self.assertEqual(3, len(self.queries))
+
+    def test_open_buckets(self):
+        self.cache.query(SQL, '2022-01-01T04:00:00Z', '2022-01-01T07:00:00Z')
+        self.time.clock += 11
+        # Only the 06:00 bucket is still open, and has expired.
+        result = self.cache.query(SQL, '2022-01-01T04:00:00Z', '2022-01-01T07:00:00Z')
+        self.assertEqual((2, 1), (result.cached, result.queries))
+        self.assertIn("'2022-01-01 06:00:00'", self.queries[-1])
+        self.time.clock += 3601
+        self.assertEqual(0, self.cache.query(SQL, '2022-01-01T04:00:00Z', '2022-01-01T07:00:00Z').cached)
+
+    def test_invalidate(self):
+        self.cache.query(SQL, '2022-01-01T00:00:00Z', '2022-01-01T04:00:00Z')
+        self.cache.invalidate('2022-01-01T01:30:00Z', '2022-01-01T02:00:00Z')
+        self.assertEqual(3, len(self.cache))
+        result = self.cache.query(SQL, '2022-01-01T00:00:00Z', '2022-01-01T04:00:00Z')
+        self.assertEqual((3, 1), (result.cached, result.queries))
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+    def test_errors(self):
+        with self.assertRaises(ClientError):
+            self.cache.query('SELECT * FROM wikipedia', '2022-01-01T00:00:00Z', '2022-01-01T01:00:00Z')
+        with self.assertRaises(ClientError):
+            self.cache.query(SQL, '2022-01-01T00:00:00Z', '2022-01-01T01:00:00Z', grain='fortnight')
+        with self.assertRaises(ClientError):
+            self.cache.query(SQL, '2022-01-01T01:00:00Z', '2022-01-01T00:00:00Z')
+        # Rows bucketed by hour do not fit a cache by minute.
+        with self.assertRaises(ClientError):
+            self.cache.query(SQL, '2022-01-01T00:10:00Z', '2022-01-01T00:20:00Z', grain=consts.MINUTE_GRAIN)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from druid_client.client.config import ClusterConfig
+from druid_client.cluster.cluster import Cluster
+from druid_client.cluster.watcher import NODE_ADDED, NODE_REMOVED, LEADER_CHANGED
+from druid_client.client import consts
+
+def server(host, port, role, leader=None):
+    return {
+        'server': '{}:{}'.format(host, port),
+        'host': host,
+        'plaintext_port': port,
+        'tls_port': -1,
+        'server_type': role,
+        'tier': None,
+        'curr_size': 0,
+        'max_size': 0,
+        'is_leader': leader,
+        }
+
+class MockClient:
+
+    def __init__(self, config, servers):
+        self.cluster_config = config
+        self.servers = servers
+        self.queries = 0
+
+    def sql(self, sql):
+        self.queries += 1
+        return list(self.servers)
+
+class TestTopologyCache(unittest.TestCase):
+
+    def make_cluster(self, ttl):
+        config = ClusterConfig({'topology_ttl': ttl})
+        client = MockClient(config, [
+            server('coord', 8081, consts.COORDINATOR, 1),
+            server('broker1', 8082, consts.BROKER),
+            ])
+        return client, Cluster(client)
+
+    def test_cached(self):
+        client, cluster = self.make_cluster(60)
+        self.assertEqual(1, client.queries)
+        for _ in range(5):
+            self.assertEqual(1, len(cluster.for_role(consts.BROKER)))
+        self.assertEqual(1, client.queries)
+
+        # A connection failure to a known node invalidates the cache.
+        client.servers.append(server('broker2', 8082, consts.BROKER))
+        client.cluster_config.node_failed('http://unknown:8082')
+        self.assertEqual(1, len(cluster.for_role(consts.BROKER)))
+        client.cluster_config.node_failed('http://broker1:8082')
+        self.assertEqual(2, len(cluster.for_role(consts.BROKER)))
+        self.assertEqual(2, client.queries)
+
+    def test_no_cache(self):
+        client, cluster = self.make_cluster(0)
+        cluster.for_role(consts.BROKER)
+        cluster.for_role(consts.BROKER)
+        self.assertEqual(3, client.queries)
+
+    def test_background_refresh(self):
+        client, cluster = self.make_cluster(0.01)
+        time.sleep(0.02)
+        client.servers.append(server('broker2', 8082, consts.BROKER))
+
+        # The expired topology is served while the refresh runs.
+        cluster.for_role(consts.BROKER)
+        for _ in range(100):
+            if not cluster._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(2, client.queries)
+        self.assertEqual(3, len(cluster._services))
+        self.assertEqual(3, len(cluster.servers()))
+
+class TestTopologyEvents(unittest.TestCase):
+
+    def test_events(self):
+        config = ClusterConfig({'topology_ttl': 60})
+        client = MockClient(config, [
+            server('coord1', 8081, consts.COORDINATOR, 1),
+            server('coord2', 8081, consts.COORDINATOR, 0),
+            server('broker1', 8082, consts.BROKER),
+            ])
+        cluster = Cluster(client)
+        events = []
+        cluster.subscribe(events.append)
+        cluster.refresh()
+        self.assertEqual([], events)
+
+        client.servers = [
+            server('coord1', 8081, consts.COORDINATOR, 0),
+            server('coord2', 8081, consts.COORDINATOR, 1),
+            server('broker2', 8082, consts.BROKER),
+            ]
+        cluster.refresh()
+        self.assertEqual(
+            [(NODE_REMOVED, 'http://broker1:8082', None),
+             (NODE_ADDED, 'http://broker2:8082', None),
+             (LEADER_CHANGED, 'http://coord2:8081', consts.COORDINATOR)],
+            [(e.kind, e.url(), e.role) for e in events])
+
+    def test_watcher(self):
+        config = ClusterConfig({'topology_ttl': 60})
+        client = MockClient(config, [server('broker1', 8082, consts.BROKER)])
+        cluster = Cluster(client)
+        events = []
+        cluster.subscribe(events.append)
+        cluster.watch(0.01)
+        client.servers = client.servers + [server('broker2', 8082, consts.BROKER)]
+        for _ in range(100):
+            if events:
+                break
+            time.sleep(0.01)
+        cluster.stop_watching()
+        self.assertEqual([NODE_ADDED], [e.kind for e in events])
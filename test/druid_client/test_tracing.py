@@ -0,0 +1,155 @@
+# Copyright 2022 Paul Rogers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import druid_client
+from druid_client.client.config import ClusterConfig
+from druid_client.client.client import Client
+from druid_client.client.tracing import Tracer, InMemoryExporter, JsonLinesExporter, NULL_SPAN, current_span
+from druid_client.testing import FakeCluster
+
+class SqlHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.traceparents.append(self.headers.get('traceparent'))
+        body = json.dumps([{'EXPR$0': 1}]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Druid-SQL-Query-Id', query['context']['sqlQueryId'])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class TestSpans(unittest.TestCase):
+
+    def test_disabled(self):
+        tracer = Tracer()
+        self.assertIs(NULL_SPAN, tracer.span('op'))
+        with tracer.span('op', table='wiki') as span:
+            span.set('rows', 10)
+        self.assertIsNone(current_span())
+
+    def test_nesting(self):
+        exporter = InMemoryExporter()
+        tracer = Tracer([exporter])
+        with tracer.span('outer', table='wiki') as outer:
+            with tracer.span('inner') as inner:
+                self.assertIs(inner, current_span())
+            with self.assertRaises(ValueError):
+                with tracer.span('failed'):
+                    raise ValueError('bad')
+            self.assertIs(outer, current_span())
+        self.assertIsNone(current_span())
+        self.assertEqual(['inner', 'failed', 'outer'], [s.name for s in exporter.spans])
+        inner, failed, outer = exporter.spans
+        self.assertIsNone(outer.parent_id)
+        self.assertEqual(outer.span_id, inner.parent_id)
+        self.assertEqual(outer.trace_id, failed.trace_id)
+        self.assertEqual('ValueError: bad', failed.error)
+        self.assertEqual({'table': 'wiki'}, outer.attributes)
+        self.assertEqual('outer', exporter.format_tree().split('\n')[0].split(' ')[0])
+        self.assertEqual(2, len(exporter.children(outer)))
+
+    def test_json_lines(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'spans.jsonl')
+            tracer = Tracer([JsonLinesExporter(path)])
+            with tracer.span('outer'):
+                with tracer.span('inner', task_id='t1'):
+                    pass
+            with open(path) as f:
+                spans = [json.loads(line) for line in f]
+        self.assertEqual(['inner', 'outer'], [s['name'] for s in spans])
+        self.assertEqual('t1', spans[0]['attributes']['task_id'])
+        self.assertEqual(spans[1]['span_id'], spans[0]['parent_id'])
+
+class TestClientSpans(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), SqlHandler)
+        cls.server.traceparents = []
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_sql_spans(self):
+        exporter = InMemoryExporter()
+        client = Client(ClusterConfig({'tracing': exporter}), self.url)
+        with client.tracer().span('workflow') as root:
+            client.sql('SELECT 1')
+            client.sql_many(['SELECT 1', 'SELECT 2'], max_concurrency=2)
+        queries = exporter.find('sql.query')
+        self.assertEqual(3, len(queries))
+        for query in queries:
+            self.assertEqual(root.span_id, query.parent_id)
+            self.assertEqual(root.trace_id, query.trace_id)
+            self.assertTrue(query.attributes['ok'])
+            http = exporter.children(query)
+            self.assertEqual(1, len(http))
+            self.assertEqual('/druid/v2/sql', http[0].attributes['template'])
+        self.assertEqual(3, len(set(q.attributes['query_id'] for q in queries)))
+        for header in self.server.traceparents[-3:]:
+            self.assertTrue(header.startswith('00-' + root.trace_id + '-'))
+        client.close()
+
+class TestClusterSpans(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCluster(brokers=1, masters=1, historicals=0, task_duration=0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def run_workflow(self, client):
+        cluster = client.cluster()
+        task = cluster.ingest({'type': 'index_parallel', 'spec': {'dataSchema': {'dataSource': 'wiki'}}})
+        self.assertTrue(task.join(poll_secs=0.02))
+        self.assertEqual(['wikipedia'], cluster.metadata().table_names())
+        return task
+
+    def test_untraced(self):
+        client = druid_client.connect(self.fake.url())
+        self.run_workflow(client)
+        client.close()
+
+    def test_traced(self):
+        exporter = InMemoryExporter()
+        client = druid_client.connect(self.fake.url(), tracing=exporter)
+        task = self.run_workflow(client)
+        ingest = exporter.find('cluster.ingest')[0]
+        self.assertEqual('wiki', ingest.attributes['table'])
+        self.assertEqual(task.id(), ingest.attributes['task_id'])
+        self.assertEqual(task.id(), exporter.find('task.join')[0].attributes['task_id'])
+        self.assertEqual(1, exporter.find('metadata.table_names')[0].attributes['tables'])
+        client.close()
+
+if __name__ == '__main__':
+    unittest.main()